@@ -1,10 +1,20 @@
 from django.contrib import admin
+from django.utils import timezone
 from django.utils.html import format_html
-from django.urls import path
+from django.urls import path, reverse
 from django.shortcuts import redirect
 from django.contrib import messages
-from django.http import HttpResponse
-from .models import MFO, Offer, VKUser, PushNotification, PushLog
+from django.http import HttpResponse, FileResponse, Http404, JsonResponse
+from django.conf import settings
+from .models import MFO, Offer, VKUser, PushNotification, PushLog, RequestProfile, UTMTracking
+from .admin_tools import EstimatedCountPaginator, cached_facet_filter
+from .search import search_users, utm_q
+from .rules import parse_birth_date
+from .personalization import compile_message
+from .services import VK_MAX_USER_IDS
+from .segments import SegmentIndexNotReady, estimate_segment, invalidate_segment_index, targeting_rule
+from .tracking import decode_payload
+import os
 
 # Убираем регистрацию Offer из админки
 # @admin.register(Offer)
@@ -19,16 +29,17 @@ from .models import MFO, Offer, VKUser, PushNotification, PushLog
 # Улучшенная админка МФО с подробными параметрами
 @admin.register(MFO)
 class MFOAdmin(admin.ModelAdmin):
-    list_display = ('name', 'rate', 'approval_chance', 'sum_min', 'sum_max', 'term_min', 'term_max', 'payout_speed_hours')
-    list_editable = ('rate', 'approval_chance', 'payout_speed_hours')
-    search_fields = ('name', 'requirements', 'get_methods', 'repay_methods')
+    list_display = ('name', 'is_active', 'rate', 'approval_chance', 'sum_min', 'sum_max', 'term_min', 'term_max', 'payout_speed_hours', 'source', 'synced_at')
+    list_editable = ('is_active', 'rate', 'approval_chance', 'payout_speed_hours')
+    search_fields = ('name', 'external_id', 'requirements', 'get_methods', 'repay_methods')
     ordering = ('-approval_chance', 'name')
-    list_filter = ('rate', 'approval_chance', 'payout_speed_hours')
+    list_filter = ('is_active', 'source', 'rate', 'approval_chance', 'payout_speed_hours')
+    readonly_fields = ('external_id', 'source', 'synced_at', 'updated_at', 'logo_file', 'logo_source')
     
     # Группируем поля по категориям
     fieldsets = (
         ('Основная информация', {
-            'fields': ('name', 'logo_url', 'link')
+            'fields': ('name', 'logo_url', 'logo_file', 'logo_source', 'link')
         }),
         ('Финансовые параметры', {
             'fields': ('sum_min', 'sum_max', 'term_min', 'term_max', 'rate'),
@@ -43,6 +54,10 @@ class MFOAdmin(admin.ModelAdmin):
             'description': 'Требования и способы получения/погашения (через точку с запятой)',
             'classes': ('collapse',)
         }),
+        ('Витрина', {
+            'fields': ('is_active', 'promo_text', 'sort_order', 'external_id', 'source', 'synced_at', 'updated_at'),
+            'description': 'Поля партнера перезаписываются синхронизацией (sync_mfo_catalog), если оффер изменился в витрине'
+        }),
     )
     
     # Добавляем подсказки для полей
@@ -59,18 +74,25 @@ class MFOAdmin(admin.ModelAdmin):
 @admin.register(VKUser)
 class VKUserAdmin(admin.ModelAdmin):
     list_display = ('vk_user_id', 'full_name', 'city', 'sex_display', 'notifications_status', 'last_visit', 'total_visits', 'utm_source')
-    list_filter = ('notifications_enabled', 'notifications_allowed', 'sex', 'city', 'utm_source', 'first_visit', 'last_visit')
+    list_filter = (
+        'notifications_enabled', 'notifications_allowed', 'sex',
+        cached_facet_filter('city', 'Город'), cached_facet_filter('utm_source', 'UTM Source'),
+        'first_visit', 'last_visit',
+    )
     search_fields = ('vk_user_id', 'first_name', 'last_name', 'city', 'utm_source', 'utm_campaign')
-    readonly_fields = ('vk_user_id', 'first_visit', 'total_visits', 'extra_data_display')
-    ordering = ['-last_visit']
-    date_hierarchy = 'first_visit'
+    search_help_text = "VK ID, слова из имени/фамилии/города или utm:часть_кампании"
+    readonly_fields = ('vk_user_id', 'first_visit', 'last_visit', 'total_visits', 'extra_data_display', 'birth_date', 'vk_city_id', 'vk_country_id')
+    # Таблица на миллионы строк: индексированная сортировка и оценочный счетчик
+    ordering = ['-last_visit', '-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('vk_user_id', 'first_name', 'last_name', 'sex', 'bdate')
+            'fields': ('vk_user_id', 'first_name', 'last_name', 'sex', 'bdate', 'birth_date')
         }),
         ('Геолокация', {
-            'fields': ('city', 'country')
+            'fields': ('city', 'country', 'vk_city_id', 'vk_country_id')
         }),
         ('Настройки уведомлений', {
             'fields': ('notifications_enabled', 'notifications_allowed'),
@@ -90,6 +112,11 @@ class VKUserAdmin(admin.ModelAdmin):
         }),
     )
     
+    def save_model(self, request, obj, form, change):
+        # Производная колонка таргетинга (api/rules.py) следует за bdate
+        obj.birth_date = parse_birth_date(obj.bdate)
+        super().save_model(request, obj, form, change)
+    
     def full_name(self, obj):
         return f"{obj.first_name} {obj.last_name}".strip() or "—"
     full_name.short_description = "Имя"
@@ -115,15 +142,26 @@ class VKUserAdmin(admin.ModelAdmin):
         return format_html('<pre>{}</pre>', json.dumps(obj.extra_data, indent=2, ensure_ascii=False))
     extra_data_display.short_description = "Дополнительные данные"
     
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.startswith('utm:'):
+            term = search_term[len('utm:'):]
+            return queryset.filter(utm_q('utm_source', term) | utm_q('utm_campaign', term)), False
+        return search_users(queryset, search_term), False
+    
     actions = ['enable_notifications', 'disable_notifications']
     
     def enable_notifications(self, request, queryset):
         updated = queryset.update(notifications_enabled=True)
+        invalidate_segment_index()  # update() не меняет last_visit - индекс аудитории строится заново
         self.message_user(request, f"Уведомления включены для {updated} пользователей", messages.SUCCESS)
     enable_notifications.short_description = "✅ Включить уведомления"
     
     def disable_notifications(self, request, queryset):
         updated = queryset.update(notifications_enabled=False)
+        invalidate_segment_index()  # update() не меняет last_visit - индекс аудитории строится заново
         self.message_user(request, f"Уведомления отключены для {updated} пользователей", messages.WARNING)
     disable_notifications.short_description = "❌ Отключить уведомления"
 
@@ -133,11 +171,70 @@ class PushNotificationAdmin(admin.ModelAdmin):
     list_display = ('title', 'status', 'segment', 'total_sent', 'total_delivered', 'created_at')
     list_filter = ('status', 'segment', 'created_at')
     search_fields = ('title', 'message')
-    readonly_fields = ('total_sent', 'total_delivered', 'total_failed', 'total_clicked', 'sent_at', 'created_at', 'updated_at')
+    readonly_fields = ('audience_estimate', 'total_sent', 'total_delivered', 'total_failed', 'total_clicked', 'total_capped', 'sent_at', 'retry_requested_at', 'created_at', 'updated_at')
     filter_horizontal = ('target_users',)
     ordering = ['-created_at']
     
-    actions = ['send_now', 'duplicate_notification']
+    actions = ['send_now', 'retry_failed', 'duplicate_notification']
+    
+    class Media:
+        # Пересчет получателей при изменении сегмента и фильтров в форме
+        js = ('api/push_audience.js',)
+    
+    def get_urls(self):
+        urls = [
+            path('estimate/', self.admin_site.admin_view(self.estimate_view), name='api_pushnotification_estimate'),
+        ]
+        return urls + super().get_urls()
+    
+    def estimate_view(self, request):
+        """Количество получателей по полям формы (индекс аудитории, api/segments.py)"""
+        import json
+        
+        if request.method != 'POST':
+            return JsonResponse({'error': 'Ожидается POST'}, status=405)
+        sex = request.POST.get('filter_sex', '')
+        audience_rule = request.POST.get('audience_rule', '').strip()
+        # Лимиты частоты из формы (пустое поле - значение по умолчанию)
+        caps = {
+            name: int(request.POST[name]) if request.POST.get(name, '').isdigit() else None
+            for name in ('cap_interval_hours', 'cap_per_day')
+        }
+        try:
+            rule = targeting_rule(
+                request.POST.get('segment', 'all'),
+                [int(pk) for pk in request.POST.getlist('target_users') if pk.isdigit()],
+                request.POST.get('filter_city', '').strip(),
+                int(sex) if sex.isdigit() else None,
+                request.POST.get('filter_utm_source', '').strip(),
+                json.loads(audience_rule) if audience_rule and audience_rule != 'null' else None,
+            )
+            return JsonResponse(estimate_segment(rule, PushNotification(**caps)))
+        except SegmentIndexNotReady as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Текст уже проверен в PushNotification.clean
+        fields = compile_message(obj.message).unique_fields
+        if fields:
+            placeholders = ', '.join(f'{{{field}}}' for field in fields)
+            self.message_user(
+                request,
+                f'⚠️ "{obj.title}": {placeholders} делает текст почти уникальным для каждого получателя - '
+                f'пуш уйдет вызовами VK по одному ID вместо {VK_MAX_USER_IDS}: отправка дольше и ближе к flood control',
+                messages.WARNING
+            )
+    
+    def audience_estimate(self, obj):
+        # Считает push_audience.js через estimate_view: форма открывается без обращения к индексу
+        return format_html(
+            '<span id="push-audience-estimate" data-url="{}">—</span>',
+            reverse('admin:api_pushnotification_estimate'),
+        )
+    audience_estimate.short_description = "Получателей"
     
     def send_now(self, request, queryset):
         """Отправить уведомления немедленно"""
@@ -145,7 +242,17 @@ class PushNotificationAdmin(admin.ModelAdmin):
         error_count = 0
         
         for notification in queryset:
-            if notification.status in ['draft', 'scheduled']:
+            if notification.status in ['draft', 'scheduled'] and notification.is_paced:
+                # Равномерная отправка идет дольше запроса админки: ее выполнит send_scheduled_pushes
+                notification.status = 'scheduled'
+                notification.scheduled_time = timezone.now()
+                notification.save(update_fields=['status', 'scheduled_time', 'updated_at'])
+                self.message_user(
+                    request,
+                    f'⏳ "{notification.title}": равномерная отправка поставлена в очередь send_scheduled_pushes',
+                    messages.INFO
+                )
+            elif notification.status in ['draft', 'scheduled']:
                 # Импортируем и вызываем функцию отправки
                 from .services import send_push_notification
                 try:
@@ -153,7 +260,7 @@ class PushNotificationAdmin(admin.ModelAdmin):
                     success_count += 1
                     self.message_user(
                         request, 
-                        f'✅ "{notification.title}": отправлено {stats.get("sent", 0)}, доставлено {stats.get("delivered", 0)}, ошибок {stats.get("failed", 0)}',
+                        f'✅ "{notification.title}": отправлено {stats.get("sent", 0)}, доставлено {stats.get("delivered", 0)}, ошибок {stats.get("failed", 0)} (можно повторить {stats.get("retryable", 0)}), пропущено по лимиту частоты {stats.get("capped", 0)}',
                         messages.SUCCESS
                     )
                 except Exception as e:
@@ -169,6 +276,25 @@ class PushNotificationAdmin(admin.ModelAdmin):
     
     send_now.short_description = "📤 Отправить сейчас"
     
+    def retry_failed(self, request, queryset):
+        """Поставить повтор получателям с временными ошибками в очередь retry_failed_pushes (api/retries.py)"""
+        from .retries import retryable_logs
+        
+        for notification in queryset:
+            if notification.status != 'sent':
+                self.message_user(request, f'⚠️ "{notification.title}" еще не отправлено', messages.WARNING)
+                continue
+            # Повтор с паузами после flood control идет дольше запроса админки
+            notification.retry_requested_at = timezone.now()
+            notification.save(update_fields=['retry_requested_at', 'updated_at'])
+            self.message_user(
+                request,
+                f'⏳ "{notification.title}": повтор {retryable_logs(notification).count()} ошибок поставлен в очередь retry_failed_pushes',
+                messages.INFO
+            )
+    
+    retry_failed.short_description = "🔁 Повторить для ошибок"
+    
     def duplicate_notification(self, request, queryset):
         """Дублировать уведомление"""
         for notification in queryset:
@@ -179,7 +305,9 @@ class PushNotificationAdmin(admin.ModelAdmin):
             notification.total_delivered = 0
             notification.total_failed = 0
             notification.total_clicked = 0
+            notification.total_capped = 0
             notification.sent_at = None
+            notification.retry_requested_at = None
             notification.save()
         self.message_user(request, f"Создано копий: {queryset.count()}", messages.SUCCESS)
     duplicate_notification.short_description = "📋 Дублировать"
@@ -188,11 +316,22 @@ class PushNotificationAdmin(admin.ModelAdmin):
 @admin.register(PushLog)
 class PushLogAdmin(admin.ModelAdmin):
     list_display = ('notification', 'user_info', 'status_badge', 'sent_at', 'clicked_at')
-    list_filter = ('status', 'sent_at', 'notification')
-    search_fields = ('notification__title', 'user__vk_user_id', 'user__first_name', 'user__last_name')
-    readonly_fields = ('notification', 'user', 'status', 'sent_at', 'clicked_at', 'vk_response_display', 'error_message')
-    ordering = ['-sent_at']
-    date_hierarchy = 'sent_at'
+    list_filter = ('status', 'retryable', 'sent_at', 'notification')
+    search_fields = ('user__vk_user_id', 'notification__title')
+    search_help_text = "VK ID пользователя или название уведомления"
+    list_select_related = ('notification', 'user')
+    readonly_fields = ('notification', 'user', 'status', 'sent_at', 'clicked_at', 'vk_response_display', 'error_message', 'error_code', 'retryable', 'attempts')
+    ordering = ['-sent_at', '-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(user__vk_user_id=int(search_term)), False
+        return queryset.filter(notification__title__icontains=search_term), False
     
     def user_info(self, obj):
         return f"{obj.user.first_name} {obj.user.last_name} (VK ID: {obj.user.vk_user_id})"
@@ -219,3 +358,87 @@ class PushLogAdmin(admin.ModelAdmin):
     
     def has_add_permission(self, request):
         return False  # Логи создаются автоматически
+
+
+
+
+@admin.register(UTMTracking)
+class UTMTrackingAdmin(admin.ModelAdmin):
+    list_display = ('timestamp', 'user_id', 'event_type', 'utm_source', 'utm_campaign', 'vk_platform')
+    list_select_related = ('event_type', 'utm_source', 'utm_campaign', 'vk_platform')
+    list_filter = (
+        cached_facet_filter('event_type__value', 'Тип события'), cached_facet_filter('utm_source__value', 'UTM Source'),
+        cached_facet_filter('utm_campaign__value', 'UTM Campaign'), cached_facet_filter('vk_platform__value', 'VK Platform'),
+        'timestamp',
+    )
+    search_fields = ('user_id',)
+    search_help_text = "VK ID пользователя (точное совпадение)"
+    readonly_fields = [field.name for field in UTMTracking._meta.fields if field.name != 'payload'] + ['payload_display']
+    ordering = ['-timestamp', '-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def payload_display(self, obj):
+        import json
+        return format_html('<pre>{}</pre>', json.dumps(decode_payload(obj.payload), indent=2, ensure_ascii=False))
+    payload_display.short_description = "Исходные данные"
+    
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if not search_term.isdigit():
+            return queryset.none(), False
+        return queryset.filter(user_id=int(search_term)), False
+    
+    def has_add_permission(self, request):
+        return False  # События создаются API
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'status_code', 'duration_ms', 'sql_count', 'sql_ms', 'http_count', 'http_ms', 'requested_by', 'files')
+    list_filter = ('method', 'status_code')
+    search_fields = ('path', 'view_name')
+    readonly_fields = [field.name for field in RequestProfile._meta.fields] + ['files']
+    ordering = ['-created_at']
+
+    def get_urls(self):
+        urls = [
+            path('<str:profile_id>/download/<str:kind>/', self.admin_site.admin_view(self.download_view), name='api_requestprofile_download'),
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, profile_id, kind):
+        """Скачать flamegraph (.folded) или хронологию SQL/HTTP (.json)"""
+        if kind not in ('folded', 'json') or not RequestProfile.objects.filter(profile_id=profile_id).exists():
+            raise Http404
+        file_path = os.path.join(settings.PROFILE_DIR, f'{profile_id}.{kind}')
+        if not os.path.exists(file_path):
+            raise Http404
+        return FileResponse(open(file_path, 'rb'), as_attachment=True, filename=f'{profile_id}.{kind}')
+
+    def files(self, obj):
+        return format_html(
+            '<a href="{}">🔥 flamegraph</a> | <a href="{}">🗂 SQL/HTTP</a>',
+            reverse('admin:api_requestprofile_download', args=[obj.profile_id, 'folded']),
+            reverse('admin:api_requestprofile_download', args=[obj.profile_id, 'json']),
+        )
+    files.short_description = "Файлы"
+
+    def delete_model(self, request, obj):
+        self.delete_files([obj])
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        self.delete_files(queryset)
+        super().delete_queryset(request, queryset)
+
+    def delete_files(self, profiles):
+        for profile in profiles:
+            for kind in ('folded', 'json'):
+                file_path = os.path.join(settings.PROFILE_DIR, f'{profile.profile_id}.{kind}')
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+    def has_add_permission(self, request):
+        return False  # Профили создаются middleware
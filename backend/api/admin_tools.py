@@ -0,0 +1,89 @@
+"""
+Инструменты админки для больших таблиц (миллионы строк)
+
+EstimatedCountPaginator - количество строк без полного COUNT(*):
+    без фильтров - оценка планировщика PostgreSQL (pg_class.reltuples),
+    с фильтрами - COUNT по подзапросу с LIMIT ADMIN_COUNT_LIMIT.
+cached_facet_filter - фильтр по текстовому полю, список значений которого
+    (самые частые ADMIN_FACET_LIMIT) считается раз в ADMIN_FACET_CACHE_TTL секунд.
+"""
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count
+from django.utils.functional import cached_property
+
+ADMIN_COUNT_LIMIT = 10000
+ADMIN_FACET_LIMIT = 50
+
+
+def estimated_table_rows(model):
+    """
+    Оценка количества строк таблицы по статистике PostgreSQL или None
+    """
+    connection = connections[model.objects.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples = -1, если таблица еще не анализировалась
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator без точного COUNT(*) по всей таблице
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_table_rows(queryset.model)
+            if estimate is not None and estimate > ADMIN_COUNT_LIMIT:
+                return estimate
+        return queryset[:ADMIN_COUNT_LIMIT].count()
+
+
+def get_facet_values(model, field):
+    """
+    Самые частые значения поля (кэшируются)
+    """
+    cache_key = f'admin:facets:{model._meta.label_lower}:{field}'
+
+    def compute():
+        rows = (
+            model.objects.exclude(**{field: ''})
+            .values(field)
+            .annotate(total=Count('pk'))
+            .order_by('-total')[:ADMIN_FACET_LIMIT]
+        )
+        return [row[field] for row in rows if row[field] is not None]
+
+    return cache.get_or_set(cache_key, compute, settings.ADMIN_FACET_CACHE_TTL)
+
+
+def cached_facet_filter(field, title):
+    """
+    Фильтр админки по текстовому полю без SELECT DISTINCT на каждой загрузке страницы
+    """
+
+    class CachedFacetFilter(admin.SimpleListFilter):
+        parameter_name = field
+
+        def lookups(self, request, model_admin):
+            return [(value, value) for value in get_facet_values(model_admin.model, field)]
+
+        def queryset(self, request, queryset):
+            if self.value():
+                return queryset.filter(**{field: self.value()})
+            return queryset
+
+    CachedFacetFilter.title = title
+    CachedFacetFilter.__name__ = f'{field.title().replace("_", "")}FacetFilter'
+    return CachedFacetFilter
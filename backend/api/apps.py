@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Метрики и бюджеты SQL учитывают запросы из любого потока (api/middleware.py)
+        from .middleware import install_request_sql_dispatch
+        connection_created.connect(install_request_sql_dispatch, dispatch_uid='api_request_sql_dispatch')
@@ -0,0 +1,152 @@
+"""
+Асинхронные версии представлений с внешними HTTP запросами
+
+Используются при запуске под ASGI (uvicorn), когда включен ASYNC_VIEWS.
+Пока ждем ответа партнера, воркер обслуживает другие запросы, поэтому
+один процесс держит сотни одновременных обращений к leads.tech.
+"""
+import asyncio
+import json
+import logging
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from django_ratelimit.core import is_ratelimited
+from django_ratelimit.exceptions import Ratelimited
+
+from .catalog import get_catalog, get_catalog_index, parse_catalog_query, query_catalog
+from .metrics import observe_upstream
+from .models import MFO
+from .tracking import acreate_tracking
+from .partners import (
+    get_client_ip, build_leads_tech_data, build_leads_tech_params, build_leads_tech_url,
+    leads_tech_request_headers, build_arbitrage_tracking,
+)
+
+logger = logging.getLogger(__name__)
+
+# HTTP клиент с пулом соединений, отдельный для каждого event loop
+_clients = {}
+
+
+def get_async_client():
+    """
+    Общий httpx.AsyncClient для текущего event loop
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=10,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        )
+        _clients[loop] = client
+    return client
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, safe=False, json_dumps_params={'ensure_ascii': False})
+
+
+def parse_request_data(request):
+    """
+    Тело запроса: JSON или form-data, как в request.data у DRF
+    """
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST.dict()
+
+
+@csrf_exempt
+@require_GET
+async def mfo_list_async(request):
+    """
+    Получение списка МФО из локального каталога (async)
+    
+    Параметры подбора - как у синхронной версии (mfo_list).
+    """
+    try:
+        catalog_query = parse_catalog_query(request.GET)
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    
+    if catalog_query is not None:
+        index = await sync_to_async(get_catalog_index)()
+        return json_response(query_catalog(index, catalog_query))
+    return json_response(await sync_to_async(get_catalog)())
+
+
+@csrf_exempt
+@require_POST
+async def send_to_leads_tech_async(request):
+    """
+    Отправляет данные пользователя и UTM метки в leads.tech (async)
+    """
+    # Та же группа, что у синхронной версии, чтобы лимит был общим
+    limited = await sync_to_async(is_ratelimited)(
+        request=request, group='api.views.send_to_leads_tech',
+        key='ip', rate='100/h', method='POST', increment=True,
+    )
+    if limited:
+        raise Ratelimited()
+
+    try:
+        data = parse_request_data(request)
+
+        leads_tech_data = build_leads_tech_data(data, get_client_ip(request))
+        leads_tech_params = build_leads_tech_params(data)
+
+        logger.info(f"🔍 [Leads.Tech] Параметры: {leads_tech_params}")
+
+        offer_id = data.get('offer_id')
+        leads_tech_url = settings.LEADS_TECH_FALLBACK_URL
+
+        if offer_id:
+            try:
+                mfo = await MFO.objects.aget(id=offer_id)
+                leads_tech_url = mfo.link
+            except MFO.DoesNotExist:
+                logger.warning(f"⚠️ [Leads.Tech] MFO с ID {offer_id} не найдено. Используем fallback URL.")
+        else:
+            logger.warning("⚠️ [Leads.Tech] offer_id не предоставлен. Используем fallback URL.")
+
+        leads_tech_params_url = build_leads_tech_url(leads_tech_url, leads_tech_params)
+
+        try:
+            with observe_upstream('leads_tech'):
+                leads_tech_response = await get_async_client().get(
+                    leads_tech_params_url,
+                    headers=leads_tech_request_headers(data),
+                )
+
+            if leads_tech_response.status_code == 200:
+                logger.info(f"✅ [Leads.Tech] Успешно отправлено: {leads_tech_response.status_code}")
+            else:
+                logger.error(f"⚠️ [Leads.Tech] Ошибка: {leads_tech_response.status_code} - {leads_tech_response.text}")
+
+        except httpx.HTTPError as leads_error:
+            logger.error(f"⚠️ [Leads.Tech] Ошибка соединения: {leads_error}")
+
+        utm_tracking = await acreate_tracking(build_arbitrage_tracking(data))
+
+        return json_response({
+            'success': True,
+            'message': 'Данные отправлены в leads.tech',
+            'tracking_id': utm_tracking.id,
+            'leads_tech_data': leads_tech_data,
+            'leads_tech_params': leads_tech_params,
+            'leads_tech_url': leads_tech_params_url,
+            'timestamp': utm_tracking.timestamp.isoformat()
+        })
+
+    except Exception:
+        logger.exception("Непредвиденная ошибка в send_to_leads_tech_async")
+        return json_response({
+            'success': False,
+            'error': 'Internal Server Error'
+        }, status=500)
@@ -0,0 +1,185 @@
+"""
+Микробенчмарки горячих путей API
+
+Каждый бенчмарк выполняется в транзакции, которая откатывается в конце,
+поэтому данные в базе не меняются. Результаты - словари, пригодные для JSON,
+чтобы регрессии было видно в цифрах.
+"""
+import random
+import statistics
+import time
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from .models import VKUser, UTMTracking, PushNotification, PushLog
+
+
+class Rollback(Exception):
+    pass
+
+
+def summarize(name, timings, queries, **extra):
+    timings_ms = sorted(t * 1000 for t in timings)
+    result = {
+        'name': name,
+        'iterations': len(timings_ms),
+        'total_ms': round(sum(timings_ms), 3),
+        'mean_ms': round(statistics.mean(timings_ms), 3) if timings_ms else 0,
+        'p50_ms': round(timings_ms[len(timings_ms) // 2], 3) if timings_ms else 0,
+        'p95_ms': round(timings_ms[min(len(timings_ms) - 1, int(len(timings_ms) * 0.95))], 3) if timings_ms else 0,
+        'queries_per_iteration': round(queries / len(timings_ms), 2) if timings_ms else 0,
+    }
+    result.update(extra)
+    return result
+
+
+def run_isolated(fn):
+    """
+    Выполняет fn в транзакции с откатом и возвращает ее результат
+    """
+    result = None
+    try:
+        with transaction.atomic():
+            result = fn()
+            raise Rollback()
+    except Rollback:
+        pass
+    return result
+
+
+def timed(name, iterations, step, **extra):
+    """
+    Вызывает step(i) iterations раз, замеряя время и количество SQL запросов
+    """
+    def body():
+        timings = []
+        with CaptureQueriesContext(connection) as ctx:
+            for i in range(iterations):
+                started = time.perf_counter()
+                step(i)
+                timings.append(time.perf_counter() - started)
+        return summarize(name, timings, len(ctx.captured_queries), **extra)
+
+    return run_isolated(body)
+
+
+def bench_register_or_update_user(iterations=200, seed=42):
+    """
+    Регистрация: половина вызовов - новые пользователи, половина - повторные визиты
+    """
+    from .services import register_or_update_user
+
+    rng = random.Random(seed)
+    existing_ids = list(VKUser.objects.order_by('?').values_list('vk_user_id', flat=True)[:iterations])
+    new_id_base = (VKUser.objects.order_by('-vk_user_id').values_list('vk_user_id', flat=True).first() or 0) + 1
+
+    def step(i):
+        if existing_ids and i % 2:
+            vk_user_id = existing_ids[i % len(existing_ids)]
+        else:
+            vk_user_id = new_id_base + i
+        register_or_update_user(
+            {'id': vk_user_id, 'first_name': 'Бенчмарк', 'city': {'title': 'Москва'}, 'sex': rng.choice([1, 2])},
+            {'utm_source': 'vk_ads', 'utm_campaign': 'benchmark'},
+        )
+
+    return timed('register_or_update_user', iterations, step)
+
+
+def bench_get_target_users_queryset(iterations=5):
+    """
+    Выбор получателей для типовых сегментов: count() и выгрузка VK ID
+    """
+    segments = [
+        {'segment': 'all'},
+        {'segment': 'active'},
+        {'segment': 'new'},
+        {'segment': 'all', 'filter_city': 'Москва'},
+        {'segment': 'all', 'filter_utm_source': 'vk_ads', 'filter_sex': 2},
+    ]
+    results = []
+    for params in segments:
+        notification = PushNotification(title='benchmark', message='benchmark', **params)
+        label = ','.join(f'{key}={value}' for key, value in params.items())
+
+        def count_step(i, notification=notification):
+            notification.get_target_users_queryset().count()
+
+        def ids_step(i, notification=notification):
+            list(notification.get_target_users_queryset().values_list('vk_user_id', flat=True))
+
+        results.append(timed(f'get_target_users_queryset.count[{label}]', iterations, count_step))
+        results.append(timed(f'get_target_users_queryset.ids[{label}]', iterations, ids_step))
+    return results
+
+
+def bench_send_push_notification(recipients=1000, vk_latency_ms=0):
+    """
+    Отправка пуша на recipients пользователей с подменой VK API
+
+    vk_latency_ms имитирует время ответа VK на один вызов.
+    """
+    from . import services
+
+    def fake_send(user_ids, message, fragment=None):
+        if vk_latency_ms:
+            time.sleep(vk_latency_ms / 1000)
+        return {'response': [{'user_id': user_id, 'status': True} for user_id in user_ids]}
+
+    def body():
+        user_ids = list(VKUser.objects.values_list('id', flat=True)[:recipients])
+        VKUser.objects.filter(id__in=user_ids).update(notifications_enabled=True, notifications_allowed=True)
+        notification = PushNotification.objects.create(title='benchmark', message='benchmark', segment='custom')
+        notification.target_users.set(user_ids)
+
+        with mock.patch.object(services, 'send_vk_notification', side_effect=fake_send):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                stats = services.send_push_notification(notification.id)
+                elapsed = time.perf_counter() - started
+
+        return summarize(
+            'send_push_notification', [elapsed], len(ctx.captured_queries),
+            recipients=stats['total'],
+            recipients_per_s=round(stats['total'] / elapsed, 1) if elapsed else 0,
+            vk_latency_ms=vk_latency_ms,
+        )
+
+    return run_isolated(body)
+
+
+def bench_utm_stats(iterations=5):
+    """
+    Статистика UTM за 7 и 30 дней через представление utm_stats
+    """
+    from .views import utm_stats
+
+    factory = RequestFactory()
+    results = []
+    for days in (7, 30):
+        def step(i, days=days):
+            response = utm_stats(factory.get('/api/utm-stats/', {'days': days}))
+            response.render()
+
+        results.append(timed(f'utm_stats[days={days}]', iterations, step))
+    return results
+
+
+def dataset_summary():
+    return {
+        'db_vendor': connection.vendor,
+        'vk_users': VKUser.objects.count(),
+        'utm_events': UTMTracking.objects.count(),
+        'push_logs': PushLog.objects.count(),
+    }
+
+
+def run_all(iterations=5, register_iterations=200, push_recipients=1000, vk_latency_ms=0):
+    results = [bench_register_or_update_user(register_iterations)]
+    results.extend(bench_get_target_users_queryset(iterations))
+    results.append(bench_send_push_notification(push_recipients, vk_latency_ms))
+    results.extend(bench_utm_stats(iterations))
+    return {'dataset': dataset_summary(), 'results': results}
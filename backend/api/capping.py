@@ -0,0 +1,101 @@
+"""
+Ограничение частоты пушей (frequency capping)
+
+Журнал PushLedger хранит по строке на пользователя: время последнего пуша
+и количество пушей в текущем окне CAP_WINDOW (окно начинается с первого пуша
+после окончания предыдущего). Лимиты задаются в уведомлении:
+    cap_interval_hours - не чаще раза в N часов;
+    cap_per_day        - не больше N пушей за окно.
+Пустое поле - значение по умолчанию из настроек (PUSH_CAP_INTERVAL_HOURS,
+PUSH_CAP_PER_DAY), 0 - без ограничения.
+
+При выборе получателей лимит - условие NOT EXISTS по первичному ключу журнала
+(анти-join, без чтения PushLog). Журнал обновляется после каждой порции
+получателей двумя запросами. Получатели выбираются в начале отправки, поэтому
+две кампании, отправляемые одновременно, друг друга не ограничивают.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+from django.utils import timezone
+
+from .models import PushLedger
+
+CAP_WINDOW = timedelta(hours=24)
+
+
+def frequency_caps(notification):
+    """
+    Лимиты уведомления (часы между пушами, пушей за окно); 0 - без ограничения
+    """
+    interval_hours = notification.cap_interval_hours
+    if interval_hours is None:
+        interval_hours = settings.PUSH_CAP_INTERVAL_HOURS
+    per_day = notification.cap_per_day
+    if per_day is None:
+        per_day = settings.PUSH_CAP_PER_DAY
+    return interval_hours, per_day
+
+
+def cap_condition(notification, now=None):
+    """
+    Условие на строки PushLedger "пользователь упирается в лимит частоты" или None без лимитов
+    """
+    now = now or timezone.now()
+    interval_hours, per_day = frequency_caps(notification)
+    conditions = []
+    if interval_hours:
+        conditions.append(Q(last_push_at__gt=now - timedelta(hours=interval_hours)))
+    if per_day:
+        conditions.append(Q(window_started_at__gt=now - CAP_WINDOW, window_count__gte=per_day))
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else conditions[0] | conditions[1]
+
+
+def capped_users(notification, now=None, user_field='pk'):
+    """
+    Условие "пользователь упирается в лимит частоты" или None без лимитов
+
+    user_field - поле ID пользователя в queryset: 'pk' для VKUser, 'user_id' для PushLog
+    """
+    condition = cap_condition(notification, now)
+    if condition is None:
+        return None
+    return Exists(PushLedger.objects.filter(condition, user=OuterRef(user_field)))
+
+
+def capped_user_ids(notification, now=None):
+    """
+    ID пользователей, которые сейчас упираются в лимит частоты (оценка аудитории, api/segments.py)
+    """
+    condition = cap_condition(notification, now)
+    if condition is None:
+        return PushLedger.objects.none().values_list('user_id', flat=True)
+    return PushLedger.objects.filter(condition).values_list('user_id', flat=True)
+
+
+def record_pushes(user_ids, now=None):
+    """
+    Отмечает доставленные пуши в журнале
+
+    Известные пользователи обновляются одним UPDATE (окно, которое уже закончилось,
+    начинается заново), новые добавляются одним INSERT.
+    """
+    if not user_ids:
+        return
+    now = now or timezone.now()
+    expired = Q(window_started_at__lte=now - CAP_WINDOW)
+    with transaction.atomic():
+        # В SET все выражения видят старые значения строки
+        PushLedger.objects.filter(user_id__in=user_ids).update(
+            last_push_at=now,
+            window_started_at=Case(When(expired, then=Value(now)), default=F('window_started_at')),
+            window_count=Case(When(expired, then=Value(1)), default=F('window_count') + 1),
+        )
+        PushLedger.objects.bulk_create(
+            [PushLedger(user_id=pk, last_push_at=now, window_started_at=now, window_count=1) for pk in user_ids],
+            ignore_conflicts=True,
+        )
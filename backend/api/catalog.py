@@ -0,0 +1,243 @@
+"""
+Каталог МФО для быстрых ответов без похода к партнеру на каждый запрос
+
+Каталог читается из таблицы MFO (активные строки), которую заполняет синхронизация
+с витриной партнера (api/catalog_sync.py). Версия каталога - количество строк
+и время последнего изменения; процесс проверяет ее не чаще раза в CATALOG_CACHE_TTL
+секунд и перечитывает строки только при смене версии.
+
+Подбор по сумме, сроку и ставке отвечает индекс CatalogIndex, который строится
+один раз на версию каталога:
+    - для каждой границы (sum_min, sum_max, term_min, term_max, rate) - отсортированный
+      массив значений и битовые маски префиксов, поэтому офферы, подходящие под условие,
+      находятся бинарным поиском, а пересечение условий - одним AND масок;
+    - для каждого вида сортировки - заранее отсортированный список офферов,
+      из которого берутся подходящие по маске с учетом offset/limit.
+"""
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .logos import logo_urls
+from .models import MFO
+
+CATALOG_VERSION_KEY = 'api:catalog:version'
+CATALOG_FIELDS = (
+    'id', 'name', 'logo_url', 'link', 'sum_min', 'sum_max', 'term_min', 'term_max', 'rate',
+    'approval_chance', 'payout_speed_hours', 'promo_text', 'requirements', 'get_methods', 'repay_methods',
+    'logo_source', 'logo_file',
+)
+LIST_FIELDS = ('requirements', 'get_methods', 'repay_methods')
+
+# Сортировки витрины (как в useMFOs на фронтенде). При заданных сумме и сроке
+# переплата amount * rate / 100 * term пропорциональна ставке, поэтому
+# overpayment использует порядок rate.
+CATALOG_SORTS = ('approval', 'rate', 'speed', 'overpayment')
+CATALOG_QUERY_PARAMS = ('amount', 'term', 'max_rate', 'sort', 'limit', 'offset')
+CATALOG_PAGE_SIZE = 20
+CATALOG_MAX_PAGE_SIZE = 100
+
+_entry = None
+_index = None
+
+
+def catalog_version():
+    """
+    Версия каталога: меняется при любом создании, изменении или удалении МФО
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        stats = MFO.objects.aggregate(total=Count('id'), updated_at=Max('updated_at'))
+        version = f"{stats['total']}:{stats['updated_at'].isoformat() if stats['updated_at'] else ''}"
+        cache.set(CATALOG_VERSION_KEY, version, timeout=settings.CATALOG_CACHE_TTL)
+    return version
+
+
+def catalog_item(row):
+    for field in LIST_FIELDS:
+        row[field] = [value.strip() for value in row[field].split(';') if value.strip()]
+    # Логотип - локальная уменьшенная копия (api/logos.py), если она есть
+    row.update(logo_urls(row['logo_url'], row.pop('logo_source'), row.pop('logo_file')))
+    return row
+
+
+def get_catalog_entry():
+    """
+    Каталог и его версия
+
+    Returns:
+        dict: {'version': ..., 'mfos': [...]}
+    """
+    global _entry
+    version = catalog_version()
+    if _entry is None or _entry['version'] != version:
+        rows = MFO.objects.filter(is_active=True).order_by('sort_order', 'id').values(*CATALOG_FIELDS)
+        _entry = {'version': version, 'mfos': [catalog_item(row) for row in rows]}
+    return _entry
+
+
+def get_catalog():
+    """
+    Текущий каталог МФО (список в формате фронтенда)
+    """
+    return get_catalog_entry()['mfos']
+
+
+def get_catalog_index():
+    """
+    Индекс текущей версии каталога (строится в процессе один раз на версию)
+    """
+    global _index
+    entry = get_catalog_entry()
+    if _index is None or _index.version != entry['version']:
+        _index = CatalogIndex(entry['mfos'], entry['version'])
+    return _index
+
+
+def _number(value, default):
+    try:
+        return float(value) if value is not None else default
+    except (TypeError, ValueError):
+        return default
+
+
+class BoundIndex:
+    """
+    Отсортированные значения одной границы и маски префиксов:
+    masks[i] - офферы с i наименьшими значениями
+    """
+
+    def __init__(self, values):
+        order = sorted(range(len(values)), key=lambda position: values[position])
+        self.values = [values[position] for position in order]
+        self.masks = [0]
+        for position in order:
+            self.masks.append(self.masks[-1] | (1 << position))
+
+    def at_most(self, value):
+        return self.masks[bisect_right(self.values, value)]
+
+    def below(self, value):
+        return self.masks[bisect_left(self.values, value)]
+
+
+class CatalogIndex:
+    """
+    Индекс каталога для подбора офферов по сумме, сроку и ставке
+    """
+
+    def __init__(self, mfos, version):
+        self.version = version
+        self.mfos = mfos
+        self.all = (1 << len(mfos)) - 1
+
+        # Пустые границы трактуются как на фронтенде: минимум 0, максимум не подходит
+        self.sum_min = BoundIndex([_number(mfo.get('sum_min'), 0) for mfo in mfos])
+        self.sum_max = BoundIndex([_number(mfo.get('sum_max'), 0) for mfo in mfos])
+        self.term_min = BoundIndex([_number(mfo.get('term_min'), 0) for mfo in mfos])
+        self.term_max = BoundIndex([_number(mfo.get('term_max'), 0) for mfo in mfos])
+        self.rate = BoundIndex([_number(mfo.get('rate'), float('inf')) for mfo in mfos])
+
+        rate = [_number(mfo.get('rate'), 999) or 999 for mfo in mfos]
+        approval = [_number(mfo.get('approval_chance'), 0) for mfo in mfos]
+        speed = [_number(mfo.get('payout_speed_hours'), 999) or 999 for mfo in mfos]
+        rank_keys = {
+            'approval': lambda i: (-approval[i], rate[i], speed[i]),
+            'rate': lambda i: (rate[i], -approval[i], speed[i]),
+            'speed': lambda i: (speed[i], -approval[i], rate[i]),
+        }
+        positions = range(len(mfos))
+        self.orders = {sort: sorted(positions, key=key) for sort, key in rank_keys.items()}
+        self.orders['overpayment'] = self.orders['rate']
+
+    def match(self, amount=None, term=None, max_rate=None):
+        """
+        Битовая маска офферов: sum_min <= amount <= sum_max, term_min <= term <= term_max, rate <= max_rate
+        """
+        mask = self.all
+        if amount is not None:
+            mask &= self.sum_min.at_most(amount) & ~self.sum_max.below(amount)
+        if term is not None:
+            mask &= self.term_min.at_most(term) & ~self.term_max.below(term)
+        if max_rate is not None:
+            mask &= self.rate.at_most(max_rate)
+        return mask
+
+    def query(self, amount=None, term=None, max_rate=None, sort='approval', offset=0, limit=CATALOG_PAGE_SIZE):
+        """
+        Подходящие офферы в порядке сортировки
+
+        Returns:
+            tuple: (всего подходящих, офферы страницы)
+        """
+        mask = self.match(amount, term, max_rate)
+        total = mask.bit_count()
+        results = []
+        skipped = 0
+        for position in self.orders[sort]:
+            if not mask >> position & 1:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            mfo = self.mfos[position]
+            if amount is not None and term is not None:
+                mfo = {**mfo, 'overpayment': round(amount * _number(mfo.get('rate'), 0) / 100 * term, 2)}
+            results.append(mfo)
+            if len(results) >= limit:
+                break
+        return total, results
+
+
+def parse_catalog_query(params):
+    """
+    Параметры подбора из запроса или None, если подбор не запрошен
+
+    Raises:
+        ValueError: Неверное значение параметра
+    """
+    if not any(params.get(name) not in (None, '') for name in CATALOG_QUERY_PARAMS):
+        return None
+
+    def number(name, cast, minimum):
+        value = params.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            value = cast(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'Неверное значение {name}: {value}')
+        if value < minimum:
+            raise ValueError(f'{name} должен быть не меньше {minimum}')
+        return value
+
+    sort = params.get('sort') or 'approval'
+    if sort not in CATALOG_SORTS:
+        raise ValueError(f'Неверная сортировка {sort}, доступны: {", ".join(CATALOG_SORTS)}')
+
+    limit = number('limit', int, 1) or CATALOG_PAGE_SIZE
+    return {
+        'amount': number('amount', int, 0),
+        'term': number('term', int, 0),
+        'max_rate': number('max_rate', float, 0),
+        'sort': sort,
+        'offset': number('offset', int, 0) or 0,
+        'limit': min(limit, CATALOG_MAX_PAGE_SIZE),
+    }
+
+
+def query_catalog(index, query):
+    """
+    Страница подбора в формате ответа API
+    """
+    total, results = index.query(**query)
+    next_offset = query['offset'] + len(results)
+    return {
+        'count': total,
+        'offset': query['offset'],
+        'limit': query['limit'],
+        'next_offset': next_offset if next_offset < total else None,
+        'results': results,
+    }
@@ -0,0 +1,125 @@
+"""
+Синхронизация каталога МФО с витринами партнеров
+
+Витрины загружаются фоновым процессом (python manage.py sync_mfo_catalog --loop),
+а не в запросах пользователей:
+    1. все источники CATALOG_FEED_SOURCES загружаются одновременно и нормализуются
+       в поля модели MFO (api/feeds.py, api/partners.py);
+    2. офферы сравниваются со строками MFO по external_id (ИНН) через хэш содержимого;
+    3. в одной транзакции создаются новые, обновляются измененные
+       и скрываются пропавшие из ответивших витрин МФО;
+    4. новые и измененные логотипы скачиваются и уменьшаются (api/logos.py).
+
+Офферы источника, который не ответил, остаются в каталоге без изменений.
+Изменение строк меняет версию каталога (api/catalog.py), по которой процессы
+перестраивают индекс витрины.
+"""
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .feeds import fetch_feeds, get_feed_sources, merge_feeds
+from .logos import cache_logos
+from .models import MFO
+
+logger = logging.getLogger(__name__)
+
+SYNC_FIELDS = (
+    'name', 'logo_url', 'link', 'sum_min', 'sum_max', 'term_min', 'term_max', 'rate',
+    'approval_chance', 'payout_speed_hours', 'promo_text', 'sort_order',
+)
+
+
+def content_hash(item):
+    raw = json.dumps([item[field] for field in SYNC_FIELDS], ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def sync_catalog(items, sources, dry_run=False):
+    """
+    Применяет офферы (поле source - имя источника) к таблице MFO
+
+    Скрываются только МФО источников из sources, которых нет в items.
+
+    Returns:
+        dict: Количество созданных, обновленных, неизмененных и скрытых МФО
+    """
+    if not items:
+        # Пустая витрина - скорее ошибка партнера, чем снятие всех офферов
+        logger.warning(f"Источники {', '.join(sources) or '-'} вернули пустую витрину, каталог не изменен")
+        return {'created': 0, 'updated': 0, 'unchanged': 0, 'deactivated': 0}
+
+    now = timezone.now()
+    items = {item['external_id']: {**item, 'content_hash': content_hash(item)} for item in items}
+
+    existing = {mfo.external_id: mfo for mfo in MFO.objects.filter(external_id__in=items)}
+    # Строки, созданные до синхронизации (импорт из Excel), привязываются по названию
+    unclaimed = {
+        mfo.name: mfo for mfo in MFO.objects.filter(external_id__isnull=True, name__in=[
+            item['name'] for external_id, item in items.items() if external_id not in existing
+        ])
+    }
+
+    to_create = []
+    to_update = []
+    unchanged = 0
+    for external_id, item in items.items():
+        mfo = existing.get(external_id) or unclaimed.pop(item['name'], None)
+        if mfo is None:
+            to_create.append(MFO(**item, synced_at=now))
+            continue
+        if (mfo.external_id == external_id and mfo.content_hash == item['content_hash']
+                and mfo.source == item['source'] and mfo.is_active):
+            unchanged += 1
+            continue
+        for field, value in item.items():
+            setattr(mfo, field, value)
+        mfo.is_active = True
+        mfo.synced_at = now
+        mfo.updated_at = now
+        to_update.append(mfo)
+
+    missing = (
+        MFO.objects.filter(source__in=sources, is_active=True)
+        .exclude(external_id__in=items)
+    )
+
+    stats = {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'unchanged': unchanged,
+        'deactivated': missing.count(),
+    }
+    if dry_run:
+        return stats
+
+    with transaction.atomic():
+        MFO.objects.bulk_create(to_create)
+        MFO.objects.bulk_update(
+            to_update,
+            SYNC_FIELDS + ('external_id', 'content_hash', 'source', 'is_active', 'synced_at', 'updated_at'),
+        )
+        stats['deactivated'] = missing.update(is_active=False, updated_at=now)
+
+    logger.info(f"Синхронизация каталога ({', '.join(sources)}): {stats}")
+    return stats
+
+
+def sync_feeds(dry_run=False, refresh_logos=False):
+    """
+    Загружает все источники, применяет объединенный каталог и обновляет копии логотипов
+
+    Returns:
+        tuple: (статистика sync_catalog, FeedResult, статистика cache_logos или None)
+    """
+    sources = get_feed_sources()
+    result = fetch_feeds(sources)
+    stats = sync_catalog(merge_feeds(result, sources), result.fetched, dry_run=dry_run)
+    logos = None
+    if settings.LOGO_CACHE_ENABLED and not dry_run:
+        logos = cache_logos(force=refresh_logos)
+    return stats, result, logos
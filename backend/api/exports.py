@@ -0,0 +1,292 @@
+"""
+Потоковые выгрузки пользователей, логов пушей и UTM событий
+
+Строки читаются из базы порциями по EXPORT_CHUNK_SIZE и сразу кодируются,
+поэтому память не зависит от размера выгрузки:
+    - на PostgreSQL - серверный курсор (QuerySet.iterator);
+    - через pgbouncer (серверные курсоры отключены) - keyset порции по первичному ключу.
+
+Форматы:
+    csv    - UTF-8 с BOM (открывается в Excel), отправляется по мере чтения;
+    csv.gz - тот же CSV, сжимаемый потоком gzip;
+    xlsx   - openpyxl write-only: строки пишутся во временный файл,
+             файл отправляется после записи последней строки.
+
+Фильтры (GET параметры или опции команды export_data):
+    date_from, date_to - даты YYYY-MM-DD включительно (поле даты у каждой выгрузки свое);
+    segment, city, sex, utm_source, subscribed - сегмент пользователей, как у пушей;
+    notification, status - для логов пушей;
+    utm_campaign, event_type - для UTM событий (utm_source - значение события).
+"""
+import csv
+import io
+import tempfile
+import zlib
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import PushLog, UTMTracking, VKUser
+from .search import city_q, segment_q, utm_q
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'csv.gz': 'application/gzip',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+# Строк CSV в одном отправляемом фрагменте
+CSV_FLUSH_ROWS = 500
+# Лимит строк листа Excel (1 048 576) с учетом строки заголовков
+XLSX_SHEET_ROWS = 1048575
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Неверная дата {name}: {value} (ожидается YYYY-MM-DD)')
+
+
+def user_filters(params):
+    """
+    Условия сегмента пользователей из параметров выгрузки или None
+    """
+    query = segment_q(params.get('segment') or 'all')
+    if params.get('city'):
+        query &= city_q(params['city'])
+    if params.get('sex'):
+        query &= Q(sex=params['sex'])
+    if params.get('utm_source'):
+        query &= utm_q('utm_source', params['utm_source'])
+    if params.get('subscribed'):
+        query &= Q(notifications_enabled=True, notifications_allowed=True)
+    return query or None
+
+
+class ExportDataset:
+    """
+    Выгрузка одной модели: колонки (заголовок, lookup для values_list) и фильтры
+    """
+
+    def __init__(self, name, title, model, date_field, columns):
+        self.name = name
+        self.title = title
+        self.model = model
+        self.date_field = date_field
+        self.columns = columns
+
+    @property
+    def header(self):
+        return [header for header, _ in self.columns]
+
+    def queryset(self, params):
+        """
+        QuerySet выгрузки с фильтрами; ValueError для неверных параметров
+        """
+        queryset = self.model.objects.all()
+        if params.get('date_from'):
+            start = datetime.combine(parse_date(params['date_from'], 'date_from'), time.min)
+            queryset = queryset.filter(**{f'{self.date_field}__gte': timezone.make_aware(start)})
+        if params.get('date_to'):
+            end = datetime.combine(parse_date(params['date_to'], 'date_to') + timedelta(days=1), time.min)
+            queryset = queryset.filter(**{f'{self.date_field}__lt': timezone.make_aware(end)})
+        return self.filter(queryset, params)
+
+    def filter(self, queryset, params):
+        query = user_filters(params)
+        if query is not None:
+            queryset = queryset.filter(user__in=VKUser.objects.filter(query))
+        return queryset
+
+
+class UsersDataset(ExportDataset):
+
+    def filter(self, queryset, params):
+        query = user_filters(params)
+        return queryset.filter(query) if query is not None else queryset
+
+
+class PushLogsDataset(ExportDataset):
+
+    def filter(self, queryset, params):
+        if params.get('notification'):
+            queryset = queryset.filter(notification_id=params['notification'])
+        if params.get('status'):
+            queryset = queryset.filter(status=params['status'])
+        return super().filter(queryset, params)
+
+
+class TrackingDataset(ExportDataset):
+
+    def filter(self, queryset, params):
+        # utm_source относится к событию, а не к первому визиту пользователя
+        if params.get('utm_source'):
+            queryset = queryset.filter(utm_source__value=params['utm_source'])
+        if params.get('utm_campaign'):
+            queryset = queryset.filter(utm_campaign__value=params['utm_campaign'])
+        if params.get('event_type'):
+            queryset = queryset.filter(event_type__value=params['event_type'])
+        return super().filter(queryset, {key: value for key, value in params.items() if key != 'utm_source'})
+
+
+DATASETS = {
+    dataset.name: dataset for dataset in (
+        UsersDataset('users', 'Пользователи', VKUser, 'first_visit', [
+            ('vk_user_id', 'vk_user_id'),
+            ('first_name', 'first_name'),
+            ('last_name', 'last_name'),
+            ('city', 'city'),
+            ('country', 'country'),
+            ('sex', 'sex'),
+            ('bdate', 'bdate'),
+            ('notifications_enabled', 'notifications_enabled'),
+            ('notifications_allowed', 'notifications_allowed'),
+            ('first_visit', 'first_visit'),
+            ('last_visit', 'last_visit'),
+            ('total_visits', 'total_visits'),
+            ('utm_source', 'utm_source'),
+            ('utm_campaign', 'utm_campaign'),
+            ('utm_content', 'utm_content'),
+        ]),
+        PushLogsDataset('push_logs', 'Логи пушей', PushLog, 'sent_at', [
+            ('id', 'id'),
+            ('notification_id', 'notification_id'),
+            ('notification_title', 'notification__title'),
+            ('vk_user_id', 'user__vk_user_id'),
+            ('status', 'status'),
+            ('error_message', 'error_message'),
+            ('sent_at', 'sent_at'),
+            ('clicked_at', 'clicked_at'),
+        ]),
+        TrackingDataset('utm', 'UTM события', UTMTracking, 'timestamp', [
+            ('id', 'id'),
+            ('timestamp', 'timestamp'),
+            ('vk_user_id', 'user_id'),
+            ('event_type', 'event_type__value'),
+            ('utm_source', 'utm_source__value'),
+            ('utm_medium', 'utm_medium__value'),
+            ('utm_campaign', 'utm_campaign__value'),
+            ('utm_content', 'utm_content__value'),
+            ('utm_term', 'utm_term'),
+            ('vk_ad_id', 'vk_ad_id__value'),
+            ('vk_ref', 'vk_ref__value'),
+            ('vk_ref_source', 'vk_ref_source__value'),
+            ('vk_platform', 'vk_platform__value'),
+            ('url', 'url'),
+            ('referrer', 'referrer'),
+            ('user_agent', 'user_agent__value'),
+        ]),
+    )
+}
+
+
+def iter_rows(dataset, queryset):
+    """
+    Строки выгрузки (кортежи) порциями по EXPORT_CHUNK_SIZE
+    """
+    lookups = [lookup for _, lookup in dataset.columns]
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'postgresql' and not connection.settings_dict.get('DISABLE_SERVER_SIDE_CURSORS'):
+        yield from queryset.order_by('pk').values_list(*lookups).iterator(chunk_size=chunk_size)
+        return
+
+    # Без серверного курсора: короткие запросы WHERE pk > последний ORDER BY pk LIMIT n
+    last_pk = None
+    while True:
+        batch = queryset.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        rows = list(batch.values_list('pk', *lookups)[:chunk_size])
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1][0]
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return timezone.localtime(value).isoformat() if timezone.is_aware(value) else value.isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def xlsx_value(value):
+    # openpyxl не поддерживает даты с часовым поясом
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.localtime(value).replace(tzinfo=None)
+    return value
+
+
+def csv_chunks(dataset, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(dataset.header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([csv_value(value) for value in row])
+        if count % CSV_FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def xlsx_chunks(dataset, rows):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = None
+    sheet_rows = 0
+    for row in rows:
+        if sheet is None or sheet_rows >= XLSX_SHEET_ROWS:
+            sheet = workbook.create_sheet(f'{dataset.title} {len(workbook.worksheets) + 1}'[:31])
+            sheet.append(dataset.header)
+            sheet_rows = 0
+        sheet.append([xlsx_value(value) for value in row])
+        sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet(dataset.title[:31]).append(dataset.header)
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(FILE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def export_chunks(dataset, queryset, file_format):
+    """
+    Байты файла выгрузки в формате file_format (см. EXPORT_FORMATS)
+    """
+    rows = iter_rows(dataset, queryset)
+    if file_format == 'xlsx':
+        return xlsx_chunks(dataset, rows)
+    if file_format == 'csv.gz':
+        return gzip_chunks(csv_chunks(dataset, rows))
+    return csv_chunks(dataset, rows)
+
+
+def export_filename(dataset, file_format):
+    return f'{dataset.name}_{timezone.localtime():%Y%m%d_%H%M}.{file_format}'
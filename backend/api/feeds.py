@@ -0,0 +1,170 @@
+"""
+Источники офферов для каталога МФО
+
+Источники описываются в настройке CATALOG_FEED_SOURCES:
+    name     - имя источника (сохраняется в MFO.source);
+    url      - адрес витрины;
+    parser   - разбор ответа: имя из FEED_PARSERS или путь к функции "module.function",
+               функция получает JSON ответа и возвращает МФО в полях модели (см. normalize_itfinance_feed);
+    priority - при совпадении external_id (ИНН) в нескольких источниках берется оффер
+               источника с меньшим priority;
+    timeout  - таймаут запроса в секундах.
+
+Все источники запрашиваются одновременно, поэтому время загрузки ограничено
+самым медленным ответившим источником, а не суммой задержек. Источник, не уложившийся
+в таймаут, пропускается. После CATALOG_FEED_FAILURE_THRESHOLD ошибок подряд источник
+не запрашивается CATALOG_FEED_RETRY_AFTER секунд (circuit breaker; состояние хранится
+в процессе sync_mfo_catalog --loop).
+"""
+import asyncio
+import logging
+import time
+
+import httpx
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import observe_upstream
+from .partners import DEFAULT_USER_AGENT
+
+logger = logging.getLogger(__name__)
+
+FEED_PARSERS = {
+    'itfinance': 'api.partners.normalize_itfinance_feed',
+}
+
+
+class FeedSource:
+    """
+    Один источник офферов из CATALOG_FEED_SOURCES
+    """
+
+    def __init__(self, name, url, parser='itfinance', priority=100, timeout=10):
+        self.name = name
+        self.url = url
+        self.parser = import_string(FEED_PARSERS.get(parser, parser))
+        self.priority = priority
+        self.timeout = timeout
+
+    def parse(self, data):
+        return [{**item, 'source': self.name} for item in self.parser(data)]
+
+
+class CircuitBreaker:
+    """
+    Пропускает источник после threshold ошибок подряд на retry_after секунд,
+    затем разрешает одну пробную попытку
+    """
+
+    def __init__(self, threshold, retry_after):
+        self.threshold = threshold
+        self.retry_after = retry_after
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        return time.monotonic() - self.opened_at >= self.retry_after
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+_breakers = {}
+
+
+def get_breaker(source):
+    breaker = _breakers.get(source.name)
+    if breaker is None:
+        breaker = _breakers[source.name] = CircuitBreaker(
+            settings.CATALOG_FEED_FAILURE_THRESHOLD, settings.CATALOG_FEED_RETRY_AFTER,
+        )
+    return breaker
+
+
+def get_feed_sources():
+    return [FeedSource(**config) for config in settings.CATALOG_FEED_SOURCES]
+
+
+class FeedResult:
+    """
+    Итог загрузки источников: офферы успешных источников, ошибки и пропущенные
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.errors = {}
+        self.skipped = []
+
+    @property
+    def fetched(self):
+        return list(self.items)
+
+
+async def fetch_source(client, source):
+    with observe_upstream(source.name):
+        response = await asyncio.wait_for(client.get(source.url, timeout=source.timeout), timeout=source.timeout)
+    response.raise_for_status()
+    items = source.parse(response.json())
+    if not items:
+        # Пустая витрина - скорее ошибка партнера: офферы источника остаются в каталоге
+        raise ValueError('пустая витрина')
+    return items
+
+
+async def fetch_sources(sources):
+    result = FeedResult()
+    active = []
+    for source in sources:
+        if get_breaker(source).allow():
+            active.append(source)
+        else:
+            result.skipped.append(source.name)
+
+    headers = {'User-Agent': DEFAULT_USER_AGENT, 'Referer': 'https://vk.com/'}
+    async with httpx.AsyncClient(headers=headers, follow_redirects=True) as client:
+        responses = await asyncio.gather(
+            *(fetch_source(client, source) for source in active), return_exceptions=True,
+        )
+
+    for source, response in zip(active, responses):
+        breaker = get_breaker(source)
+        if isinstance(response, BaseException):
+            breaker.record_failure()
+            error = 'таймаут' if isinstance(response, asyncio.TimeoutError) else str(response) or type(response).__name__
+            result.errors[source.name] = error
+            logger.warning(f"Источник офферов {source.name} недоступен: {error}")
+        else:
+            breaker.record_success()
+            result.items[source.name] = response
+    return result
+
+
+def fetch_feeds(sources=None):
+    """
+    Загружает все источники одновременно
+
+    Returns:
+        FeedResult: офферы по источникам, ошибки и пропущенные источники
+    """
+    return asyncio.run(fetch_sources(sources if sources is not None else get_feed_sources()))
+
+
+def merge_feeds(result, sources=None):
+    """
+    Офферы всех успешных источников без повторов external_id (по priority источника)
+    """
+    sources = sources if sources is not None else get_feed_sources()
+    priority = {source.name: source.priority for source in sources}
+    merged = {}
+    for name in sorted(result.items, key=lambda name: priority.get(name, 0)):
+        for item in result.items[name]:
+            merged.setdefault(item['external_id'], item)
+    return list(merged.values())
@@ -0,0 +1,171 @@
+"""
+Локальные копии логотипов МФО для карточек витрины
+
+Логотипы партнеров часто отдаются в полном размере и без нормального кэширования,
+поэтому после синхронизации каталога (api/catalog_sync.py) каждый логотип
+один раз скачивается и уменьшается:
+    - варианты LOGO_SIZES (1x и 2x для карточки 70px) в WebP и PNG;
+    - имя файлов - хэш содержимого исходной картинки: <хэш>-<размер>.<формат>,
+      поэтому файл никогда не меняется и nginx отдает его с Cache-Control immutable;
+    - файлы лежат в LOGO_CACHE_DIR (общий volume со статикой, /static/logos/).
+
+Логотип скачивается заново, только если у МФО сменился logo_url или пропали файлы.
+Пока копии нет (или скачать не удалось), в ответах остается исходный logo_url.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+
+import httpx
+from django.conf import settings
+from django.utils import timezone
+
+from .metrics import observe_upstream
+from .models import MFO
+from .partners import DEFAULT_USER_AGENT
+
+logger = logging.getLogger(__name__)
+
+# Стороны квадрата вариантов (px): карточка 70px на обычных и retina экранах
+LOGO_SIZES = (70, 140)
+LOGO_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 85, 'method': 6},
+    'png': {'format': 'PNG', 'optimize': True},
+}
+# Картинки больше этого размера не скачиваются
+LOGO_MAX_BYTES = 5 * 1024 * 1024
+
+
+def logo_path(name, size, extension):
+    return os.path.join(settings.LOGO_CACHE_DIR, f'{name}-{size}.{extension}')
+
+
+def logo_urls(logo_url, logo_source, logo_file):
+    """
+    URL логотипа для ответа API: локальная копия, если она сделана из текущего logo_url
+
+    Returns:
+        dict: {'logo_url': ..., 'logo_png_url': ...}
+    """
+    if not logo_file or not logo_url or logo_source != logo_url:
+        return {'logo_url': logo_url or '', 'logo_png_url': logo_url or ''}
+    size = LOGO_SIZES[-1]
+    return {
+        'logo_url': f'{settings.LOGO_CACHE_URL}{logo_file}-{size}.webp',
+        'logo_png_url': f'{settings.LOGO_CACHE_URL}{logo_file}-{size}.png',
+    }
+
+
+def logo_exists(name):
+    return all(
+        os.path.exists(logo_path(name, size, extension))
+        for size in LOGO_SIZES for extension in LOGO_FORMATS
+    )
+
+
+def save_variants(content):
+    """
+    Сохраняет уменьшенные варианты картинки и возвращает их общее имя (хэш содержимого)
+    """
+    from PIL import Image, ImageOps
+
+    name = hashlib.sha256(content).hexdigest()[:32]
+    if logo_exists(name):
+        # Та же картинка уже сохранена (другой МФО или прежний URL)
+        return name
+
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGBA')
+
+    os.makedirs(settings.LOGO_CACHE_DIR, exist_ok=True)
+    for size in LOGO_SIZES:
+        variant = image.copy()
+        # thumbnail сохраняет пропорции и не увеличивает маленькие логотипы
+        variant.thumbnail((size, size), Image.LANCZOS)
+        for extension, options in LOGO_FORMATS.items():
+            path = logo_path(name, size, extension)
+            # Запись во временный файл: nginx не должен отдать недописанную картинку
+            temp_path = f'{path}.tmp'
+            variant.save(temp_path, **options)
+            os.replace(temp_path, path)
+    return name
+
+
+async def download_logo(client, semaphore, url):
+    async with semaphore:
+        with observe_upstream('logo'):
+            async with client.stream('GET', url) as response:
+                response.raise_for_status()
+                content = bytearray()
+                async for chunk in response.aiter_bytes():
+                    content.extend(chunk)
+                    if len(content) > LOGO_MAX_BYTES:
+                        raise ValueError(f'больше {LOGO_MAX_BYTES // 1024 // 1024} МБ')
+    return bytes(content)
+
+
+async def download_logos(urls):
+    semaphore = asyncio.Semaphore(settings.LOGO_CACHE_CONCURRENCY)
+    headers = {'User-Agent': DEFAULT_USER_AGENT, 'Referer': 'https://vk.com/'}
+    timeout = httpx.Timeout(settings.LOGO_CACHE_TIMEOUT)
+    async with httpx.AsyncClient(headers=headers, timeout=timeout, follow_redirects=True) as client:
+        responses = await asyncio.gather(
+            *(download_logo(client, semaphore, url) for url in urls), return_exceptions=True,
+        )
+    return dict(zip(urls, responses))
+
+
+def cache_logos(force=False):
+    """
+    Скачивает и уменьшает логотипы активных МФО, у которых нет актуальной локальной копии
+
+    Args:
+        force: Скачать заново все логотипы
+
+    Returns:
+        dict: Количество сохраненных, неизмененных и не скачанных логотипов
+    """
+    mfos = MFO.objects.filter(is_active=True).exclude(logo_url__isnull=True).exclude(logo_url='')
+    pending = [
+        mfo for mfo in mfos.only('id', 'logo_url', 'logo_source', 'logo_file')
+        if force or mfo.logo_source != mfo.logo_url or not mfo.logo_file or not logo_exists(mfo.logo_file)
+    ]
+    stats = {'cached': 0, 'unchanged': mfos.count() - len(pending), 'failed': 0}
+    if not pending:
+        return stats
+
+    downloads = asyncio.run(download_logos(sorted({mfo.logo_url for mfo in pending})))
+    names = {}
+    for url, content in downloads.items():
+        try:
+            if isinstance(content, BaseException):
+                raise content
+            names[url] = save_variants(content)
+        except Exception as e:
+            logger.warning(f"Логотип {url} не сохранен: {str(e) or type(e).__name__}")
+
+    now = timezone.now()
+    to_update = []
+    for mfo in pending:
+        name = names.get(mfo.logo_url)
+        if name is None:
+            stats['failed'] += 1
+            if not mfo.logo_file or (mfo.logo_source == mfo.logo_url and logo_exists(mfo.logo_file)):
+                # Рабочая копия на месте или ее не было - пробуем снова при следующей синхронизации
+                continue
+            # logo_url сменился или файлы пропали: до следующей попытки в ответах исходный URL
+            name, source = '', ''
+        else:
+            stats['cached'] += 1
+            source = mfo.logo_url
+        mfo.logo_file = name
+        mfo.logo_source = source
+        mfo.updated_at = now
+        to_update.append(mfo)
+
+    # updated_at меняет версию каталога: процессы перечитают URL логотипов
+    MFO.objects.bulk_update(to_update, ('logo_file', 'logo_source', 'updated_at'))
+    logger.info(f"Логотипы МФО: {stats}")
+    return stats
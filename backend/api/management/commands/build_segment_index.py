@@ -0,0 +1,39 @@
+"""
+Django management command для построения снимка индекса аудитории пушей
+Использование:
+    python manage.py build_segment_index                      # в SEGMENT_INDEX_PATH
+    python manage.py build_segment_index --output index.npz
+
+Запускается по cron не реже раза в SEGMENT_INDEX_REBUILD_INTERVAL секунд: воркеры
+читают снимок в фоне и дочитывают только измененных после него пользователей
+(api/segments.py), вместо того чтобы каждый строил индекс из базы.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import VKUser
+from api.segments import SegmentIndex
+
+
+class Command(BaseCommand):
+    help = 'Построение снимка индекса аудитории пушей для воркеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.SEGMENT_INDEX_PATH, help='Файл снимка (по умолчанию SEGMENT_INDEX_PATH)')
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('Укажите --output или SEGMENT_INDEX_PATH')
+
+        started = time.monotonic()
+        index = SegmentIndex()
+        index.load(VKUser.objects.all())
+        built = time.monotonic()
+        index.save(options['output'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Индекс аудитории: {index.size} пользователей, построен за {built - started:.1f} с, '
+            f'записан в {options["output"]} за {time.monotonic() - built:.1f} с'
+        ))
@@ -0,0 +1,30 @@
+"""
+Django management command для выдачи токена профилирования запросов
+Использование: python manage.py create_profile_token admin
+
+Токен передается в заголовке X-Profile-Token и действует PROFILE_TOKEN_MAX_AGE секунд:
+    curl -H "X-Profile-Token: <токен>" https://bodyexp.ru/api/arbitrage/send-to-leads-tech/ ...
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.profiling import make_profile_token
+
+
+class Command(BaseCommand):
+    help = 'Подписанный токен для профилирования запросов (заголовок X-Profile-Token)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Сотрудник (is_staff), от имени которого снимаются профили')
+
+    def handle(self, *args, **options):
+        username = options['username']
+        if not get_user_model().objects.filter(username=username, is_staff=True).exists():
+            raise CommandError(f'Сотрудник {username} не найден')
+
+        if not settings.PROFILING_ENABLED:
+            self.stdout.write(self.style.WARNING('⚠️  PROFILING_ENABLED=False - профилирование отключено'))
+
+        self.stdout.write(make_profile_token(username))
+        self.stdout.write(self.style.SUCCESS(f'✅ Токен действует {settings.PROFILE_TOKEN_MAX_AGE} секунд'))
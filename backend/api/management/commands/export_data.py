@@ -0,0 +1,70 @@
+"""
+Django management command для потоковой выгрузки данных в файл
+Использование:
+    python manage.py export_data users --format xlsx --segment active
+    python manage.py export_data utm --format csv.gz --date-from 2025-01-01 --output utm.csv.gz
+    python manage.py export_data push_logs --status failed --output -   # в stdout
+
+Память не зависит от количества строк (см. api/exports.py).
+"""
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exports import DATASETS, EXPORT_FORMATS, export_chunks, export_filename
+
+FILTER_OPTIONS = (
+    'date_from', 'date_to', 'segment', 'city', 'sex', 'utm_source', 'subscribed',
+    'notification', 'status', 'utm_campaign', 'event_type',
+)
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка пользователей, логов пушей или UTM событий в CSV/XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(DATASETS), help='Что выгружать')
+        parser.add_argument('--format', dest='file_format', choices=list(EXPORT_FORMATS), default='csv.gz', help='Формат файла')
+        parser.add_argument('--output', help='Путь к файлу ("-" - stdout), по умолчанию <dataset>_<дата>.<формат>')
+        parser.add_argument('--date-from', help='С даты YYYY-MM-DD включительно')
+        parser.add_argument('--date-to', help='По дату YYYY-MM-DD включительно')
+        parser.add_argument('--segment', choices=['all', 'active', 'inactive', 'new'], help='Сегмент пользователей')
+        parser.add_argument('--city', help='Город пользователя (подстрока)')
+        parser.add_argument('--sex', type=int, choices=[1, 2], help='Пол пользователя')
+        parser.add_argument('--utm-source', help='UTM Source')
+        parser.add_argument('--subscribed', action='store_true', help='Только подписанные на уведомления')
+        parser.add_argument('--notification', type=int, help='ID пуш-уведомления (push_logs)')
+        parser.add_argument('--status', help='Статус отправки (push_logs)')
+        parser.add_argument('--utm-campaign', help='UTM Campaign (utm)')
+        parser.add_argument('--event-type', help='Тип события (utm)')
+
+    def handle(self, *args, **options):
+        dataset = DATASETS[options['dataset']]
+        file_format = options['file_format']
+        params = {name: options[name] for name in FILTER_OPTIONS if options.get(name)}
+
+        try:
+            queryset = dataset.queryset(params)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = options['output'] or export_filename(dataset, file_format)
+        started = time.monotonic()
+        written = 0
+
+        if output == '-':
+            for chunk in export_chunks(dataset, queryset, file_format):
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        self.stdout.write(f'📤 Выгрузка {dataset.name} в {output}...')
+        with open(output, 'wb') as f:
+            for chunk in export_chunks(dataset, queryset, file_format):
+                f.write(chunk)
+                written += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Готово: {output}, {written / 1024 / 1024:.1f} МБ за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,195 @@
+"""
+Django management command для генерации синтетических данных под бенчмарки
+Использование: python manage.py generate_synthetic_data --users 1000000 --events 3000000 --push-logs 2000000
+
+НЕ запускать на продакшн базе: создает пользователей с VK ID от --id-offset.
+"""
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import VKUser, UTMTracking, PushNotification, PushLog
+from api.rules import parse_birth_date
+from api.tracking import dimension_id, encode_payload, user_agent_id
+
+CITIES = [
+    ('Москва', 30), ('Санкт-Петербург', 14), ('Новосибирск', 5), ('Екатеринбург', 5),
+    ('Казань', 4), ('Нижний Новгород', 3), ('Челябинск', 3), ('Самара', 3),
+    ('Омск', 2), ('Ростов-на-Дону', 2), ('Уфа', 2), ('Красноярск', 2),
+    ('Воронеж', 2), ('Пермь', 2), ('Волгоград', 2), ('', 15),
+]
+# Условные ID VK для городов выше (страна - Россия, ID 1)
+CITY_IDS = {city: index for index, (city, _) in enumerate(CITIES, 1) if city}
+UTM_SOURCES = [('vk_ads', 45), ('vk_group', 20), ('', 20), ('vk_post', 8), ('mytarget', 5), ('telegram', 2)]
+PLATFORMS = [('mobile_android', 50), ('mobile_iphone', 30), ('desktop_web', 15), ('mobile_web', 5)]
+EVENT_TYPES = [('page_view', 70), ('offer_click', 20), ('arbitrage_send', 10)]
+FIRST_NAMES = ['Иван', 'Анна', 'Сергей', 'Мария', 'Алексей', 'Елена', 'Дмитрий', 'Ольга', 'Андрей', 'Наталья']
+LAST_NAMES = ['Иванов', 'Петрова', 'Смирнов', 'Кузнецова', 'Попов', 'Васильева', 'Соколов', 'Морозова']
+
+
+def weighted(choices):
+    values, weights = zip(*choices)
+    return values, weights
+
+
+class Command(BaseCommand):
+    help = 'Генерация синтетических пользователей, UTM событий и логов пушей для бенчмарков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help='Количество пользователей')
+        parser.add_argument('--events', type=int, default=300000, help='Количество UTM событий')
+        parser.add_argument('--push-logs', type=int, default=200000, help='Количество логов пушей')
+        parser.add_argument('--days', type=int, default=180, help='Глубина истории в днях')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер пачки bulk_create')
+        parser.add_argument('--id-offset', type=int, default=9_000_000_000, help='Начальный VK ID синтетических пользователей')
+        parser.add_argument('--seed', type=int, default=42, help='Seed генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.days = options['days']
+        self.batch_size = options['batch_size']
+
+        user_ids = self.generate_users(options['users'], options['id_offset'])
+        self.generate_events(options['events'], options['id_offset'], options['users'])
+        self.generate_push_logs(options['push_logs'], user_ids)
+
+        self.stdout.write(self.style.SUCCESS('\n🎉 Синтетические данные созданы'))
+
+    def random_past(self):
+        # Экспоненциальное распределение: свежих визитов больше, чем старых
+        days_ago = min(self.rng.expovariate(1 / (self.days / 4)), self.days)
+        return self.now - timedelta(days=days_ago)
+
+    def generate_users(self, total, id_offset):
+        self.stdout.write(f'👥 Создание пользователей: {total}')
+        cities, city_weights = weighted(CITIES)
+        sources, source_weights = weighted(UTM_SOURCES)
+
+        batch = []
+        for index in range(total):
+            first_visit = self.random_past()
+            last_visit = first_visit + (self.now - first_visit) * self.rng.random() ** 3
+            city = self.rng.choices(cities, city_weights)[0]
+            utm_source = self.rng.choices(sources, source_weights)[0]
+            year = self.rng.randint(1960, 2006)
+            bdate = f'{self.rng.randint(1, 28)}.{self.rng.randint(1, 12)}.{year}' if self.rng.random() < 0.6 else ''
+            batch.append(VKUser(
+                vk_user_id=id_offset + index,
+                first_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                city=city,
+                country='Россия' if city else '',
+                sex=self.rng.choice([1, 2]),
+                bdate=bdate,
+                birth_date=parse_birth_date(bdate),
+                vk_city_id=CITY_IDS.get(city),
+                vk_country_id=1 if city else None,
+                notifications_enabled=self.rng.random() < 0.97,
+                notifications_allowed=self.rng.random() < 0.35,
+                first_visit=first_visit,
+                last_visit=last_visit,
+                total_visits=1 + int(self.rng.expovariate(1 / 3)),
+                utm_source=utm_source,
+                utm_campaign=f'campaign_{self.rng.randint(1, 50)}' if utm_source else '',
+                utm_content=f'banner_{self.rng.randint(1, 300)}' if utm_source else '',
+            ))
+            if len(batch) >= self.batch_size:
+                self.flush_users(batch)
+                batch = []
+        if batch:
+            self.flush_users(batch)
+
+        return list(
+            VKUser.objects.filter(vk_user_id__gte=id_offset, vk_user_id__lt=id_offset + total)
+            .values_list('id', flat=True)
+        )
+
+    def flush_users(self, batch):
+        visits = {user.vk_user_id: (user.first_visit, user.last_visit) for user in batch}
+        VKUser.objects.bulk_create(batch, ignore_conflicts=True)
+
+        # auto_now/auto_now_add перезаписали сгенерированные даты визитов - восстанавливаем.
+        # bulk_update не вызывает pre_save, поэтому auto_now здесь не срабатывает
+        users = list(VKUser.objects.filter(vk_user_id__in=list(visits)).only('id', 'vk_user_id'))
+        for user in users:
+            user.first_visit, user.last_visit = visits[user.vk_user_id]
+        VKUser.objects.bulk_update(users, ['first_visit', 'last_visit'], batch_size=self.batch_size)
+
+    def generate_events(self, total, id_offset, users_total):
+        self.stdout.write(f'📊 Создание UTM событий: {total}')
+        sources, source_weights = weighted(UTM_SOURCES)
+        platforms, platform_weights = weighted(PLATFORMS)
+        event_types, event_weights = weighted(EVENT_TYPES)
+
+        user_agent = user_agent_id(
+            'Mozilla/5.0 (Linux; Android 13) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36'
+        )
+        payload = encode_payload({})
+        
+        def dimension_ids(values):
+            return {f'{kind}_id': dimension_id(kind, value) for kind, value in values.items()}
+
+        batch = []
+        timestamps = []
+        for _ in range(total):
+            utm_source = self.rng.choices(sources, source_weights)[0]
+            # Небольшая доля анонимных событий (до получения данных пользователя)
+            user_id = id_offset + self.rng.randrange(max(users_total, 1)) if self.rng.random() < 0.9 else None
+            timestamps.append(self.random_past())
+            batch.append(UTMTracking(user_id=user_id, payload=payload, user_agent_id=user_agent, url='https://bodyexp.ru/', **dimension_ids({
+                'utm_source': utm_source,
+                'utm_medium': 'cpc' if utm_source else '',
+                'utm_campaign': f'campaign_{self.rng.randint(1, 50)}' if utm_source else '',
+                'utm_content': f'banner_{self.rng.randint(1, 300)}' if utm_source else '',
+                'vk_ad_id': str(10 ** 6 + self.rng.randrange(2000)) if utm_source == 'vk_ads' else '',
+                'vk_platform': self.rng.choices(platforms, platform_weights)[0],
+                'event_type': self.rng.choices(event_types, event_weights)[0],
+            })))
+            if len(batch) >= self.batch_size:
+                self.flush_events(batch, timestamps)
+                batch, timestamps = [], []
+        if batch:
+            self.flush_events(batch, timestamps)
+
+    def flush_events(self, batch, timestamps):
+        created = UTMTracking.objects.bulk_create(batch)
+        if created and created[0].pk is not None:
+            for event, timestamp in zip(created, timestamps):
+                event.timestamp = timestamp
+            UTMTracking.objects.bulk_update(created, ['timestamp'], batch_size=self.batch_size)
+
+    def generate_push_logs(self, total, user_ids):
+        if not total or not user_ids:
+            return
+        self.stdout.write(f'📨 Создание логов пушей: {total}')
+
+        notifications = [
+            PushNotification.objects.create(
+                title=f'Синтетическая рассылка {index + 1}',
+                message='Тестовое сообщение для бенчмарка',
+                status='sent',
+                sent_at=self.random_past(),
+            )
+            for index in range(10)
+        ]
+
+        batch = []
+        for _ in range(total):
+            status = self.rng.choices(['delivered', 'failed', 'clicked'], [85, 10, 5])[0]
+            batch.append(PushLog(
+                notification=self.rng.choice(notifications),
+                user_id=self.rng.choice(user_ids),
+                status=status,
+                error_message='Flood control' if status == 'failed' else '',
+                error_code=9 if status == 'failed' else None,
+                retryable=status == 'failed',
+                vk_response={'response': [1]} if status != 'failed' else {'error': {'error_code': 9}},
+            ))
+            if len(batch) >= self.batch_size:
+                PushLog.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            PushLog.objects.bulk_create(batch)
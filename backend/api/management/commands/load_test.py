@@ -0,0 +1,206 @@
+"""
+Django management command для нагрузочного тестирования API
+Использование:
+    python manage.py load_test http://localhost:8000/api/mfos/ --requests 1000 --concurrency 200
+    python manage.py load_test http://localhost:8000 --profile launch --requests 500 --concurrency 50
+
+Профиль launch воспроизводит всплеск запусков Mini App: на каждого пользователя
+одновременно уходят register, status, utm-track, send-to-leads-tech и mfos.
+Для этого профиля отключите rate limiting на тестовом стенде (RATELIMIT_ENABLE=False).
+
+Позволяет сравнить режимы запуска (WSGI sync воркеры и ASGI + uvicorn)
+на одинаковом профиле нагрузки.
+"""
+import asyncio
+import json
+import time
+
+import httpx
+from django.core.management.base import BaseCommand
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def latency_summary(latencies):
+    return {
+        'p50': round(percentile(latencies, 50), 1),
+        'p95': round(percentile(latencies, 95), 1),
+        'p99': round(percentile(latencies, 99), 1),
+        'max': round(max(latencies), 1) if latencies else 0,
+    }
+
+
+def launch_requests(base_url, index):
+    """
+    Запросы, которые Mini App отправляет при запуске (пользователь index)
+    """
+    vk_user_id = 8_000_000_000 + index
+    user_data = {'id': vk_user_id, 'first_name': 'Нагрузка', 'city': {'title': 'Москва'}}
+    utm_params = {'utm_source': 'vk_ads', 'utm_campaign': 'load_test', 'vk_platform': 'mobile_android'}
+    return [
+        ('register', 'POST', f'{base_url}/api/users/register/', {'user_data': user_data, 'utm_params': utm_params}),
+        ('status', 'GET', f'{base_url}/api/users/status/?vk_user_id={vk_user_id}', None),
+        ('utm_track', 'POST', f'{base_url}/api/utm-track/', {'user_data': user_data, 'utm_params': utm_params}),
+        ('leads_tech', 'POST', f'{base_url}/api/arbitrage/send-to-leads-tech/', dict(utm_params, user_id=vk_user_id)),
+        ('mfos', 'GET', f'{base_url}/api/mfos/', None),
+    ]
+
+
+async def run_launch_burst(base_url, users, concurrency, timeout):
+    """
+    Всплеск запусков: users пользователей, не более concurrency запусков одновременно
+    """
+    base_url = base_url.rstrip('/')
+    latencies = {}
+    status_codes = {}
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    limits = httpx.Limits(max_connections=concurrency * 5, max_keepalive_connections=concurrency * 5)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+
+        async def one_request(name, method, url, payload):
+            nonlocal errors
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=payload)
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+            key = f'{name}:{response.status_code}'
+            status_codes[key] = status_codes.get(key, 0) + 1
+
+        async def one_launch(index):
+            async with semaphore:
+                await asyncio.gather(*(one_request(*spec) for spec in launch_requests(base_url, index)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_launch(index) for index in range(users)))
+        elapsed = time.perf_counter() - started
+
+    total_requests = sum(len(values) for values in latencies.values()) + errors
+    return {
+        'profile': 'launch',
+        'base_url': base_url,
+        'users': users,
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'launches_per_s': round(users / elapsed, 1) if elapsed else 0,
+        'rps': round(total_requests / elapsed, 1) if elapsed else 0,
+        'latency_ms': {name: latency_summary(values) for name, values in latencies.items()},
+        'status_codes': status_codes,
+        'errors': errors,
+    }
+
+
+async def run_load(url, method, payload, total_requests, concurrency, timeout):
+    """
+    Отправляет total_requests запросов, не более concurrency одновременно
+    """
+    latencies = []
+    status_codes = {}
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+
+        async def one_request():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, url, json=payload)
+                    status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(total_requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'url': url,
+        'method': method,
+        'requests': total_requests,
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(total_requests / elapsed, 1) if elapsed else 0,
+        'latency_ms': latency_summary(latencies),
+        'status_codes': status_codes,
+        'errors': errors,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочное тестирование endpoint-а API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='URL endpoint-а (или базовый URL для --profile launch)')
+        parser.add_argument('--profile', choices=['single', 'launch'], default='single',
+                            help='single - один endpoint, launch - всплеск запусков Mini App')
+        parser.add_argument('--method', default='GET', help='HTTP метод (по умолчанию GET)')
+        parser.add_argument('--data', help='JSON тело запроса для POST')
+        parser.add_argument('--requests', type=int, default=500, help='Всего запросов (для launch - запусков)')
+        parser.add_argument('--concurrency', type=int, default=50, help='Одновременных запросов')
+        parser.add_argument('--timeout', type=float, default=30, help='Таймаут запроса (секунды)')
+        parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        if options['profile'] == 'launch':
+            result = asyncio.run(run_launch_burst(
+                base_url=options['url'],
+                users=options['requests'],
+                concurrency=options['concurrency'],
+                timeout=options['timeout'],
+            ))
+            self.write_launch_result(result, options['json'])
+            return
+
+        payload = json.loads(options['data']) if options['data'] else None
+
+        result = asyncio.run(run_load(
+            url=options['url'],
+            method=options['method'].upper(),
+            payload=payload,
+            total_requests=options['requests'],
+            concurrency=options['concurrency'],
+            timeout=options['timeout'],
+        ))
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, ensure_ascii=False))
+            return
+
+        latency = result['latency_ms']
+        self.stdout.write(f'\n🎯 {result["method"]} {result["url"]}')
+        self.stdout.write(f'   Запросов: {result["requests"]}, одновременно: {result["concurrency"]}')
+        self.stdout.write(self.style.SUCCESS(f'   ⚡ RPS: {result["rps"]} за {result["elapsed_s"]} с'))
+        self.stdout.write(f'   ⏱  p50: {latency["p50"]} мс, p95: {latency["p95"]} мс, p99: {latency["p99"]} мс, max: {latency["max"]} мс')
+        self.stdout.write(f'   📊 Коды ответов: {result["status_codes"]}')
+        if result['errors']:
+            self.stdout.write(self.style.ERROR(f'   ❌ Ошибок соединения: {result["errors"]}'))
+
+    def write_launch_result(self, result, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(result, ensure_ascii=False))
+            return
+
+        self.stdout.write(f'\n🚀 Всплеск запусков: {result["users"]} пользователей, одновременно {result["concurrency"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'   ⚡ {result["launches_per_s"]} запусков/с, {result["rps"]} RPS за {result["elapsed_s"]} с'
+        ))
+        for name, latency in result['latency_ms'].items():
+            self.stdout.write(f'   ⏱  {name}: p50 {latency["p50"]} мс, p95 {latency["p95"]} мс, p99 {latency["p99"]} мс')
+        self.stdout.write(f'   📊 Коды ответов: {result["status_codes"]}')
+        if result['errors']:
+            self.stdout.write(self.style.ERROR(f'   ❌ Ошибок соединения: {result["errors"]}'))
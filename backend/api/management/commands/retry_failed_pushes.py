@@ -0,0 +1,71 @@
+"""
+Django management command для повторной отправки пушей получателям с временными ошибками
+Использование: python manage.py retry_failed_pushes [--notification ID] [--hours 24] [--dry-run]
+
+Без --notification повторяются уведомления, отправленные за --hours, и поставленные
+в очередь действием админки «Повторить для ошибок». Запускается по cron.
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.models import PushNotification
+from api.retries import notifications_to_retry, retry_failed_pushes, retryable_logs
+
+
+class Command(BaseCommand):
+    help = 'Повторная отправка пушей получателям с временными ошибками VK (flood control, лимиты, сеть)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--notification',
+            type=int,
+            action='append',
+            help='ID уведомления (можно указать несколько раз); по умолчанию - все отправленные за --hours и поставленные в очередь из админки',
+        )
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=24,
+            help='Уведомления, отправленные за последние N часов (по умолчанию 24)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Показать количество ошибок для повтора без отправки',
+        )
+
+    def handle(self, *args, **options):
+        if options['notification']:
+            notifications = PushNotification.objects.filter(id__in=options['notification'])
+        else:
+            notifications = notifications_to_retry(timezone.now() - timedelta(hours=options['hours']))
+        notifications = list(notifications.order_by('sent_at'))
+
+        if not notifications:
+            self.stdout.write(self.style.WARNING('⚠️  Нет уведомлений с ошибками для повтора'))
+            return
+
+        for notification in notifications:
+            self.stdout.write(f'\n🔁 Уведомление: {notification.title}')
+            self.stdout.write(f'   Ошибок для повтора: {retryable_logs(notification).count()}')
+
+            if options['dry_run']:
+                self.stdout.write(self.style.WARNING('   🔸 DRY RUN - пропускаем отправку'))
+                continue
+
+            try:
+                stats = retry_failed_pushes(notification.id)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'   ❌ Ошибка: {str(e)}'))
+                continue
+
+            self.stdout.write(self.style.SUCCESS(
+                f'   ✅ Повторено:\n'
+                f'      • Попыток: {stats["retried"]}\n'
+                f'      • Доставлено: {stats["delivered"]}\n'
+                f'      • Осталось временных ошибок: {stats["failed"]}\n'
+                f'      • Постоянных ошибок (не повторяются): {stats["permanent"]}\n'
+                f'      • Отложено по лимиту частоты: {stats["capped"]}'
+            ))
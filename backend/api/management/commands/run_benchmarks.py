@@ -0,0 +1,49 @@
+"""
+Django management command для запуска микробенчмарков горячих путей
+Использование: python manage.py run_benchmarks --output bench.json
+
+Данные для замеров создаются командой generate_synthetic_data.
+Все изменения, сделанные бенчмарками, откатываются.
+"""
+import json
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.benchmarks import run_all
+
+
+class Command(BaseCommand):
+    help = 'Микробенчмарки register_or_update_user, get_target_users_queryset, send_push_notification, utm_stats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5, help='Повторов для запросов выборки')
+        parser.add_argument('--register-iterations', type=int, default=200, help='Вызовов register_or_update_user')
+        parser.add_argument('--push-recipients', type=int, default=1000, help='Получателей тестового пуша')
+        parser.add_argument('--vk-latency-ms', type=float, default=0, help='Имитация задержки VK API на вызов')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        report = run_all(
+            iterations=options['iterations'],
+            register_iterations=options['register_iterations'],
+            push_recipients=options['push_recipients'],
+            vk_latency_ms=options['vk_latency_ms'],
+        )
+        report['started_at'] = timezone.now().isoformat()
+
+        dataset = report['dataset']
+        self.stdout.write(
+            f'\n🗄  База: {dataset["db_vendor"]}, пользователей: {dataset["vk_users"]}, '
+            f'UTM событий: {dataset["utm_events"]}, логов пушей: {dataset["push_logs"]}\n'
+        )
+        for result in report['results']:
+            self.stdout.write(
+                f'⏱  {result["name"]}: mean {result["mean_ms"]} мс, p95 {result["p95_ms"]} мс, '
+                f'SQL/итерация {result["queries_per_iteration"]}'
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'\n✅ Результаты сохранены в {options["output"]}'))
@@ -0,0 +1,48 @@
+"""
+Django management command для запуска локальных заглушек партнеров
+Использование: python manage.py run_partner_stubs --port 8090 --latency-ms 80 --flood-rate 0.01
+
+Затем направьте backend на заглушки:
+    VK_API_BASE_URL=http://localhost:8090/method
+    ITFINANCE_FEED_URL=http://localhost:8090/itfinance/v1/website-shopwindow-offers
+    LEADS_TECH_BASE_URL_OVERRIDE=http://localhost:8090/leads-tech
+"""
+from django.core.management.base import BaseCommand
+
+from api.stubs import PartnerStubApp, StubConfig
+
+
+class Command(BaseCommand):
+    help = 'Локальные заглушки VK API, itfinance и leads.tech для замеров без сети'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Адрес (по умолчанию 127.0.0.1)')
+        parser.add_argument('--port', type=int, default=8090, help='Порт (по умолчанию 8090)')
+        parser.add_argument('--latency-ms', type=float, default=50, help='Задержка ответа')
+        parser.add_argument('--jitter-ms', type=float, default=20, help='Разброс задержки')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ошибок (VK код 10, HTTP 502 у остальных)')
+        parser.add_argument('--flood-rate', type=float, default=0.0, help='Доля ответов VK с кодом 9 (flood control)')
+        parser.add_argument('--rate-limit', type=int, default=20, help='Вызовов VK метода в секунду, дальше код 6 (0 - без лимита)')
+        parser.add_argument('--disallowed-rate', type=float, default=0.05, help='Доля получателей с выключенными уведомлениями')
+        parser.add_argument('--offers', type=int, default=30, help='Офферов в витрине itfinance')
+        parser.add_argument('--seed', type=int, help='Seed генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        import uvicorn
+
+        config = StubConfig(
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            error_rate=options['error_rate'],
+            flood_rate=options['flood_rate'],
+            rate_limit=options['rate_limit'],
+            disallowed_rate=options['disallowed_rate'],
+            offers=options['offers'],
+            seed=options['seed'],
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'🧪 Заглушки партнеров: http://{options["host"]}:{options["port"]} '
+            f'(задержка {config.latency_ms}±{config.jitter_ms} мс, лимит VK {config.rate_limit}/с)'
+        ))
+        uvicorn.run(PartnerStubApp(config), host=options['host'], port=options['port'], log_level='warning')
@@ -41,6 +41,10 @@ class Command(BaseCommand):
             self.stdout.write(f'\n📨 Уведомление: {notification.title}')
             self.stdout.write(f'   Запланировано: {notification.scheduled_time}')
             self.stdout.write(f'   Получателей: {target_count}')
+            if notification.pace_per_minute:
+                self.stdout.write(f'   🐢 Равномерно: {notification.pace_per_minute} в минуту')
+            elif notification.pace_window_minutes:
+                self.stdout.write(f'   🐢 Равномерно: за {notification.pace_window_minutes} мин')
             
             if dry_run:
                 self.stdout.write(self.style.WARNING('   🔸 DRY RUN - пропускаем отправку'))
@@ -54,7 +58,8 @@ class Command(BaseCommand):
                     f'   ✅ Успешно отправлено:\n'
                     f'      • Всего: {stats["total"]}\n'
                     f'      • Доставлено: {stats["delivered"]}\n'
-                    f'      • Ошибок: {stats["failed"]}'
+                    f'      • Ошибок: {stats["failed"]} (можно повторить: {stats["retryable"]})\n'
+                    f'      • Пропущено по лимиту частоты: {stats["capped"]}'
                 ))
                 
             except Exception as e:
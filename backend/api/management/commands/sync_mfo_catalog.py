@@ -0,0 +1,67 @@
+"""
+Django management command для синхронизации каталога МФО с витринами партнеров
+Использование:
+    python manage.py sync_mfo_catalog              # один раз
+    python manage.py sync_mfo_catalog --dry-run    # показать изменения без записи
+    python manage.py sync_mfo_catalog --loop       # постоянно, раз в CATALOG_SYNC_INTERVAL секунд
+    python manage.py sync_mfo_catalog --refresh-logos  # заново скачать все логотипы
+
+Источники - настройка CATALOG_FEED_SOURCES (api/feeds.py).
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from api.catalog_sync import sync_feeds
+
+
+class Command(BaseCommand):
+    help = 'Синхронизация каталога МФО с витринами партнеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Показать изменения без записи в базу')
+        parser.add_argument('--loop', action='store_true', help='Синхронизировать постоянно')
+        parser.add_argument('--interval', type=int, default=settings.CATALOG_SYNC_INTERVAL, help='Интервал для --loop (секунды)')
+        parser.add_argument('--refresh-logos', action='store_true', help='Скачать и уменьшить все логотипы заново')
+
+    def sync(self, dry_run, refresh_logos=False):
+        started = time.monotonic()
+        stats, result, logos = sync_feeds(dry_run=dry_run, refresh_logos=refresh_logos)
+
+        for name, items in result.items.items():
+            self.stdout.write(f'📥 {name}: {len(items)} офферов')
+        for name, error in result.errors.items():
+            self.stdout.write(self.style.ERROR(f'❌ {name}: {error}'))
+        for name in result.skipped:
+            self.stdout.write(self.style.WARNING(f'⏸️  {name}: пропущен после ошибок подряд'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Каталог{" (dry run)" if dry_run else ""}: '
+            f'новых {stats["created"]}, обновлено {stats["updated"]}, '
+            f'без изменений {stats["unchanged"]}, скрыто {stats["deactivated"]} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
+        if logos is not None:
+            self.stdout.write(
+                f'🖼️  Логотипы: сохранено {logos["cached"]}, без изменений {logos["unchanged"]}, '
+                f'не скачано {logos["failed"]}'
+            )
+        return result
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            result = self.sync(options['dry_run'], options['refresh_logos'])
+            if not result.items:
+                raise CommandError('Ни один источник офферов не ответил')
+            return
+
+        self.stdout.write(f'🔄 Синхронизация каталога раз в {options["interval"]} с')
+        while True:
+            try:
+                # Офферы неответивших источников остаются прежними до следующей попытки
+                self.sync(options['dry_run'])
+            finally:
+                close_old_connections()
+            time.sleep(options['interval'])
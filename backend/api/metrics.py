@@ -0,0 +1,324 @@
+"""
+Метрики производительности в формате Prometheus
+
+Реестр хранится в памяти процесса. При нескольких воркерах gunicorn задается
+METRICS_MULTIPROC_DIR (gunicorn.conf.py делает это сам): каждый процесс не чаще
+раза в METRICS_FLUSH_INTERVAL секунд (фоновым потоком) и при выходе записывает свои значения
+в файл <pid>-<id>.json этого каталога, а /metrics складывает файлы всех процессов.
+Файлы завершившихся воркеров мастер gunicorn переносит в archive.json
+(archive_process), поэтому счетчики не сбрасываются при перезапуске воркеров
+(max_requests). Значения на /metrics отстают не больше чем на METRICS_FLUSH_INTERVAL.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .profiling import record_upstream
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE_FILE = 'archive.json'
+# Сколько имен перенесенных файлов помнит archive.json (см. MultiprocessStore.collect)
+ARCHIVE_MERGED_NAMES = 100
+
+
+class Counter:
+    """
+    Счетчик с метками
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        STORE.changed()
+
+    def export(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(target, values):
+        for key, value in values.items():
+            target[key] = target.get(key, 0) + value
+
+    def collect(self, values=None):
+        values = self.export() if values is None else values
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labelnames, json.loads(key))), value
+
+
+class Histogram:
+    """
+    Гистограмма с метками и фиксированными корзинами
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+        STORE.changed()
+
+    def export(self):
+        with self._lock:
+            return {json.dumps(key): dict(state, buckets=list(state['buckets'])) for key, state in self._values.items()}
+
+    @staticmethod
+    def merge(target, values):
+        for key, state in values.items():
+            current = target.get(key)
+            if current is None:
+                target[key] = dict(state, buckets=list(state['buckets']))
+                continue
+            current['buckets'] = [a + b for a, b in zip(current['buckets'], state['buckets'])]
+            current['sum'] += state['sum']
+            current['count'] += state['count']
+
+    def collect(self, values=None):
+        values = self.export() if values is None else values
+        for key, state in values.items():
+            labels = dict(zip(self.labelnames, json.loads(key)))
+            for bound, count in zip(self.buckets, state['buckets']):
+                yield f'{self.name}_bucket', dict(labels, le=repr(bound)), count
+            yield f'{self.name}_bucket', dict(labels, le='+Inf'), state['count']
+            yield f'{self.name}_sum', labels, state['sum']
+            yield f'{self.name}_count', labels, state['count']
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def snapshot():
+    return {metric.name: metric.export() for metric in REGISTRY}
+
+
+def merge_snapshot(target, values):
+    """
+    Складывает снимок values (metric -> значения) в target
+    """
+    kinds = {metric.name: metric for metric in REGISTRY}
+    for name, metric_values in values.items():
+        metric = kinds.get(name)
+        if metric is not None:
+            metric.merge(target.setdefault(name, {}), metric_values)
+    return target
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Файл удален мастером или еще не дописан
+        return {}
+
+
+def write_snapshot(path, values):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(values, f)
+    os.replace(tmp_path, path)
+
+
+class MultiprocessStore:
+    """
+    Файлы значений метрик процессов в общем каталоге (METRICS_MULTIPROC_DIR)
+
+    Значения записывает фоновый поток процесса, если они менялись с прошлой записи,
+    поэтому простаивающий воркер тоже отдает последние значения.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._changed = threading.Event()
+        self._pid = None
+        self._path = None
+
+    @property
+    def directory(self):
+        if not settings.configured:
+            return ''
+        return getattr(settings, 'METRICS_MULTIPROC_DIR', '')
+
+    def path(self):
+        """
+        Файл текущего процесса или None без общего каталога
+
+        После fork (preload_app) у воркера свой файл и свой поток записи.
+        """
+        if self._pid == os.getpid():
+            return self._path
+        with self._lock:
+            if self._pid != os.getpid():
+                directory = self.directory
+                self._path = os.path.join(directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json') if directory else None
+                self._pid = os.getpid()
+                if self._path:
+                    threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+        return self._path
+
+    def changed(self):
+        self._changed.set()
+        self.path()
+
+    def flush(self):
+        path = self.path()
+        if path is None:
+            return
+        with self._write_lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_snapshot(path, snapshot())
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            if self._changed.is_set():
+                self._changed.clear()
+                self.flush()
+
+    def collect(self):
+        """
+        Сумма значений всех процессов (включая завершившиеся)
+        """
+        self.flush()
+        # Сначала файлы процессов, потом архив: если файл успели перенести в архив
+        # после чтения, архив его перечисляет в merged и значения не удваиваются
+        processes = {}
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            name = os.path.basename(path)
+            if name != ARCHIVE_FILE:
+                processes[name] = read_snapshot(path)
+        archive = read_snapshot(os.path.join(self.directory, ARCHIVE_FILE))
+        merged = merge_snapshot({}, archive.get('values', {}))
+        archived = set(archive.get('merged', ()))
+        for name, values in processes.items():
+            if name not in archived:
+                merge_snapshot(merged, values)
+        return merged
+
+
+STORE = MultiprocessStore()
+atexit.register(STORE.flush)
+
+
+def archive_process(directory, pid):
+    """
+    Переносит значения завершившегося процесса в archive.json (вызывает мастер gunicorn)
+    """
+    paths = glob.glob(os.path.join(directory, f'{pid}-*.json'))
+    if not paths:
+        return
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    archive = read_snapshot(archive_path)
+    values = archive.get('values', {})
+    names = archive.get('merged', [])
+    for path in paths:
+        merge_snapshot(values, read_snapshot(path))
+        names.append(os.path.basename(path))
+    write_snapshot(archive_path, {'values': values, 'merged': names[-ARCHIVE_MERGED_NAMES:]})
+    for path in paths:
+        os.remove(path)
+
+
+HTTP_REQUEST_DURATION = register(Histogram(
+    'api_http_request_duration_seconds', 'Время обработки запроса', ('view', 'method', 'status'),
+))
+DB_QUERIES = register(Counter(
+    'api_db_queries_total', 'Количество SQL запросов', ('view',),
+))
+DB_QUERY_DURATION = register(Histogram(
+    'api_db_query_duration_seconds', 'Суммарное время SQL запросов за один HTTP запрос', ('view',),
+))
+UPSTREAM_REQUEST_DURATION = register(Histogram(
+    'api_upstream_request_duration_seconds', 'Время внешних HTTP запросов', ('upstream', 'outcome'),
+))
+PUSH_MESSAGES = register(Counter(
+    'api_push_messages_total', 'Отправленные пуш-уведомления', ('status',),
+))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + pairs + '}'
+
+
+def render_prometheus():
+    """
+    Текстовый формат Prometheus (exposition format 0.0.4)
+    """
+    merged = STORE.collect() if STORE.directory else None
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        values = None if merged is None else merged.get(metric.name, {})
+        for name, labels, value in metric.collect(values):
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+    lines.append('# HELP api_process_info Процесс, отдавший метрики')
+    lines.append('# TYPE api_process_info gauge')
+    lines.append(f'api_process_info{{pid="{os.getpid()}"}} 1')
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def observe_upstream(upstream):
+    """
+    Замер времени внешнего HTTP запроса
+
+    Пример:
+        with observe_upstream('vk'):
+            requests.get(...)
+    """
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        UPSTREAM_REQUEST_DURATION.observe(duration, upstream=upstream, outcome=outcome)
+        record_upstream(upstream, started, duration, outcome)
@@ -0,0 +1,246 @@
+"""
+Middleware для сбора метрик производительности API, контроля бюджетов SQL
+и профилирования запросов по требованию
+
+Все три middleware работают и под WSGI, и под ASGI: в async цепочке Django
+не переключает поток на каждом из них, поэтому async представления (api/async_views.py)
+выполняются в event loop. Соединения с базой у Django свои в каждом потоке, и под ASGI
+запросы идут из потоков sync_to_async, поэтому обертки SQL подключаются не через
+connection.execute_wrapper, а через переменную контекста (request_sql_wrapper),
+которая видна и в этих потоках.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .metrics import HTTP_REQUEST_DURATION, DB_QUERIES, DB_QUERY_DURATION
+from .query_budget import QueryRecorder, check_budget, get_budget_mode
+from .profiling import PROFILE_QUERY_FLAG, RequestProfile, profile_requested_by
+
+logger = logging.getLogger(__name__)
+
+# Обертки SQL текущего HTTP запроса (в порядке вложенности, первая - внешняя)
+request_sql_wrappers = ContextVar('request_sql_wrappers', default=())
+
+
+def dispatch_request_sql(execute, sql, params, many, context):
+    """
+    Обертка каждого соединения: передает запрос оберткам текущего HTTP запроса
+    """
+    for wrapper in reversed(request_sql_wrappers.get()):
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install_request_sql_dispatch(sender, connection, **kwargs):
+    """
+    Подключает dispatch_request_sql к новому соединению (сигнал connection_created)
+    """
+    if dispatch_request_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(dispatch_request_sql)
+
+
+@contextmanager
+def request_sql_wrapper(wrapper):
+    """
+    Как connection.execute_wrapper, но для запросов из всех потоков текущего HTTP запроса
+    """
+    token = request_sql_wrappers.set(request_sql_wrappers.get() + (wrapper,))
+    try:
+        yield
+    finally:
+        request_sql_wrappers.reset(token)
+
+
+class QueryStats:
+    """
+    Счетчик SQL запросов текущего HTTP запроса (request_sql_wrapper)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def get_view_name(request):
+    """
+    Имя представления для метки метрик (без подстановки параметров URL)
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+class HybridMiddleware:
+    """
+    Основа middleware, которое работает и в sync, и в async цепочке
+
+    В async цепочке __call__ возвращает корутину __acall__.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """
+    Записывает время обработки каждого запроса, количество и время SQL запросов
+    """
+
+    def handle(self, request):
+        query_stats = QueryStats()
+        started = time.perf_counter()
+
+        with request_sql_wrapper(query_stats):
+            response = self.get_response(request)
+
+        self.record(request, response, started, query_stats)
+        return response
+
+    async def __acall__(self, request):
+        query_stats = QueryStats()
+        started = time.perf_counter()
+
+        with request_sql_wrapper(query_stats):
+            response = await self.get_response(request)
+
+        self.record(request, response, started, query_stats)
+        return response
+
+    def record(self, request, response, started, query_stats):
+        duration = time.perf_counter() - started
+        view = get_view_name(request)
+
+        HTTP_REQUEST_DURATION.observe(duration, view=view, method=request.method, status=response.status_code)
+        DB_QUERIES.inc(query_stats.count, view=view)
+        DB_QUERY_DURATION.observe(query_stats.duration, view=view)
+
+
+def request_budget(request):
+    match = getattr(request, 'resolver_match', None)
+    return getattr(match.func, 'query_budget', None) if match else None
+
+
+class QueryBudgetMiddleware(HybridMiddleware):
+    """
+    Проверяет бюджет SQL запросов, объявленный декоратором @query_budget
+    """
+
+    def handle(self, request):
+        mode = get_budget_mode()
+        if mode == 'off':
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with request_sql_wrapper(recorder):
+            response = self.get_response(request)
+
+        budget = request_budget(request)
+        if budget is not None:
+            check_budget(get_view_name(request), budget, recorder, mode)
+
+        return response
+
+    async def __acall__(self, request):
+        mode = get_budget_mode()
+        if mode == 'off':
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        with request_sql_wrapper(recorder):
+            response = await self.get_response(request)
+
+        budget = request_budget(request)
+        if budget is not None:
+            # Отчет о превышении выполняет EXPLAIN
+            await sync_to_async(check_budget)(get_view_name(request), budget, recorder, mode)
+
+        return response
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """
+    Профилирует запрос, если его запросил сотрудник (см. api/profiling.py)
+
+    При PROFILING_ENABLED=False middleware отключается целиком.
+    В async цепочке стек снимается с потока event loop.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def handle(self, request):
+        requested_by = profile_requested_by(request)
+        if requested_by is None:
+            return self.get_response(request)
+
+        profile = self.start(request, requested_by)
+        try:
+            with request_sql_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            profile.stop()
+
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        requested_by = await sync_to_async(profile_requested_by)(request)
+        if requested_by is None:
+            return await self.get_response(request)
+
+        profile = self.start(request, requested_by)
+        try:
+            with request_sql_wrapper(profile):
+                response = await self.get_response(request)
+        finally:
+            profile.stop()
+
+        return await sync_to_async(self.finish)(request, response, profile)
+
+    def start(self, request, requested_by):
+        # Флаг не должен попасть в фильтры админки и параметры представлений
+        if PROFILE_QUERY_FLAG in request.GET:
+            query = request.GET.copy()
+            del query[PROFILE_QUERY_FLAG]
+            request.GET = query
+
+        profile = RequestProfile(requested_by)
+        profile.start()
+        return profile
+
+    def finish(self, request, response, profile):
+        try:
+            record = profile.save(request, response, get_view_name(request))
+        except Exception as e:
+            logger.error(f"Не удалось сохранить профиль запроса {request.path}: {e}")
+            return response
+
+        response['X-Profile-Id'] = record.profile_id
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_vkuser_pushnotification_pushlog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vkuser',
+            name='first_visit',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Первый визит'),
+        ),
+        migrations.AlterField(
+            model_name='vkuser',
+            name='last_visit',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Последний визит'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-19 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_vkuser_visit_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profile_id', models.CharField(max_length=32, unique=True, verbose_name='ID профиля')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата')),
+                ('requested_by', models.CharField(blank=True, max_length=150, verbose_name='Сотрудник')),
+                ('method', models.CharField(max_length=10, verbose_name='Метод')),
+                ('path', models.CharField(max_length=500, verbose_name='Путь')),
+                ('view_name', models.CharField(blank=True, max_length=200, verbose_name='Представление')),
+                ('status_code', models.IntegerField(verbose_name='Код ответа')),
+                ('duration_ms', models.FloatField(verbose_name='Время (мс)')),
+                ('samples', models.IntegerField(default=0, verbose_name='Сэмплов стека')),
+                ('sql_count', models.IntegerField(default=0, verbose_name='SQL запросов')),
+                ('sql_ms', models.FloatField(default=0, verbose_name='Время SQL (мс)')),
+                ('http_count', models.IntegerField(default=0, verbose_name='Внешних HTTP запросов')),
+                ('http_ms', models.FloatField(default=0, verbose_name='Время внешних HTTP (мс)')),
+            ],
+            options={
+                'verbose_name': 'Профиль запроса',
+                'verbose_name_plural': 'Профили запросов',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
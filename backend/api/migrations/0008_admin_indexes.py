@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-19 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pushlog',
+            name='sent_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата отправки'),
+        ),
+        migrations.AlterField(
+            model_name='utmtracking',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Время события'),
+        ),
+        migrations.AlterField(
+            model_name='utmtracking',
+            name='user_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True, verbose_name='ID пользователя'),
+        ),
+    ]
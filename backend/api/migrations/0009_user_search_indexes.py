@@ -0,0 +1,47 @@
+# Индексы для поиска пользователей (api/search.py).
+# Выражения совпадают с SQL, который Django генерирует для icontains/istartswith
+# на PostgreSQL: UPPER("field"::text) LIKE UPPER(...). На других СУБД миграция ничего не делает.
+
+from django.db import migrations
+
+TRIGRAM_FIELDS = ('first_name', 'last_name', 'city')
+PREFIX_FIELDS = ('utm_source', 'utm_campaign')
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for field in TRIGRAM_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS api_vkuser_{field}_trgm '
+            f'ON api_vkuser USING gin (UPPER({field}::text) gin_trgm_ops)'
+        )
+    for field in PREFIX_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS api_vkuser_{field}_prefix '
+            f'ON api_vkuser (UPPER({field}::text) text_pattern_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in TRIGRAM_FIELDS:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS api_vkuser_{field}_trgm')
+    for field in PREFIX_FIELDS:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS api_vkuser_{field}_prefix')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('api', '0008_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,153 @@
+# Компактная схема UTMTracking: повторяющиеся строковые параметры - ключи справочника
+# TrackingDimension, User-Agent - ключ UserAgent, full_utm_data/full_user_data - один сжатый payload.
+# url, referrer и utm_term почти у каждого события уникальны и остаются колонками события
+# (TEXT без ограничения длины, значения не обрезаются).
+
+import hashlib
+import json
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+DIMENSION_FIELDS = (
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_content',
+    'vk_ad_id', 'vk_ref', 'vk_ref_source', 'vk_platform', 'event_type',
+)
+INDEXED_FIELDS = ('utm_source', 'utm_campaign')
+BATCH_SIZE = 5000
+
+
+def dimension_ref(kind, verbose_name):
+    return models.ForeignKey(
+        null=True, blank=True, on_delete=django.db.models.deletion.PROTECT, related_name='+',
+        db_index=kind in INDEXED_FIELDS, limit_choices_to={'kind': kind},
+        to='api.trackingdimension', verbose_name=verbose_name,
+    )
+
+
+def backfill(apps, schema_editor):
+    UTMTracking = apps.get_model('api', 'UTMTracking')
+    TrackingDimension = apps.get_model('api', 'TrackingDimension')
+    UserAgent = apps.get_model('api', 'UserAgent')
+
+    dimension_ids = {}
+    user_agent_ids = {}
+
+    def dimension_id(kind, value):
+        # Исходные колонки не длиннее 200 символов, в справочник (500) помещаются целиком
+        value = value or ''
+        if not value:
+            return None
+        key = (kind, value)
+        if key not in dimension_ids:
+            dimension_ids[key] = TrackingDimension.objects.get_or_create(kind=kind, value=value)[0].id
+        return dimension_ids[key]
+
+    def user_agent_id(value):
+        if not value:
+            return None
+        digest = hashlib.sha1(value.encode('utf-8')).hexdigest()
+        if digest not in user_agent_ids:
+            user_agent_ids[digest] = UserAgent.objects.get_or_create(hash=digest, defaults={'value': value})[0].id
+        return user_agent_ids[digest]
+
+    last_id = 0
+    while True:
+        batch = list(UTMTracking.objects.filter(id__gt=last_id).order_by('id')[:BATCH_SIZE])
+        if not batch:
+            break
+        for event in batch:
+            for kind in DIMENSION_FIELDS:
+                setattr(event, f'{kind}_ref_id', dimension_id(kind, getattr(event, kind)))
+            event.user_agent_ref_id = user_agent_id(event.user_agent)
+            if event.full_utm_data == event.full_user_data:
+                payload = event.full_utm_data
+            else:
+                payload = {'utm_params': event.full_utm_data, 'user_data': event.full_user_data}
+            raw = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+            event.payload = zlib.compress(raw)
+        UTMTracking.objects.bulk_update(
+            batch, [f'{kind}_ref' for kind in DIMENSION_FIELDS] + ['user_agent_ref', 'payload']
+        )
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_user_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackingDimension',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('utm_source', 'UTM Source'), ('utm_medium', 'UTM Medium'), ('utm_campaign', 'UTM Campaign'), ('utm_content', 'UTM Content'), ('vk_ad_id', 'VK Ad ID'), ('vk_ref', 'VK Ref'), ('vk_ref_source', 'VK Ref Source'), ('vk_platform', 'VK Platform'), ('event_type', 'Тип события')], max_length=20, verbose_name='Параметр')),
+                ('value', models.CharField(max_length=500, verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Значение UTM параметра',
+                'verbose_name_plural': 'Значения UTM параметров',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'value'), name='api_trackingdimension_kind_value')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('hash', models.CharField(max_length=40, unique=True, verbose_name='SHA-1')),
+                ('value', models.TextField(verbose_name='User Agent')),
+            ],
+            options={
+                'verbose_name': 'User Agent',
+                'verbose_name_plural': 'User Agents',
+            },
+        ),
+        migrations.AddField('utmtracking', 'utm_source_ref', dimension_ref('utm_source', 'UTM Source')),
+        migrations.AddField('utmtracking', 'utm_medium_ref', dimension_ref('utm_medium', 'UTM Medium')),
+        migrations.AddField('utmtracking', 'utm_campaign_ref', dimension_ref('utm_campaign', 'UTM Campaign')),
+        migrations.AddField('utmtracking', 'utm_content_ref', dimension_ref('utm_content', 'UTM Content')),
+        migrations.AddField('utmtracking', 'vk_ad_id_ref', dimension_ref('vk_ad_id', 'VK Ad ID')),
+        migrations.AddField('utmtracking', 'vk_ref_ref', dimension_ref('vk_ref', 'VK Ref')),
+        migrations.AddField('utmtracking', 'vk_ref_source_ref', dimension_ref('vk_ref_source', 'VK Ref Source')),
+        migrations.AddField('utmtracking', 'vk_platform_ref', dimension_ref('vk_platform', 'VK Platform')),
+        migrations.AddField('utmtracking', 'event_type_ref', dimension_ref('event_type', 'Тип события')),
+        migrations.AddField(
+            model_name='utmtracking',
+            name='user_agent_ref',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.useragent', verbose_name='User Agent'),
+        ),
+        migrations.AddField(
+            model_name='utmtracking',
+            name='payload',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Исходные данные'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AlterField('utmtracking', 'utm_term', models.TextField(blank=True, verbose_name='UTM Term')),
+        migrations.AlterField('utmtracking', 'url', models.TextField(blank=True, verbose_name='URL страницы')),
+        migrations.AlterField('utmtracking', 'referrer', models.TextField(blank=True, verbose_name='Referrer')),
+        migrations.RemoveField('utmtracking', 'utm_source'),
+        migrations.RemoveField('utmtracking', 'utm_medium'),
+        migrations.RemoveField('utmtracking', 'utm_campaign'),
+        migrations.RemoveField('utmtracking', 'utm_content'),
+        migrations.RemoveField('utmtracking', 'vk_ad_id'),
+        migrations.RemoveField('utmtracking', 'vk_ref'),
+        migrations.RemoveField('utmtracking', 'vk_ref_source'),
+        migrations.RemoveField('utmtracking', 'vk_platform'),
+        migrations.RemoveField('utmtracking', 'user_agent'),
+        migrations.RemoveField('utmtracking', 'event_type'),
+        migrations.RemoveField('utmtracking', 'full_utm_data'),
+        migrations.RemoveField('utmtracking', 'full_user_data'),
+        migrations.RenameField('utmtracking', 'utm_source_ref', 'utm_source'),
+        migrations.RenameField('utmtracking', 'utm_medium_ref', 'utm_medium'),
+        migrations.RenameField('utmtracking', 'utm_campaign_ref', 'utm_campaign'),
+        migrations.RenameField('utmtracking', 'utm_content_ref', 'utm_content'),
+        migrations.RenameField('utmtracking', 'vk_ad_id_ref', 'vk_ad_id'),
+        migrations.RenameField('utmtracking', 'vk_ref_ref', 'vk_ref'),
+        migrations.RenameField('utmtracking', 'vk_ref_source_ref', 'vk_ref_source'),
+        migrations.RenameField('utmtracking', 'vk_platform_ref', 'vk_platform'),
+        migrations.RenameField('utmtracking', 'user_agent_ref', 'user_agent'),
+        migrations.RenameField('utmtracking', 'event_type_ref', 'event_type'),
+    ]
@@ -0,0 +1,49 @@
+# UTMTracking.user_id (строка) -> BIGINT vk_user_id со связью с VKUser.vk_user_id
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+
+
+def normalize(value):
+    value = (value or '').strip()
+    return int(value) if value.isdigit() else None
+
+
+def backfill(apps, schema_editor):
+    UTMTracking = apps.get_model('api', 'UTMTracking')
+
+    last_id = 0
+    while True:
+        batch = list(
+            UTMTracking.objects.filter(id__gt=last_id).order_by('id').only('id', 'legacy_user_id')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for event in batch:
+            event.user_id = normalize(event.legacy_user_id)
+        UTMTracking.objects.bulk_update(batch, ['user'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_compact_utm_tracking'),
+    ]
+
+    operations = [
+        migrations.RenameField('utmtracking', 'user_id', 'legacy_user_id'),
+        migrations.AddField(
+            model_name='utmtracking',
+            name='user',
+            field=models.ForeignKey(blank=True, db_column='vk_user_id', db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='utm_events', to='api.vkuser', to_field='vk_user_id', verbose_name='Пользователь'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.RemoveField('utmtracking', 'legacy_user_id'),
+        migrations.AddIndex(
+            model_name='utmtracking',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='api_utm_user_timeline'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Синхронизация каталога МФО с витриной itfinance.online (api/catalog_sync.py)
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def hide_unsynced(apps, schema_editor):
+    # До синхронизации витрина показывала только фид партнера, а строки таблицы
+    # (импорт из Excel) в нее не попадали. Синхронизация включит строки,
+    # совпавшие с офферами партнера по названию.
+    MFO = apps.get_model('api', 'MFO')
+    MFO.objects.update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_utmtracking_user_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mfo',
+            name='logo_url',
+            field=models.URLField(blank=True, max_length=500, null=True, verbose_name='URL логотипа'),
+        ),
+        migrations.AlterField(
+            model_name='mfo',
+            name='link',
+            field=models.URLField(max_length=500, verbose_name='Ссылка на оффер'),
+        ),
+        migrations.AddField(
+            model_name='mfo',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='Ключ партнера (ИНН)'),
+        ),
+        migrations.AddField(
+            model_name='mfo',
+            name='source',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Источник'),
+        ),
+        migrations.AddField(
+            model_name='mfo',
+            name='promo_text',
+            field=models.CharField(blank=True, max_length=500, verbose_name='Подпись оффера'),
+        ),
+        migrations.AddField(
+            model_name='mfo',
+            name='sort_order',
+            field=models.IntegerField(default=0, verbose_name='Позиция в витрине'),
+        ),
+        migrations.AddField(
+            model_name='mfo',
+            name='is_active',
+            field=models.BooleanField(db_index=True, default=True, verbose_name='Показывать в витрине'),
+        ),
+        migrations.AddField(
+            model_name='mfo',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40, verbose_name='Хэш данных партнера'),
+        ),
+        migrations.AddField(
+            model_name='mfo',
+            name='synced_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Синхронизировано'),
+        ),
+        migrations.AddField(
+            model_name='mfo',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменено'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(hide_unsynced, migrations.RunPython.noop),
+    ]
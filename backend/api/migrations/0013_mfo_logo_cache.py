@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_mfo_catalog_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mfo',
+            name='logo_file',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Файл логотипа'),
+        ),
+        migrations.AddField(
+            model_name='mfo',
+            name='logo_source',
+            field=models.URLField(blank=True, editable=False, max_length=500, verbose_name='Исходный логотип'),
+        ),
+    ]
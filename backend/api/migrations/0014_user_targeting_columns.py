@@ -0,0 +1,122 @@
+# Производные колонки таргетинга VKUser (api/rules.py) и правило аудитории пуша.
+# Колонки добавляются без индексов, заполняются порциями из bdate и extra_data,
+# затем индексируются. На PostgreSQL дополнительно - префиксный индекс utm_content
+# (как у utm_source / utm_campaign в 0009_user_search_indexes).
+
+from datetime import date
+
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+
+
+def parse_birth_date(bdate):
+    parts = (bdate or '').strip().split('.')
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        return None
+    day, month, year = (int(part) for part in parts)
+    try:
+        birth_date = date(year, month, day)
+    except ValueError:
+        return None
+    if year < 1900 or birth_date > date.today():
+        return None
+    return birth_date
+
+
+def geo_id(value):
+    if isinstance(value, dict) and isinstance(value.get('id'), int) and value['id'] > 0:
+        return value['id']
+    return None
+
+
+def backfill(apps, schema_editor):
+    VKUser = apps.get_model('api', 'VKUser')
+
+    last_id = 0
+    while True:
+        batch = list(
+            VKUser.objects.filter(id__gt=last_id).order_by('id').only('id', 'bdate', 'extra_data')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        changed = []
+        for user in batch:
+            extra_data = user.extra_data if isinstance(user.extra_data, dict) else {}
+            user.birth_date = parse_birth_date(user.bdate)
+            user.vk_city_id = geo_id(extra_data.get('city'))
+            user.vk_country_id = geo_id(extra_data.get('country'))
+            if user.birth_date or user.vk_city_id or user.vk_country_id:
+                changed.append(user)
+        VKUser.objects.bulk_update(changed, ['birth_date', 'vk_city_id', 'vk_country_id'])
+        last_id = batch[-1].id
+
+
+def create_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS api_vkuser_utm_content_prefix '
+        'ON api_vkuser (UPPER(utm_content::text) text_pattern_ops)'
+    )
+
+
+def drop_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS api_vkuser_utm_content_prefix')
+
+
+class Migration(migrations.Migration):
+
+    # Заполнение идет порциями, CREATE INDEX CONCURRENTLY не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('api', '0013_mfo_logo_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushnotification',
+            name='audience_rule',
+            field=models.JSONField(blank=True, help_text='Дополнительное условие, например {"and": [{"age": {"min": 18, "max": 35}}, {"visits": {"min": 3}}, {"city_id": [1, 2]}]}. Язык правил - api/rules.py', null=True, verbose_name='Правило аудитории'),
+        ),
+        migrations.AddField(
+            model_name='vkuser',
+            name='birth_date',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Дата рождения (с годом)'),
+        ),
+        migrations.AddField(
+            model_name='vkuser',
+            name='vk_city_id',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='ID города VK'),
+        ),
+        migrations.AddField(
+            model_name='vkuser',
+            name='vk_country_id',
+            field=models.IntegerField(blank=True, editable=False, null=True, verbose_name='ID страны VK'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='vkuser',
+            name='birth_date',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True, verbose_name='Дата рождения (с годом)'),
+        ),
+        migrations.AlterField(
+            model_name='vkuser',
+            name='vk_city_id',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='ID города VK'),
+        ),
+        migrations.AlterField(
+            model_name='vkuser',
+            name='vk_country_id',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='ID страны VK'),
+        ),
+        migrations.AlterField(
+            model_name='vkuser',
+            name='total_visits',
+            field=models.IntegerField(db_index=True, default=1, verbose_name='Всего визитов'),
+        ),
+        migrations.RunPython(create_prefix_index, drop_prefix_index),
+    ]
@@ -0,0 +1,71 @@
+# Журнал частоты пушей (api/capping.py) и лимиты частоты в уведомлении.
+# Журнал заполняется по доставленным за последние сутки пушам из PushLog
+# (индекс по sent_at), чтобы лимиты работали сразу после выката.
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+BATCH_SIZE = 5000
+
+
+def seed_ledger(apps, schema_editor):
+    PushLog = apps.get_model('api', 'PushLog')
+    PushLedger = apps.get_model('api', 'PushLedger')
+
+    rows = (
+        PushLog.objects
+        .filter(sent_at__gte=timezone.now() - timedelta(hours=24), status__in=('delivered', 'clicked'))
+        .values('user_id')
+        .annotate(last_push_at=Max('sent_at'), window_started_at=Min('sent_at'), window_count=Count('id'))
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(PushLedger(**row))
+        if len(batch) >= BATCH_SIZE:
+            PushLedger.objects.bulk_create(batch)
+            batch = []
+    PushLedger.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_user_targeting_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushLedger',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='push_ledger', serialize=False, to='api.vkuser', verbose_name='Пользователь')),
+                ('last_push_at', models.DateTimeField(verbose_name='Последний пуш')),
+                ('window_started_at', models.DateTimeField(verbose_name='Начало суточного окна')),
+                ('window_count', models.IntegerField(default=0, verbose_name='Пушей в окне')),
+            ],
+            options={
+                'verbose_name': 'Журнал частоты пушей',
+                'verbose_name_plural': 'Журнал частоты пушей',
+            },
+        ),
+        migrations.AddField(
+            model_name='pushnotification',
+            name='cap_interval_hours',
+            field=models.PositiveIntegerField(blank=True, help_text='Пропустить пользователей, получивших любой пуш за последние N часов', null=True, verbose_name='Не чаще раза в N часов'),
+        ),
+        migrations.AddField(
+            model_name='pushnotification',
+            name='cap_per_day',
+            field=models.PositiveIntegerField(blank=True, help_text='Пропустить пользователей, получивших N пушей за текущие сутки', null=True, verbose_name='Не больше N пушей за сутки'),
+        ),
+        migrations.AddField(
+            model_name='pushnotification',
+            name='total_capped',
+            field=models.IntegerField(default=0, verbose_name='Пропущено по лимиту частоты'),
+        ),
+        migrations.RunPython(seed_ledger, migrations.RunPython.noop),
+    ]
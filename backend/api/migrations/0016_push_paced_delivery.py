@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-19 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_push_frequency_caps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushnotification',
+            name='pace_adaptive',
+            field=models.BooleanField(default=False, help_text='Снижать скорость, пока p95 ответа бэкенда выше PUSH_PACE_LATENCY_TARGET_MS', verbose_name='Замедлять при росте задержек бэкенда'),
+        ),
+        migrations.AddField(
+            model_name='pushnotification',
+            name='pace_per_minute',
+            field=models.PositiveIntegerField(blank=True, help_text='Пусто - без ограничения скорости', null=True, verbose_name='Скорость отправки (сообщений в минуту)'),
+        ),
+        migrations.AddField(
+            model_name='pushnotification',
+            name='pace_window_minutes',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Растянуть отправку на N минут'),
+        ),
+    ]
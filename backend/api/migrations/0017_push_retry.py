@@ -0,0 +1,59 @@
+# Код ошибки, признак повторяемости и число попыток в PushLog (api/retries.py).
+# Для существующих ошибок код берется из сохраненного ответа VK: ошибки запроса
+# с временными кодами и сетевые ошибки (пустой ответ) можно повторить.
+
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+# api.services.RETRYABLE_VK_ERRORS на момент миграции
+RETRYABLE_VK_ERRORS = {1, 6, 9, 10, 29}
+
+
+def backfill(apps, schema_editor):
+    PushLog = apps.get_model('api', 'PushLog')
+
+    last_id = 0
+    while True:
+        batch = list(
+            PushLog.objects.filter(status='failed', id__gt=last_id)
+            .order_by('id').only('id', 'vk_response')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for log in batch:
+            vk_response = log.vk_response if isinstance(log.vk_response, dict) else {}
+            error = vk_response.get('error')
+            log.error_code = error.get('error_code') if isinstance(error, dict) else None
+            log.retryable = log.error_code in RETRYABLE_VK_ERRORS if error else 'response' not in vk_response
+        PushLog.objects.bulk_update(batch, ['error_code', 'retryable'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_push_paced_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushlog',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=1, verbose_name='Попыток отправки'),
+        ),
+        migrations.AddField(
+            model_name='pushlog',
+            name='error_code',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Код ошибки VK'),
+        ),
+        migrations.AddField(
+            model_name='pushlog',
+            name='retryable',
+            field=models.BooleanField(default=False, verbose_name='Можно повторить'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='pushlog',
+            index=models.Index(fields=['notification', 'status', 'retryable'], name='api_pushlog_retry'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_push_retry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pushnotification',
+            name='message',
+            field=models.TextField(help_text='Можно подставить поля пользователя: {first_name}, {last_name}, {city}, {country}; значение для пустого поля - {first_name|друг}', max_length=500, verbose_name='Текст сообщения'),
+        ),
+    ]
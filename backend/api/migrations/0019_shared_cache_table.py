@@ -0,0 +1,25 @@
+# Таблица общего кэша (CACHES['shared'], DatabaseCache): значения и блокировки,
+# которые должны видеть все процессы (статистика пользователей, api/stats.py).
+# createcachetable идемпотентен: существующая таблица не меняется.
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+def drop_cache_table(apps, schema_editor):
+    schema_editor.execute('DROP TABLE IF EXISTS api_shared_cache')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_push_message_placeholders'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, drop_cache_table),
+    ]
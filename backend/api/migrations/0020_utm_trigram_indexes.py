@@ -0,0 +1,50 @@
+# Фильтры по UTM (filter_utm_source пушей, правила аудитории, выгрузки, поиск utm: в админке)
+# ищут подстроку без учета регистра, как filter_utm_source до 0009. Префиксные btree индексы
+# из 0009 и 0014 такому условию не подходят и заменяются триграммными GIN индексами на выражении
+# UPPER("field"::text), которое Django генерирует для icontains на PostgreSQL.
+# На других СУБД миграция ничего не делает.
+
+from django.db import migrations
+
+UTM_FIELDS = ('utm_source', 'utm_campaign', 'utm_content')
+# Префиксные индексы: utm_source и utm_campaign из 0009, utm_content из 0014
+PREFIX_FIELDS = ('utm_source', 'utm_campaign', 'utm_content')
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for field in UTM_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS api_vkuser_{field}_trgm '
+            f'ON api_vkuser USING gin (UPPER({field}::text) gin_trgm_ops)'
+        )
+    for field in PREFIX_FIELDS:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS api_vkuser_{field}_prefix')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in PREFIX_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS api_vkuser_{field}_prefix '
+            f'ON api_vkuser (UPPER({field}::text) text_pattern_ops)'
+        )
+    for field in UTM_FIELDS:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS api_vkuser_{field}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('api', '0019_shared_cache_table'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
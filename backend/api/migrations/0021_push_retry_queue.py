@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_utm_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushnotification',
+            name='retry_requested_at',
+            field=models.DateTimeField(blank=True, help_text='Действие админки ставит повтор в очередь команды retry_failed_pushes', null=True, verbose_name='Повтор ошибок запрошен'),
+        ),
+    ]
@@ -1,6 +1,6 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from urllib.parse import urlencode
-from django.utils import timezone
 import json
 
 # Create your models here.
@@ -19,14 +19,19 @@ class VKUser(models.Model):
     sex = models.IntegerField(null=True, blank=True, verbose_name="Пол (1-женский, 2-мужской)")
     bdate = models.CharField(max_length=20, blank=True, verbose_name="Дата рождения")
     
+    # Производные колонки для таргетинга (api/rules.py), заполняются при регистрации
+    birth_date = models.DateField(null=True, blank=True, db_index=True, editable=False, verbose_name="Дата рождения (с годом)")
+    vk_city_id = models.IntegerField(null=True, blank=True, db_index=True, editable=False, verbose_name="ID города VK")
+    vk_country_id = models.IntegerField(null=True, blank=True, db_index=True, editable=False, verbose_name="ID страны VK")
+    
     # Настройки уведомлений
     notifications_enabled = models.BooleanField(default=True, verbose_name="Уведомления разрешены")
     notifications_allowed = models.BooleanField(default=False, verbose_name="Пользователь разрешил уведомления в VK")
     
     # Данные активности
-    first_visit = models.DateTimeField(auto_now_add=True, verbose_name="Первый визит")
-    last_visit = models.DateTimeField(auto_now=True, verbose_name="Последний визит")
-    total_visits = models.IntegerField(default=1, verbose_name="Всего визитов")
+    first_visit = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Первый визит")
+    last_visit = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Последний визит")
+    total_visits = models.IntegerField(default=1, db_index=True, verbose_name="Всего визитов")
     
     # UTM данные первого визита (для аналитики)
     utm_source = models.CharField(max_length=200, blank=True, verbose_name="UTM Source")
@@ -68,7 +73,11 @@ class PushNotification(models.Model):
     ]
     
     title = models.CharField(max_length=100, verbose_name="Заголовок уведомления")
-    message = models.TextField(max_length=500, verbose_name="Текст сообщения")
+    message = models.TextField(
+        max_length=500, verbose_name="Текст сообщения",
+        help_text="Можно подставить поля пользователя: {first_name}, {last_name}, {city}, {country}; "
+                  "значение для пустого поля - {first_name|друг}",
+    )
     
     # Настройки таргетинга
     segment = models.CharField(max_length=20, choices=SEGMENT_CHOICES, default='all', verbose_name="Сегмент")
@@ -78,6 +87,34 @@ class PushNotification(models.Model):
     filter_city = models.CharField(max_length=100, blank=True, verbose_name="Фильтр по городу")
     filter_sex = models.IntegerField(null=True, blank=True, verbose_name="Фильтр по полу")
     filter_utm_source = models.CharField(max_length=200, blank=True, verbose_name="Фильтр по UTM Source")
+    audience_rule = models.JSONField(
+        null=True, blank=True, verbose_name="Правило аудитории",
+        help_text='Дополнительное условие, например {"and": [{"age": {"min": 18, "max": 35}}, {"visits": {"min": 3}}, '
+                  '{"city_id": [1, 2]}]}. Язык правил - api/rules.py',
+    )
+    
+    # Ограничение частоты (api/capping.py): пусто - значение по умолчанию из настроек, 0 - без ограничения
+    cap_interval_hours = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="Не чаще раза в N часов",
+        help_text="Пропустить пользователей, получивших любой пуш за последние N часов",
+    )
+    cap_per_day = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="Не больше N пушей за сутки",
+        help_text="Пропустить пользователей, получивших N пушей за текущие сутки",
+    )
+    
+    # Равномерная отправка (api/pacing.py): скорость или окно, не оба сразу
+    pace_per_minute = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="Скорость отправки (сообщений в минуту)",
+        help_text="Пусто - без ограничения скорости",
+    )
+    pace_window_minutes = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="Растянуть отправку на N минут",
+    )
+    pace_adaptive = models.BooleanField(
+        default=False, verbose_name="Замедлять при росте задержек бэкенда",
+        help_text="Снижать скорость, пока p95 ответа бэкенда выше PUSH_PACE_LATENCY_TARGET_MS",
+    )
     
     # Ссылка и действие
     action_url = models.URLField(max_length=500, blank=True, verbose_name="Ссылка при клике")
@@ -86,12 +123,17 @@ class PushNotification(models.Model):
     # Статус и планирование
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft', verbose_name="Статус")
     scheduled_time = models.DateTimeField(null=True, blank=True, verbose_name="Время отправки")
+    retry_requested_at = models.DateTimeField(
+        null=True, blank=True, verbose_name="Повтор ошибок запрошен",
+        help_text="Действие админки ставит повтор в очередь команды retry_failed_pushes",
+    )
     
     # Статистика
     total_sent = models.IntegerField(default=0, verbose_name="Отправлено")
     total_delivered = models.IntegerField(default=0, verbose_name="Доставлено")
     total_failed = models.IntegerField(default=0, verbose_name="Не доставлено")
     total_clicked = models.IntegerField(default=0, verbose_name="Переходов")
+    total_capped = models.IntegerField(default=0, verbose_name="Пропущено по лимиту частоты")
     
     # Даты
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
@@ -101,11 +143,38 @@ class PushNotification(models.Model):
     def __str__(self):
         return f"{self.title} ({self.get_status_display()})"
     
-    def get_target_users_queryset(self):
+    def clean(self):
+        from .personalization import compile_message
+        from .rules import validate_rule
+        
+        try:
+            compile_message(self.message or '')
+        except ValueError as e:
+            raise ValidationError({'message': str(e)})
+        if self.audience_rule:
+            try:
+                validate_rule(self.audience_rule)
+            except ValueError as e:
+                raise ValidationError({'audience_rule': str(e)})
+        if self.pace_per_minute and self.pace_window_minutes:
+            raise ValidationError({'pace_window_minutes': 'Укажите скорость отправки или окно, не оба сразу'})
+        if self.pace_adaptive and not self.is_paced:
+            raise ValidationError({'pace_adaptive': 'Замедление работает вместе со скоростью отправки или окном'})
+    
+    @property
+    def is_paced(self):
+        return bool(self.pace_per_minute or self.pace_window_minutes)
+    
+    def get_target_users_queryset(self, frequency_caps=True):
         """
         Возвращает queryset пользователей для отправки на основе сегмента и фильтров
+        
+        Args:
+            frequency_caps: Исключить пользователей, упирающихся в лимит частоты (api/capping.py)
         """
-        from datetime import timedelta
+        from .capping import capped_users
+        from .rules import rule_q
+        from .search import city_q, segment_q, utm_q
         
         if self.segment == 'custom' and self.target_users.exists():
             queryset = self.target_users.all()
@@ -113,20 +182,21 @@ class PushNotification(models.Model):
             queryset = VKUser.objects.filter(notifications_enabled=True, notifications_allowed=True)
         
         # Применяем сегментацию
-        if self.segment == 'active':
-            queryset = queryset.filter(last_visit__gte=timezone.now() - timedelta(days=7))
-        elif self.segment == 'inactive':
-            queryset = queryset.filter(last_visit__lt=timezone.now() - timedelta(days=7))
-        elif self.segment == 'new':
-            queryset = queryset.filter(first_visit__gte=timezone.now() - timedelta(days=3))
+        queryset = queryset.filter(segment_q(self.segment))
         
-        # Применяем фильтры
+        # Применяем фильтры (условия используют индексы поиска, см. api/search.py)
         if self.filter_city:
-            queryset = queryset.filter(city__icontains=self.filter_city)
+            queryset = queryset.filter(city_q(self.filter_city))
         if self.filter_sex:
             queryset = queryset.filter(sex=self.filter_sex)
         if self.filter_utm_source:
-            queryset = queryset.filter(utm_source__icontains=self.filter_utm_source)
+            queryset = queryset.filter(utm_q('utm_source', self.filter_utm_source))
+        if self.audience_rule:
+            queryset = queryset.filter(rule_q(self.audience_rule))
+        
+        capped = capped_users(self) if frequency_caps else None
+        if capped is not None:
+            queryset = queryset.filter(~capped)
         
         return queryset
     
@@ -153,7 +223,12 @@ class PushLog(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name="Статус")
     error_message = models.TextField(blank=True, verbose_name="Сообщение об ошибке")
     
-    sent_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата отправки")
+    # Повторная отправка (api/retries.py): код ошибки VK (пусто - сетевая ошибка) и можно ли повторить
+    error_code = models.IntegerField(null=True, blank=True, verbose_name="Код ошибки VK")
+    retryable = models.BooleanField(default=False, verbose_name="Можно повторить")
+    attempts = models.PositiveSmallIntegerField(default=1, verbose_name="Попыток отправки")
+    
+    sent_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Дата отправки")
     clicked_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата клика")
     
     # VK API response
@@ -166,6 +241,31 @@ class PushLog(models.Model):
         verbose_name = "Лог уведомления"
         verbose_name_plural = "Логи уведомлений"
         ordering = ['-sent_at']
+        indexes = [
+            # Ошибки кампании, которые можно отправить повторно
+            models.Index(fields=['notification', 'status', 'retryable'], name='api_pushlog_retry'),
+        ]
+
+
+class PushLedger(models.Model):
+    """
+    Последние пуши пользователя для ограничения частоты (api/capping.py)
+    
+    Одна строка на пользователя: проверка лимита не читает PushLog
+    """
+    user = models.OneToOneField(
+        VKUser, on_delete=models.CASCADE, primary_key=True, related_name='push_ledger', verbose_name="Пользователь",
+    )
+    last_push_at = models.DateTimeField(verbose_name="Последний пуш")
+    window_started_at = models.DateTimeField(verbose_name="Начало суточного окна")
+    window_count = models.IntegerField(default=0, verbose_name="Пушей в окне")
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.window_count} с {self.window_started_at:%d.%m %H:%M}"
+    
+    class Meta:
+        verbose_name = "Журнал частоты пушей"
+        verbose_name_plural = "Журнал частоты пушей"
 
 class Offer(models.Model):
     """
@@ -200,8 +300,8 @@ class Offer(models.Model):
 
 class MFO(models.Model):
     name = models.CharField(max_length=100, verbose_name="Название")
-    logo_url = models.URLField(max_length=200, blank=True, null=True, verbose_name="URL логотипа")
-    link = models.URLField(max_length=200, verbose_name="Ссылка на оффер")
+    logo_url = models.URLField(max_length=500, blank=True, null=True, verbose_name="URL логотипа")
+    link = models.URLField(max_length=500, verbose_name="Ссылка на оффер")
     sum_min = models.IntegerField(verbose_name="Мин. сумма")
     sum_max = models.IntegerField(verbose_name="Макс. сумма")
     term_min = models.IntegerField(verbose_name="Мин. срок (дни)")
@@ -216,6 +316,20 @@ class MFO(models.Model):
     get_methods = models.TextField(blank=True, help_text="Перечислите через точку с запятой", verbose_name="Способы получения")
     repay_methods = models.TextField(blank=True, help_text="Перечислите через точку с запятой", verbose_name="Способы погашения")
 
+    # Синхронизация с витриной партнера (python manage.py sync_mfo_catalog)
+    external_id = models.CharField(max_length=64, unique=True, null=True, blank=True, verbose_name="Ключ партнера (ИНН)")
+    source = models.CharField(max_length=50, blank=True, verbose_name="Источник")
+    promo_text = models.CharField(max_length=500, blank=True, verbose_name="Подпись оффера")
+    sort_order = models.IntegerField(default=0, verbose_name="Позиция в витрине")
+    is_active = models.BooleanField(default=True, db_index=True, verbose_name="Показывать в витрине")
+    content_hash = models.CharField(max_length=40, blank=True, editable=False, verbose_name="Хэш данных партнера")
+    synced_at = models.DateTimeField(null=True, blank=True, verbose_name="Синхронизировано")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменено")
+
+    # Локальная копия логотипа (api/logos.py): имя файлов вариантов и URL, с которого они сделаны
+    logo_file = models.CharField(max_length=64, blank=True, editable=False, verbose_name="Файл логотипа")
+    logo_source = models.URLField(max_length=500, blank=True, editable=False, verbose_name="Исходный логотип")
+
     def __str__(self):
         return self.name
     
@@ -223,37 +337,108 @@ class MFO(models.Model):
         verbose_name = "МФО"
         verbose_name_plural = "МФО"
 
+class TrackingDimension(models.Model):
+    """
+    Справочник значений параметров UTM событий (словарное кодирование)
+
+    События хранят небольшой целочисленный ключ вместо повторяющейся строки.
+    Только для параметров с небольшим числом значений: url, referrer и utm_term
+    (подписанные параметры запуска, ID пользователя) почти у каждого события свои
+    и хранятся обычными колонками UTMTracking.
+    """
+    KIND_CHOICES = [
+        ('utm_source', 'UTM Source'),
+        ('utm_medium', 'UTM Medium'),
+        ('utm_campaign', 'UTM Campaign'),
+        ('utm_content', 'UTM Content'),
+        ('vk_ad_id', 'VK Ad ID'),
+        ('vk_ref', 'VK Ref'),
+        ('vk_ref_source', 'VK Ref Source'),
+        ('vk_platform', 'VK Platform'),
+        ('event_type', 'Тип события'),
+    ]
+    
+    id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Параметр")
+    value = models.CharField(max_length=500, verbose_name="Значение")
+    
+    def __str__(self):
+        return self.value
+    
+    class Meta:
+        verbose_name = "Значение UTM параметра"
+        verbose_name_plural = "Значения UTM параметров"
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'value'], name='api_trackingdimension_kind_value'),
+        ]
+
+
+class UserAgent(models.Model):
+    """
+    Уникальные User-Agent (дедупликация по SHA-1)
+    """
+    id = models.AutoField(primary_key=True)
+    hash = models.CharField(max_length=40, unique=True, verbose_name="SHA-1")
+    value = models.TextField(verbose_name="User Agent")
+    
+    def __str__(self):
+        return self.value
+    
+    class Meta:
+        verbose_name = "User Agent"
+        verbose_name_plural = "User Agents"
+
+
+def dimension_field(kind, verbose_name, db_index=False):
+    return models.ForeignKey(
+        TrackingDimension, on_delete=models.PROTECT, null=True, blank=True, related_name='+',
+        db_index=db_index, limit_choices_to={'kind': kind}, verbose_name=verbose_name,
+    )
+
+
 class UTMTracking(models.Model):
     """
     Модель для отслеживания UTM параметров и аналитики
+    
+    Повторяющиеся строковые параметры хранятся ключами TrackingDimension (запись и чтение -
+    api/tracking.py), url, referrer и utm_term - как есть, исходные данные запроса - один раз,
+    в сжатом виде (payload).
     """
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Время события")
-    user_id = models.CharField(max_length=100, blank=True, null=True, verbose_name="ID пользователя")
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Время события")
+    # VK ID пользователя (BIGINT). Связь с VKUser без ограничения в БД:
+    # события приходят и до регистрации пользователя
+    user = models.ForeignKey(
+        VKUser, to_field='vk_user_id', db_column='vk_user_id', on_delete=models.DO_NOTHING,
+        db_constraint=False, db_index=False, null=True, blank=True, related_name='utm_events',
+        verbose_name="Пользователь",
+    )
     
     # UTM параметры
-    utm_source = models.CharField(max_length=200, blank=True, verbose_name="UTM Source")
-    utm_medium = models.CharField(max_length=200, blank=True, verbose_name="UTM Medium")
-    utm_campaign = models.CharField(max_length=200, blank=True, verbose_name="UTM Campaign")
-    utm_content = models.CharField(max_length=200, blank=True, verbose_name="UTM Content")
-    utm_term = models.CharField(max_length=200, blank=True, verbose_name="UTM Term")
+    utm_source = dimension_field('utm_source', "UTM Source", db_index=True)
+    utm_medium = dimension_field('utm_medium', "UTM Medium")
+    utm_campaign = dimension_field('utm_campaign', "UTM Campaign", db_index=True)
+    utm_content = dimension_field('utm_content', "UTM Content")
+    utm_term = models.TextField(blank=True, verbose_name="UTM Term")
     
     # VK параметры
-    vk_ad_id = models.CharField(max_length=100, blank=True, verbose_name="VK Ad ID")
-    vk_ref = models.CharField(max_length=200, blank=True, verbose_name="VK Ref")
-    vk_ref_source = models.CharField(max_length=200, blank=True, verbose_name="VK Ref Source")
-    vk_platform = models.CharField(max_length=100, blank=True, verbose_name="VK Platform")
+    vk_ad_id = dimension_field('vk_ad_id', "VK Ad ID")
+    vk_ref = dimension_field('vk_ref', "VK Ref")
+    vk_ref_source = dimension_field('vk_ref_source', "VK Ref Source")
+    vk_platform = dimension_field('vk_platform', "VK Platform")
     
     # Дополнительные параметры
-    url = models.URLField(max_length=500, blank=True, verbose_name="URL страницы")
-    referrer = models.URLField(max_length=500, blank=True, verbose_name="Referrer")
-    user_agent = models.TextField(blank=True, verbose_name="User Agent")
+    url = models.TextField(blank=True, verbose_name="URL страницы")
+    referrer = models.TextField(blank=True, verbose_name="Referrer")
+    user_agent = models.ForeignKey(
+        UserAgent, on_delete=models.PROTECT, null=True, blank=True, related_name='+',
+        db_index=False, verbose_name="User Agent",
+    )
     
-    # Полные данные в JSON формате
-    full_utm_data = models.JSONField(default=dict, verbose_name="Полные UTM данные")
-    full_user_data = models.JSONField(default=dict, verbose_name="Полные данные пользователя")
+    # Исходные данные запроса (JSON, сжатый zlib при UTM_PAYLOAD_COMPRESSION)
+    payload = models.BinaryField(null=True, blank=True, verbose_name="Исходные данные")
     
     # Тип события
-    event_type = models.CharField(max_length=50, default='page_view', verbose_name="Тип события")
+    event_type = dimension_field('event_type', "Тип события")
     
     def __str__(self):
         return f"UTM Tracking - {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')} - {self.user_id or 'Anonymous'}"
@@ -261,4 +446,37 @@ class UTMTracking(models.Model):
     class Meta:
         verbose_name = "UTM Отслеживание"
         verbose_name_plural = "UTM Отслеживание"
-        ordering = ['-timestamp']
\ No newline at end of file
+        ordering = ['-timestamp']
+        indexes = [
+            # Хронология событий пользователя (keyset пагинация по timestamp, id)
+            models.Index(fields=['user', '-timestamp', '-id'], name='api_utm_user_timeline'),
+        ]
+
+
+class RequestProfile(models.Model):
+    """
+    Профиль запроса, снятый по требованию сотрудника (файлы лежат в PROFILE_DIR)
+    """
+    profile_id = models.CharField(max_length=32, unique=True, verbose_name="ID профиля")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата")
+    requested_by = models.CharField(max_length=150, blank=True, verbose_name="Сотрудник")
+
+    method = models.CharField(max_length=10, verbose_name="Метод")
+    path = models.CharField(max_length=500, verbose_name="Путь")
+    view_name = models.CharField(max_length=200, blank=True, verbose_name="Представление")
+    status_code = models.IntegerField(verbose_name="Код ответа")
+
+    duration_ms = models.FloatField(verbose_name="Время (мс)")
+    samples = models.IntegerField(default=0, verbose_name="Сэмплов стека")
+    sql_count = models.IntegerField(default=0, verbose_name="SQL запросов")
+    sql_ms = models.FloatField(default=0, verbose_name="Время SQL (мс)")
+    http_count = models.IntegerField(default=0, verbose_name="Внешних HTTP запросов")
+    http_ms = models.FloatField(default=0, verbose_name="Время внешних HTTP (мс)")
+
+    def __str__(self):
+        return f"{self.method} {self.path} - {self.duration_ms:.0f} мс"
+
+    class Meta:
+        verbose_name = "Профиль запроса"
+        verbose_name_plural = "Профили запросов"
+        ordering = ['-created_at']
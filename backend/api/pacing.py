@@ -0,0 +1,125 @@
+"""
+Равномерная отправка пушей (paced delivery)
+
+Пуш на всю аудиторию за несколько минут приводит в Mini App тысячи пользователей
+одновременно: user_register, utm_track, push_click_track и mfo_list получают
+всплеск сразу после отправки. Уведомление может задать скорость отправки:
+    pace_per_minute     - сообщений в минуту;
+    pace_window_minutes - растянуть отправку на N минут (скорость считается
+                          от числа получателей).
+Pacer выдает сообщения равномерно: вызовы VK уменьшаются до batch_size получателей
+(примерно вызов в секунду), перед каждым вызовом Pacer ждет, пока не подойдет
+его время по расписанию. Если отправка отстала (медленный ответ VK), догоняет
+не больше чем на CATCH_UP секунд, без залпа.
+
+pace_adaptive - замедление при росте задержек бэкенда. Метрики api/metrics.py
+живут в памяти каждого воркера и недоступны процессу отправки, поэтому раз
+в PUSH_PACE_PROBE_INTERVAL секунд Pacer сам запрашивает PUSH_PACE_PROBE_URL
+(по умолчанию витрина МФО - один из endpoint'ов со всплеском) и считает p95
+по последним PROBE_SAMPLES замерам. p95 выше PUSH_PACE_LATENCY_TARGET_MS -
+скорость вдвое ниже (но не ниже MIN_FACTOR от заданной), p95 ниже половины
+порога - скорость постепенно возвращается. С замедлением окно отправки
+может закончиться позже заданного.
+"""
+import logging
+import math
+import time
+from collections import deque
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Отставание от расписания, которое можно наверстать залпом (секунды)
+CATCH_UP = 1.0
+# Замеров задержки для p95 и минимум замеров для решения
+PROBE_SAMPLES = 20
+MIN_PROBE_SAMPLES = 3
+# Нижняя граница скорости при замедлении (доля заданной) и шаг восстановления
+MIN_FACTOR = 0.1
+RECOVERY_STEP = 1.25
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+class Pacer:
+    """
+    Расписание отправки с заданной скоростью
+    """
+
+    def __init__(self, per_minute, adaptive=False):
+        self.per_minute = per_minute
+        self.adaptive = adaptive
+        self.factor = 1.0
+        self.latencies = deque(maxlen=PROBE_SAMPLES)
+        self.probed_at = None
+        self.next_at = time.monotonic()
+
+    def batch_size(self, limit):
+        """
+        Получателей на один вызов: примерно вызов в секунду, не больше limit
+        """
+        return max(1, min(limit, int(self.per_minute * self.factor / 60)))
+
+    def wait(self, count=1):
+        """
+        Ждет времени отправки следующих count сообщений
+        """
+        if self.adaptive:
+            self.adapt()
+        delay = self.next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_at = max(self.next_at, time.monotonic() - CATCH_UP) + count * 60.0 / (self.per_minute * self.factor)
+
+    def probe(self):
+        """
+        Время ответа бэкенда (секунды); ошибка или таймаут считаются как таймаут
+        """
+        timeout = settings.PUSH_PACE_PROBE_TIMEOUT
+        started = time.perf_counter()
+        try:
+            requests.get(settings.PUSH_PACE_PROBE_URL, timeout=timeout).raise_for_status()
+        except requests.RequestException:
+            return timeout
+        return time.perf_counter() - started
+
+    def adapt(self):
+        now = time.monotonic()
+        if self.probed_at is not None and now - self.probed_at < settings.PUSH_PACE_PROBE_INTERVAL:
+            return
+        self.probed_at = now
+        self.latencies.append(self.probe())
+        if len(self.latencies) < MIN_PROBE_SAMPLES:
+            return
+
+        p95_ms = percentile(self.latencies, 0.95) * 1000
+        target_ms = settings.PUSH_PACE_LATENCY_TARGET_MS
+        if p95_ms > target_ms and self.factor > MIN_FACTOR:
+            self.factor = max(self.factor / 2, MIN_FACTOR)
+        elif p95_ms < target_ms / 2 and self.factor < 1.0:
+            self.factor = min(self.factor * RECOVERY_STEP, 1.0)
+        else:
+            return
+        # После смены скорости решение принимается по новым замерам
+        self.latencies.clear()
+        logger.info(
+            "push_pace p95_ms=%.0f target_ms=%s rate_per_minute=%.0f",
+            p95_ms, target_ms, self.per_minute * self.factor,
+        )
+
+
+def pacer_for(notification, total):
+    """
+    Pacer для уведомления с равномерной отправкой или None (отправка без пауз)
+    """
+    per_minute = notification.pace_per_minute
+    if not per_minute and notification.pace_window_minutes and total:
+        per_minute = math.ceil(total / notification.pace_window_minutes)
+    if not per_minute:
+        return None
+    return Pacer(per_minute, adaptive=notification.pace_adaptive)
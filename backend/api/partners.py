@@ -0,0 +1,267 @@
+"""
+Интеграции с партнерами: витрина офферов itfinance.online и постбэки leads.tech
+
+Здесь собрана логика, общая для синхронных (api.views) и асинхронных
+(api.async_views) представлений и синхронизации каталога (api.catalog_sync):
+построение запросов и разбор ответов. Сетевые вызовы выполняют вызывающие
+модули своим HTTP-клиентом.
+"""
+import re
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+APPROVAL_CHANCE_RE = re.compile(r'(\d+)%')
+INSTANT_PAYOUT_RE = re.compile(r'моментально', re.IGNORECASE)
+TWO_CLICKS_RE = re.compile(r'в 2 клика', re.IGNORECASE)
+
+# Очистка пустых параметров после замены плейсхолдеров
+EMPTY_PARAM_AT_END_RE = re.compile(r'[&?]\w+=$')
+EMPTY_PARAM_IN_MIDDLE_RE = re.compile(r'[&?]\w+=[&]')
+QUESTION_AMPERSAND_RE = re.compile(r'\?&')
+DOUBLE_AMPERSAND_RE = re.compile(r'&&+')
+TRAILING_SEPARATOR_RE = re.compile(r'[?&]$')
+
+LEADS_TECH_DATA_FIELDS = (
+    'user_id', 'first_name', 'last_name', 'email', 'phone',
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term',
+    'vk_user_id', 'vk_ad_id', 'vk_ref', 'vk_ref_source', 'vk_platform',
+    'click_id', 'sub_id', 's1', 's2', 's3', 's4', 's5', 's6', 's7', 's8',
+    'timestamp', 'url', 'referrer', 'user_agent',
+)
+
+
+# =============================================================================
+# ITFINANCE
+# =============================================================================
+
+def parse_approval_chance(label_text, order):
+    """
+    Шанс одобрения из подписи оффера ("Одобрение 95%") или оценка по позиции в витрине
+    """
+    match = APPROVAL_CHANCE_RE.search(label_text)
+    if match:
+        return int(match.group(1))
+    return max(100 - order * 5, 75)
+
+
+def parse_payout_speed_hours(label_text, order):
+    """
+    Скорость выплаты из подписи оффера или оценка по позиции в витрине
+    """
+    if INSTANT_PAYOUT_RE.search(label_text):
+        return 0.5
+    if TWO_CLICKS_RE.search(label_text):
+        return 1.0
+    return max(24 - order * 2, 1)
+
+
+def normalize_itfinance_item(item):
+    """
+    Преобразует оффер витрины itfinance.online в поля модели MFO
+
+    external_id - ИНН организации (стабильный ключ для синхронизации),
+    для офферов без ИНН - название продукта.
+
+    Returns:
+        dict | None: Поля МФО или None, если в элементе нет оффера
+    """
+    offer = item.get('offer') or {}
+    name = (offer.get('product_name') or '').strip()
+    external_id = str(offer.get('inn') or '').strip() or (f'name:{name}' if name else '')
+    if not external_id:
+        return None
+
+    label_text = item.get('label_text') or ''
+    order = item.get('order') or 5
+
+    return {
+        'external_id': external_id[:64],
+        'name': name[:100],
+        'logo_url': offer.get('image_link') or '',
+        'link': item.get('link') or '',
+        'sum_min': int(float(offer.get('amount_min') or 0)),
+        'sum_max': int(float(offer.get('amount_max') or 0)),
+        'term_min': int(offer.get('loan_term_from') or 0),
+        'term_max': int(offer.get('loan_term_to') or 0),
+        'rate': float(offer.get('daily_percentage_min', 0.8) or 0),
+        'approval_chance': parse_approval_chance(label_text, order),
+        'payout_speed_hours': parse_payout_speed_hours(label_text, order),
+        'promo_text': label_text,
+        'sort_order': order,
+    }
+
+
+def normalize_itfinance_feed(data):
+    """
+    Офферы витрины itfinance.online в полях модели MFO (без повторов external_id)
+    """
+    mfos = {}
+    for item in data.get('items', []):
+        mfo = normalize_itfinance_item(item)
+        if mfo is not None:
+            mfos.setdefault(mfo['external_id'], mfo)
+    return list(mfos.values())
+
+
+# =============================================================================
+# LEADS.TECH
+# =============================================================================
+
+def get_client_ip(request):
+    """
+    IP адрес пользователя с учетом прокси nginx
+    """
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def build_leads_tech_data(data, ip_address):
+    """
+    Данные пользователя и UTM метки в формате leads.tech
+    """
+    leads_tech_data = {field: data.get(field, '') for field in LEADS_TECH_DATA_FIELDS}
+    leads_tech_data['ip_address'] = ip_address
+    return leads_tech_data
+
+
+def build_leads_tech_params(data):
+    """
+    Параметры s4/s5/s6 для leads.tech (формат офферов)
+
+    Поддерживаем стандартные VK параметры И старый формат для обратной совместимости
+    Приоритет: campaign_id/banner_id (VK стандарт) → ref/ref_source (старый формат)
+    """
+    return {
+        's4': (data.get('s4') or
+               data.get('campaign_id') or  # VK стандарт: {{campaign_id}}
+               data.get('utm_campaign') or  # Стандартный UTM
+               data.get('ref') or           # Старый формат
+               data.get('vk_ref') or ''),
+        's5': (data.get('s5') or
+               data.get('banner_id') or     # VK стандарт: {{banner_id}}
+               data.get('utm_content') or   # Стандартный UTM
+               data.get('ref_source') or    # Старый формат
+               data.get('vk_ref_source') or ''),
+        's6': (data.get('s6') or
+               data.get('user_id') or       # Основной ID
+               data.get('utm_term') or      # VK может передать в utm_term
+               data.get('vk_user_id') or ''),
+    }
+
+
+def build_leads_tech_url(base_url, leads_tech_params):
+    """
+    Подставляет параметры в ссылку оффера leads.tech
+
+    Плейсхолдеры {ref}, {ref_source}, {user_id} заменяются на реальные значения,
+    пустые параметры удаляются, недостающие параметры добавляются в конец.
+    """
+    # ФИНАЛЬНОЕ ИСПРАВЛЕНИЕ: приводим все значения к строке перед заменой
+    url = base_url.replace('{ref}', str(leads_tech_params.get('s4', '')))
+    url = url.replace('{ref_source}', str(leads_tech_params.get('s5', '')))
+    url = url.replace('{user_id}', str(leads_tech_params.get('s6', '')))
+
+    # Удаляем параметры вида &param= или ?param=
+    url = EMPTY_PARAM_AT_END_RE.sub('', url)  # в конце
+    url = EMPTY_PARAM_IN_MIDDLE_RE.sub('&', url)  # в середине
+    url = QUESTION_AMPERSAND_RE.sub('?', url)  # ?& -> ?
+    url = DOUBLE_AMPERSAND_RE.sub('&', url)  # && -> &
+    url = TRAILING_SEPARATOR_RE.sub('', url)  # удаляем ? или & в конце
+
+    # Если в leads_tech_params есть значения, но их нет в базовой ссылке
+    params_to_add = []
+    for key, value in leads_tech_params.items():
+        if value and key not in url:
+            params_to_add.append(f"{key}={str(value)}") # Приводим к строке
+
+    if params_to_add:
+        separator = "&" if "?" in url else "?"
+        url = url + separator + "&".join(params_to_add)
+
+    # На стендах постбэки уходят в локальную заглушку (run_partner_stubs)
+    override = getattr(settings, 'LEADS_TECH_BASE_URL_OVERRIDE', '')
+    if override:
+        parts = urlsplit(url)
+        url = override.rstrip('/') + parts.path + (f'?{parts.query}' if parts.query else '')
+
+    return url
+
+
+def leads_tech_request_headers(data):
+    """
+    Заголовки пользователя для запроса в leads.tech
+    """
+    return {
+        'User-Agent': data.get('user_agent', ''),
+        'Referer': data.get('referrer', ''),
+    }
+
+
+# =============================================================================
+# UTM ОТСЛЕЖИВАНИЕ
+# =============================================================================
+
+def build_utm_tracking(data):
+    """
+    Параметры события UTMTracking из данных utm_track (utm_params + user_data)
+
+    Записывается через api.tracking.create_tracking.
+    """
+    utm_params = data.get('utm_params', {})
+    user_data = data.get('user_data', {})
+
+    return {
+        'user_id': user_data.get('id') or utm_params.get('vk_user_id') or utm_params.get('user_id'),
+
+        # UTM параметры
+        'utm_source': utm_params.get('utm_source', ''),
+        'utm_medium': utm_params.get('utm_medium', ''),
+        'utm_campaign': utm_params.get('utm_campaign', ''),
+        'utm_content': utm_params.get('utm_content', ''),
+        'utm_term': utm_params.get('utm_term', ''),
+
+        # VK параметры
+        'vk_ad_id': utm_params.get('vk_ad_id') or utm_params.get('ad_id', ''),
+        'vk_ref': utm_params.get('vk_ref') or utm_params.get('ref', ''),
+        'vk_ref_source': utm_params.get('vk_ref_source') or utm_params.get('ref_source', ''),
+        'vk_platform': utm_params.get('vk_platform', ''),
+
+        # Дополнительные данные
+        'url': data.get('url', ''),
+        'referrer': data.get('referrer', ''),
+        'user_agent': data.get('user_agent', ''),
+
+        # Исходные данные запроса (сохраняются один раз)
+        'payload': {'utm_params': utm_params, 'user_data': user_data},
+
+        # Тип события
+        'event_type': data.get('event_type', 'page_view'),
+    }
+
+
+def build_arbitrage_tracking(data):
+    """
+    Параметры события UTMTracking для arbitrage_send
+    """
+    return {
+        'user_id': data.get('user_id'),
+        'utm_source': data.get('utm_source', ''),
+        'utm_medium': data.get('utm_medium', ''),
+        'utm_campaign': data.get('utm_campaign', ''),
+        'utm_content': data.get('utm_content', ''),
+        'utm_term': data.get('utm_term', ''),
+        'vk_ad_id': data.get('vk_ad_id', ''),
+        'vk_ref': data.get('vk_ref', ''),
+        'vk_ref_source': data.get('vk_ref_source', ''),
+        'vk_platform': data.get('vk_platform', ''),
+        'url': data.get('url', ''),
+        'referrer': data.get('referrer', ''),
+        'user_agent': data.get('user_agent', ''),
+        'payload': data,
+        'event_type': 'arbitrage_send',
+    }
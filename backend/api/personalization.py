@@ -0,0 +1,91 @@
+"""
+Персонализация текста пушей
+
+В тексте уведомления можно использовать поля пользователя:
+    {first_name}, {last_name}, {city}, {country}
+и значение на случай пустого поля: {first_name|друг}. Фигурные скобки
+в тексте записываются как {{ и }}.
+
+Шаблон разбирается один раз на кампанию (compile_message): получается список
+кусков текста и подстановок, и отрисовка для получателя - склейка строк без
+повторного разбора. Получатели с одинаковым итоговым текстом отправляются
+общими вызовами notifications.sendMessage (services.deliver), поэтому шаблон
+с {city} по-прежнему уходит пачками по 100 ID. С {first_name} и {last_name}
+текст почти у каждого получателя свой и вызовы идут по одному ID: админка
+предупреждает об этом при сохранении, а send_push_notification пишет в лог
+среднее число ID на вызов.
+"""
+import re
+
+PLACEHOLDERS = ('first_name', 'last_name', 'city', 'country')
+TOKEN_RE = re.compile(r'\{\{|\}\}|\{(\w+)(?:\|([^{}]*))?\}')
+# Поля, которые почти у каждого получателя свои (общий вызов VK вырождается в вызов на одного)
+UNIQUE_FIELDS = ('first_name', 'last_name')
+
+
+class MessageTemplate:
+    """
+    Разобранный текст уведомления
+    """
+
+    def __init__(self, parts):
+        # Куски текста (str) и подстановки (поле, значение по умолчанию)
+        self.parts = parts
+        self.fields = tuple(dict.fromkeys(part[0] for part in parts if isinstance(part, tuple)))
+
+    @property
+    def is_static(self):
+        return not self.fields
+
+    @property
+    def unique_fields(self):
+        return tuple(field for field in self.fields if field in UNIQUE_FIELDS)
+
+    def render(self, user):
+        """
+        Текст для получателя (VKUser или объект с полями self.fields)
+        """
+        if self.is_static:
+            return ''.join(self.parts)
+        return ''.join(
+            part if isinstance(part, str) else (getattr(user, part[0]) or '').strip() or part[1]
+            for part in self.parts
+        )
+
+
+def literal(text):
+    if '{' in text or '}' in text:
+        raise ValueError('Одиночная фигурная скобка: подстановка пишется как {first_name}, скобка - как {{ или }}')
+    return text
+
+
+def compile_message(message):
+    """
+    Разбирает текст уведомления
+
+    Raises:
+        ValueError: Неизвестное поле или одиночная фигурная скобка
+    """
+    parts = []
+    position = 0
+    for match in TOKEN_RE.finditer(message):
+        parts.append(literal(message[position:match.start()]))
+        position = match.end()
+        token = match.group(0)
+        if token in ('{{', '}}'):
+            parts.append(token[0])
+            continue
+        field, default = match.group(1), match.group(2)
+        if field not in PLACEHOLDERS:
+            raise ValueError(f'Неизвестное поле {{{field}}}, доступны: {", ".join(PLACEHOLDERS)}')
+        parts.append((field, (default or '').strip()))
+    parts.append(literal(message[position:]))
+
+    # Соседние куски текста склеиваются заранее
+    merged = []
+    for part in parts:
+        if isinstance(part, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += part
+        elif part != '':
+            merged.append(part)
+    return MessageTemplate(merged)
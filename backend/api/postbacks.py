@@ -0,0 +1,58 @@
+"""
+Фоновая отправка постбэков партнерам (leads.tech)
+
+Запрос к партнеру не должен задерживать ответ пользователю: постбэк ставится
+в очередь пула потоков и отправляется после коммита транзакции.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.db import transaction
+
+from .metrics import observe_upstream
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_session = requests.Session()
+
+
+def get_executor():
+    """
+    Пул потоков для постбэков (создается лениво в каждом воркере)
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'POSTBACK_WORKERS', 4),
+                    thread_name_prefix='postback',
+                )
+    return _executor
+
+
+def send_leads_tech_postback(url, headers):
+    """
+    Синхронная отправка постбэка в leads.tech
+    """
+    try:
+        with observe_upstream('leads_tech'):
+            response = _session.get(url, timeout=10, headers=headers)
+        if response.status_code == 200:
+            logger.info(f"✅ [Leads.Tech] Постбэк отправлен: {response.status_code}")
+        else:
+            logger.error(f"⚠️ [Leads.Tech] Ошибка постбэка: {response.status_code} - {response.text[:500]}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"⚠️ [Leads.Tech] Ошибка соединения при отправке постбэка: {e}")
+
+
+def enqueue_leads_tech_postback(url, headers):
+    """
+    Ставит постбэк в очередь; отправка начнется после коммита текущей транзакции
+    """
+    transaction.on_commit(lambda: get_executor().submit(send_leads_tech_postback, url, headers))
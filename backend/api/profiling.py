@@ -0,0 +1,186 @@
+"""
+Профилирование отдельных запросов по требованию сотрудников
+
+Профиль включается для одного запроса:
+    - параметром ?_profile=1 для сотрудника, вошедшего в админку (is_staff);
+    - заголовком X-Profile-Token с подписанным токеном (python manage.py create_profile_token),
+      например для запросов из Mini App.
+
+Сэмплирующий профайлер раз в PROFILE_SAMPLE_INTERVAL_MS снимает стек потока запроса.
+Результат сохраняется в PROFILE_DIR:
+    <id>.folded - стеки в формате flamegraph.pl / speedscope ("a;b;c количество");
+    <id>.json   - хронология SQL запросов и внешних HTTP запросов (observe_upstream).
+Список профилей - в админке (RequestProfile).
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+
+PROFILE_QUERY_FLAG = '_profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE_TOKEN'
+PROFILE_TOKEN_SALT = 'api.profiling'
+
+# Профиль текущего запроса (для записи внешних HTTP запросов из observe_upstream)
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+
+def make_profile_token(username):
+    return signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).sign_object({'user': username})
+
+
+def read_profile_token(token):
+    """
+    Имя сотрудника из токена или None, если токен неверный или просрочен
+    """
+    try:
+        payload = signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).unsign_object(
+            token, max_age=settings.PROFILE_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        return None
+    return payload.get('user')
+
+
+def profile_requested_by(request):
+    """
+    Кто запросил профиль (имя сотрудника) или None
+    """
+    token = request.META.get(PROFILE_HEADER)
+    if token:
+        return read_profile_token(token)
+
+    if PROFILE_QUERY_FLAG in request.GET:
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated and user.is_staff:
+            return user.get_username()
+    return None
+
+
+class StackSampler(threading.Thread):
+    """
+    Снимает стек потока thread_id раз в interval секунд
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            stack = ';'.join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in sorted(self.stacks.items())) + '\n'
+
+
+class RequestProfile:
+    """
+    Сбор данных одного запроса: сэмплы стека, SQL и внешние HTTP запросы
+    """
+
+    def __init__(self, requested_by):
+        self.id = uuid.uuid4().hex
+        self.requested_by = requested_by
+        self.started = time.perf_counter()
+        self.sql = []
+        self.http = []
+        self.sampler = StackSampler(threading.get_ident(), settings.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+
+    def offset_ms(self, moment):
+        return round((moment - self.started) * 1000, 3)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql.append({
+                'start_ms': self.offset_ms(started),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                'sql': sql,
+            })
+
+    def record_upstream(self, upstream, started, duration, outcome):
+        self.http.append({
+            'upstream': upstream,
+            'start_ms': self.offset_ms(started),
+            'duration_ms': round(duration * 1000, 3),
+            'outcome': outcome,
+        })
+
+    def start(self):
+        self.token = current_profile.set(self)
+        self.sampler.start()
+
+    def stop(self):
+        self.sampler.stop()
+        current_profile.reset(self.token)
+        self.duration_ms = round((time.perf_counter() - self.started) * 1000, 3)
+
+    def save(self, request, response, view_name):
+        """
+        Записывает файлы профиля и строку RequestProfile для админки
+        """
+        from .models import RequestProfile as RequestProfileRecord
+
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(settings.PROFILE_DIR, f'{self.id}.folded'), 'w', encoding='utf-8') as f:
+            f.write(self.sampler.folded())
+        with open(os.path.join(settings.PROFILE_DIR, f'{self.id}.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'id': self.id,
+                'method': request.method,
+                'path': request.path,
+                'view': view_name,
+                'status': response.status_code,
+                'duration_ms': self.duration_ms,
+                'samples': self.sampler.samples,
+                'sql': self.sql,
+                'http': self.http,
+            }, f, ensure_ascii=False, indent=2)
+
+        return RequestProfileRecord.objects.create(
+            profile_id=self.id,
+            requested_by=self.requested_by or '',
+            method=request.method,
+            path=request.path[:500],
+            view_name=view_name[:200],
+            status_code=response.status_code,
+            duration_ms=self.duration_ms,
+            samples=self.sampler.samples,
+            sql_count=len(self.sql),
+            sql_ms=round(sum(query['duration_ms'] for query in self.sql), 3),
+            http_count=len(self.http),
+            http_ms=round(sum(call['duration_ms'] for call in self.http), 3),
+        )
+
+
+def record_upstream(upstream, started, duration, outcome):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.record_upstream(upstream, started, duration, outcome)
@@ -0,0 +1,172 @@
+"""
+Бюджеты SQL запросов для представлений API
+
+Каждое представление объявляет, сколько запросов и строк оно может использовать:
+
+    @query_budget(queries=3, rows=200)
+    @api_view(['GET'])
+    def offers_list(request): ...
+
+QueryBudgetMiddleware считает запросы и строки (cursor.rowcount, на PostgreSQL
+это количество строк в результате) и при превышении бюджета:
+    - в режиме 'raise' (по умолчанию при DEBUG) выбрасывает QueryBudgetExceeded,
+      поэтому регрессия падает в dev окружении и в тестах через test client;
+    - в режиме 'log' пишет предупреждение с EXPLAIN самых дорогих запросов;
+    - в режиме 'off' ничего не делает.
+
+Запросы сессии и пользователя (аутентификация) не учитываются.
+Для тестов и скриптов есть контекстный менеджер assert_query_budget.
+Запросы async представлений (из потоков sync_to_async) тоже учитываются.
+"""
+import logging
+import re
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_LIMIT = 3
+NUMBERS_RE = re.compile(r'\b\d+\b')
+# Загрузка сессии и пользователя одинакова для всех представлений и в бюджет не входит
+AUTH_QUERY_RE = re.compile(r'\s*SELECT\b.*?\bFROM "(django_session|auth_user)"', re.DOTALL)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudget:
+    """
+    Ограничения для одного представления (None - без ограничения)
+    """
+
+    def __init__(self, queries=None, rows=None):
+        self.queries = queries
+        self.rows = rows
+
+    def violations(self, recorder):
+        violations = []
+        if self.queries is not None and recorder.count > self.queries:
+            violations.append(f'запросов {recorder.count} > {self.queries}')
+        if self.rows is not None and recorder.rows > self.rows:
+            violations.append(f'строк {recorder.rows} > {self.rows}')
+        return violations
+
+
+def query_budget(queries=None, rows=None):
+    """
+    Декоратор: объявляет бюджет представления (ставится над @api_view)
+    """
+    def decorator(view_func):
+        view_func.query_budget = QueryBudget(queries=queries, rows=rows)
+        return view_func
+    return decorator
+
+
+def get_budget_mode():
+    return getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+
+
+class QueryRecorder:
+    """
+    Записывает SQL запросы с параметрами, временем и количеством строк (connection.execute_wrapper)
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def rows(self):
+        return sum(query['rows'] for query in self.queries)
+
+    def __call__(self, execute, sql, params, many, context):
+        if AUTH_QUERY_RE.match(sql):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            rowcount = getattr(context['cursor'], 'rowcount', -1)
+            self.queries.append({
+                'sql': sql,
+                'params': params,
+                'many': many,
+                'duration': time.perf_counter() - started,
+                'rows': max(rowcount or 0, 0),
+            })
+
+    def repeated(self):
+        """
+        Самый частый шаблон запроса (признак N+1) и сколько раз он выполнялся
+        """
+        patterns = {}
+        for query in self.queries:
+            pattern = NUMBERS_RE.sub('N', query['sql'])
+            patterns[pattern] = patterns.get(pattern, 0) + 1
+        if not patterns:
+            return None, 0
+        return max(patterns.items(), key=lambda item: item[1])
+
+    def offenders(self, limit=EXPLAIN_LIMIT):
+        """
+        Самые дорогие SELECT запросы: по строкам, затем по времени
+        """
+        selects = [
+            query for query in self.queries
+            if not query['many'] and query['sql'].lstrip().upper().startswith('SELECT')
+        ]
+        selects.sort(key=lambda query: (query['rows'], query['duration']), reverse=True)
+        return selects[:limit]
+
+
+def explain(query, using=connection):
+    """
+    План выполнения запроса (EXPLAIN без ANALYZE - запрос не выполняется)
+    """
+    try:
+        prefix = using.ops.explain_query_prefix()
+        with using.cursor() as cursor:
+            cursor.execute(f'{prefix} {query["sql"]}', query['params'])
+            return '\n'.join(' '.join(str(value) for value in row) for row in cursor.fetchall())
+    except Exception as e:
+        return f'EXPLAIN недоступен: {e}'
+
+
+def build_report(name, budget, recorder, violations):
+    pattern, times = recorder.repeated()
+    lines = [f'Бюджет SQL превышен в {name}: {", ".join(violations)}']
+    if times > 1:
+        lines.append(f'Повторяется {times} раз: {pattern}')
+    for query in recorder.offenders():
+        lines.append(f'-- {query["rows"]} строк, {query["duration"] * 1000:.1f} мс: {query["sql"]}')
+        lines.append(explain(query))
+    return '\n'.join(lines)
+
+
+def check_budget(name, budget, recorder, mode):
+    violations = budget.violations(recorder)
+    if not violations or mode == 'off':
+        return
+
+    report = build_report(name, budget, recorder, violations)
+    if mode == 'raise':
+        raise QueryBudgetExceeded(report)
+    logger.warning(report)
+
+
+@contextmanager
+def assert_query_budget(queries=None, rows=None, name='block'):
+    """
+    Контекстный менеджер для тестов: выбрасывает QueryBudgetExceeded при превышении
+    """
+    recorder = QueryRecorder()
+    with connection.execute_wrapper(recorder):
+        yield recorder
+    check_budget(name, QueryBudget(queries=queries, rows=rows), recorder, 'raise')
@@ -0,0 +1,173 @@
+"""
+Повторная отправка пушей получателям с временными ошибками
+
+Повторяются только строки PushLog кампании со status='failed' и retryable=True:
+ошибки всего запроса с кодами RETRYABLE_VK_ERRORS (flood control, лимиты, внутренняя
+ошибка VK) и сетевые ошибки. Постоянные отказы (уведомления выключены, приложение
+заблокировано) и строки, исчерпавшие PUSH_RETRY_MAX_ATTEMPTS попыток, не трогаются.
+Получатели, которые после первой отправки упираются в лимиты частоты уведомления
+(api/capping.py), пропускаются и остаются в очереди до окончания лимита.
+
+Строки читаются порциями по первичному ключу (индекс api_pushlog_retry) и уходят
+общими вызовами VK по тексту (services.deliver). После каждой порции логи
+обновляются одним bulk_update, счетчики уведомления - одним UPDATE,
+доставленные попадают в журнал частоты (api/capping.py). Если в порции VK
+ответил ограничением частоты, перед следующей порцией пауза PUSH_RETRY_BACKOFF
+секунд, удваивающаяся до MAX_BACKOFF. Оставшиеся временные ошибки повторяются
+следующим проходом, всего не больше PUSH_RETRY_ROUNDS проходов за вызов.
+
+Повтор идет дольше запроса админки, поэтому действие админки только ставит
+уведомление в очередь (retry_requested_at), а повторяет команда retry_failed_pushes.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .capping import capped_users, record_pushes
+from .models import PushLog, PushNotification
+from .pacing import pacer_for
+from .personalization import compile_message
+from .services import deliver, log_push_result
+
+logger = logging.getLogger(__name__)
+
+# Коды ошибок VK API, после которых перед следующей порцией нужна пауза
+THROTTLING_VK_ERRORS = frozenset({6, 9, 29})
+MAX_BACKOFF = 60.0
+RETRY_FIELDS = ('status', 'error_message', 'error_code', 'retryable', 'attempts', 'vk_response', 'sent_at')
+
+
+def retryable_logs(notification):
+    """
+    Ошибки отправки кампании, которые можно повторить
+    """
+    return PushLog.objects.filter(
+        notification=notification, status='failed', retryable=True,
+        attempts__lt=settings.PUSH_RETRY_MAX_ATTEMPTS,
+    )
+
+
+def retry_candidates(notification):
+    """
+    Ошибки для повтора без получателей, которые сейчас упираются в лимит частоты
+    """
+    logs = retryable_logs(notification)
+    capped = capped_users(notification, user_field='user_id')
+    return logs if capped is None else logs.filter(~capped)
+
+
+def notifications_to_retry(since):
+    """
+    Уведомления с ошибками для повтора: отправленные после since и поставленные в очередь из админки
+    """
+    return PushNotification.objects.filter(
+        Q(sent_at__gte=since) | Q(retry_requested_at__isnull=False),
+        Exists(retryable_logs(OuterRef('pk'))), status='sent',
+    )
+
+
+def retry_batch(notification, template, logs, pacer=None, stats=None):
+    """
+    Повторная отправка порции логов общими вызовами VK; возвращает (доставлено, была ли пауза от VK)
+
+    В stats['calls'], если передана, добавляется число вызовов VK.
+    """
+    now = timezone.now()
+    by_user = {log.user_id: log for log in logs}
+    results = deliver(notification, [(log.user, template.render(log.user)) for log in logs], pacer, stats)
+    delivered_ids = []
+    throttled = False
+    for user, delivered, error_code, error_msg, retryable, vk_response in results:
+        log = by_user[user.pk]
+        log.attempts += 1
+        log.vk_response = vk_response
+        log.error_code = error_code
+        log.error_message = error_msg
+        log.retryable = retryable
+        log.sent_at = now
+        if delivered:
+            log.status = 'delivered'
+            delivered_ids.append(log.user_id)
+            log_push_result(notification, user, 'delivered')
+        else:
+            throttled = throttled or error_code in THROTTLING_VK_ERRORS
+            log_push_result(notification, user, 'failed', vk_response, error_msg, error_code)
+
+    PushLog.objects.bulk_update(logs, RETRY_FIELDS)
+    record_pushes(delivered_ids, now)
+    if delivered_ids:
+        count = len(delivered_ids)
+        PushNotification.objects.filter(pk=notification.pk).update(
+            total_sent=F('total_sent') + count,
+            total_delivered=F('total_delivered') + count,
+            total_failed=F('total_failed') - count,
+        )
+    return len(delivered_ids), throttled
+
+
+def retry_failed_pushes(notification_id):
+    """
+    Повторная отправка получателям кампании с временными ошибками
+
+    Args:
+        notification_id: ID отправленного уведомления
+
+    Returns:
+        dict: Попыток, доставлено, осталось временных и постоянных ошибок, отложено по лимиту частоты
+    """
+    try:
+        notification = PushNotification.objects.get(id=notification_id)
+    except PushNotification.DoesNotExist:
+        raise ValueError(f"Уведомление с ID {notification_id} не найдено")
+
+    if notification.status != 'sent':
+        raise ValueError(f"Повторять можно только отправленное уведомление (статус: {notification.status})")
+
+    stats = {'retried': 0, 'delivered': 0, 'failed': 0, 'permanent': 0, 'capped': 0, 'calls': 0}
+    template = compile_message(notification.message)
+    batch_size = settings.PUSH_RETRY_BATCH_SIZE
+    backoff = settings.PUSH_RETRY_BACKOFF
+    pacer = pacer_for(notification, retry_candidates(notification).count())
+
+    for round_number in range(settings.PUSH_RETRY_ROUNDS):
+        if round_number:
+            # Оставшиеся ошибки временные: даем VK время восстановиться
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+        last_id = 0
+        while True:
+            # Лимиты проверяются на каждую порцию: за время повтора пользователь мог получить другой пуш
+            logs = list(
+                retry_candidates(notification).filter(id__gt=last_id).order_by('id')
+                .select_related('user')[:batch_size]
+            )
+            if not logs:
+                break
+            last_id = logs[-1].id
+            delivered, throttled = retry_batch(notification, template, logs, pacer, stats)
+            stats['retried'] += len(logs)
+            stats['delivered'] += delivered
+            if throttled:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            else:
+                backoff = settings.PUSH_RETRY_BACKOFF
+
+        if not retry_candidates(notification).exists():
+            break
+
+    failed = PushLog.objects.filter(notification=notification, status='failed')
+    stats['failed'] = failed.filter(retryable=True).count()
+    stats['permanent'] = failed.filter(retryable=False).count()
+    stats['capped'] = retryable_logs(notification).count() - retry_candidates(notification).count()
+    PushNotification.objects.filter(pk=notification.pk).update(retry_requested_at=None)
+    logger.info(
+        "push_retry_finished notification_id=%s retried=%s delivered=%s failed=%s permanent=%s capped=%s calls=%s",
+        notification.id, stats['retried'], stats['delivered'], stats['failed'], stats['permanent'], stats['capped'],
+        stats['calls'],
+    )
+    return stats
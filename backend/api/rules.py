@@ -0,0 +1,221 @@
+"""
+Правила аудитории пушей
+
+Правило - JSON дерево (PushNotification.audience_rule, /api/push/segments/estimate/):
+    {"and": [правило, ...]}, {"or": [правило, ...]}, {"not": правило}
+    {"subscribed": true}                    - уведомления разрешены
+    {"segment": "active"}                   - сегмент PushNotification.SEGMENT_CHOICES
+    {"active_days": 14}                     - был за последние N дней
+    {"new_days": 3}                         - зарегистрирован за последние N дней
+    {"visits": {"min": 3, "max": 10}}       - количество визитов (границы включительно, любая необязательна)
+    {"age": {"min": 18, "max": 35}}         - полных лет (пользователи без года рождения не подходят)
+    {"sex": 1}                              - пол
+    {"city": "моск"}                        - подстрока названия города без учета регистра
+    {"city_id": [1, 2]}, {"country_id": 1}  - ID города / страны VK
+    {"utm_source": "vk"}                    - подстрока UTM Source без учета регистра
+    {"utm_campaign": "..."}, {"utm_content": "..."}
+    {"users": [1, 2, 3]}                    - конкретные пользователи (первичные ключи VKUser)
+
+rule_q компилирует правило в условие Django. Все условия идут по индексированным
+колонкам VKUser: возраст - по birth_date, география - по vk_city_id / vk_country_id
+(производные колонки заполняются при регистрации, см. derived_columns),
+строки - по индексам из api/search.py. Тот же язык вычисляет индекс аудитории
+(api/segments.py) для мгновенной оценки размера сегмента.
+"""
+from datetime import date, timedelta
+from functools import reduce
+from operator import and_, or_
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .search import city_q, segment_q, utm_q
+
+RULE_LEAVES = (
+    'subscribed', 'segment', 'active_days', 'new_days', 'visits', 'age', 'sex',
+    'city', 'city_id', 'country_id', 'utm_source', 'utm_campaign', 'utm_content', 'users',
+)
+SEGMENTS = ('all', 'active', 'inactive', 'new', 'custom')
+UTM_LEAVES = ('utm_source', 'utm_campaign', 'utm_content')
+MIN_BIRTH_YEAR = 1900
+
+
+def parse_birth_date(bdate):
+    """
+    Дата рождения из VK формата "D.M.YYYY" или None (год скрыт, формат неверный)
+    """
+    parts = (bdate or '').strip().split('.')
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        return None
+    day, month, year = (int(part) for part in parts)
+    try:
+        birth_date = date(year, month, day)
+    except ValueError:
+        return None
+    if year < MIN_BIRTH_YEAR or birth_date > date.today():
+        return None
+    return birth_date
+
+
+def geo_id(value):
+    """
+    ID города или страны из объекта VK {"id": 1, "title": "Москва"} или None
+    """
+    if isinstance(value, dict) and isinstance(value.get('id'), int) and value['id'] > 0:
+        return value['id']
+    return None
+
+
+def derived_columns(vk_user_data, bdate):
+    """
+    Производные колонки таргетинга VKUser из данных VK Bridge
+
+    Returns:
+        dict: birth_date и те из vk_city_id / vk_country_id, которые есть в данных
+    """
+    columns = {'birth_date': parse_birth_date(bdate)}
+    for field, key in (('vk_city_id', 'city'), ('vk_country_id', 'country')):
+        value = geo_id(vk_user_data.get(key))
+        if value is not None:
+            columns[field] = value
+    return columns
+
+
+def years_ago(today, years):
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:
+        # 29 февраля в невисокосный год
+        return today.replace(year=today.year - years, day=28)
+
+
+def birth_date_bounds(age_min, age_max, today):
+    """
+    Границы birth_date для возраста [age_min, age_max]: (не раньше чем, не позже чем)
+    """
+    earliest = years_ago(today, int(age_max) + 1) + timedelta(days=1) if age_max is not None else None
+    latest = years_ago(today, int(age_min)) if age_min is not None else None
+    return earliest, latest
+
+
+def split_rule(rule):
+    """
+    (ключ, значение) правила; ValueError для неверной формы
+    """
+    if not isinstance(rule, dict) or len(rule) != 1:
+        raise ValueError(f'Правило должно быть объектом с одним ключом: {rule!r}')
+    (key, value), = rule.items()
+    if key in ('and', 'or') and (not isinstance(value, list) or not value):
+        raise ValueError(f'"{key}" ожидает непустой список правил')
+    if key not in ('and', 'or', 'not') + RULE_LEAVES:
+        raise ValueError(f'Неизвестное условие "{key}", доступны: and, or, not, {", ".join(RULE_LEAVES)}')
+    if key == 'segment' and value not in SEGMENTS:
+        raise ValueError(f'Неизвестный сегмент: {value}')
+    return key, value
+
+
+def positive_number(name, value):
+    if isinstance(value, bool):
+        raise ValueError(f'Неверное значение {name}: {value}')
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Неверное значение {name}: {value}')
+    if value <= 0:
+        raise ValueError(f'{name} должен быть больше 0')
+    return value
+
+
+def number_range(name, value):
+    """
+    (min, max) из {"min": ..., "max": ...}; хотя бы одна граница обязательна
+    """
+    if not isinstance(value, dict) or not value or set(value) - {'min', 'max'}:
+        raise ValueError(f'"{name}" ожидает {{"min": ..., "max": ...}}')
+    bounds = []
+    for bound in ('min', 'max'):
+        number = value.get(bound)
+        if number is not None and (isinstance(number, bool) or not isinstance(number, int) or number < 0):
+            raise ValueError(f'{name}.{bound} должен быть целым числом не меньше 0')
+        bounds.append(number)
+    if None not in bounds and bounds[0] > bounds[1]:
+        raise ValueError(f'{name}.min больше {name}.max')
+    return tuple(bounds)
+
+
+def id_list(name, value):
+    """
+    Список целых ID из числа или списка
+    """
+    values = value if isinstance(value, list) else [value]
+    if not values or any(isinstance(item, bool) or not isinstance(item, int) for item in values):
+        raise ValueError(f'"{name}" ожидает ID или список ID')
+    return values
+
+
+def text(name, value):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f'"{name}" ожидает непустую строку')
+    return value.strip()
+
+
+def rule_q(rule, now=None):
+    """
+    Условие Django для правила аудитории
+
+    Raises:
+        ValueError: Неверное правило
+    """
+    now = now or timezone.now()
+    key, value = split_rule(rule)
+
+    if key == 'and':
+        return reduce(and_, (rule_q(item, now) for item in value))
+    if key == 'or':
+        return reduce(or_, (rule_q(item, now) for item in value))
+    if key == 'not':
+        return ~rule_q(value, now)
+    if key == 'subscribed':
+        query = Q(notifications_enabled=True, notifications_allowed=True)
+        return query if value else ~query
+    if key == 'segment':
+        return segment_q(value, now)
+    if key == 'active_days':
+        return Q(last_visit__gte=now - timedelta(days=positive_number(key, value)))
+    if key == 'new_days':
+        return Q(first_visit__gte=now - timedelta(days=positive_number(key, value)))
+    if key == 'visits':
+        visits_min, visits_max = number_range(key, value)
+        query = Q()
+        if visits_min is not None:
+            query &= Q(total_visits__gte=visits_min)
+        if visits_max is not None:
+            query &= Q(total_visits__lte=visits_max)
+        return query
+    if key == 'age':
+        earliest, latest = birth_date_bounds(*number_range(key, value), timezone.localdate(now))
+        query = Q(birth_date__isnull=False)
+        if earliest is not None:
+            query &= Q(birth_date__gte=earliest)
+        if latest is not None:
+            query &= Q(birth_date__lte=latest)
+        return query
+    if key == 'sex':
+        return Q(sex=positive_number(key, value))
+    if key == 'city':
+        return city_q(text(key, value))
+    if key == 'city_id':
+        return Q(vk_city_id__in=id_list(key, value))
+    if key == 'country_id':
+        return Q(vk_country_id__in=id_list(key, value))
+    if key in UTM_LEAVES:
+        return utm_q(key, text(key, value))
+    # users
+    return Q(pk__in=id_list(key, value))
+
+
+def validate_rule(rule):
+    """
+    Проверяет правило; ValueError с описанием ошибки
+    """
+    rule_q(rule)
@@ -0,0 +1,67 @@
+"""
+Поиск пользователей для админки и таргетинга пушей
+
+Все условия строятся так, чтобы на PostgreSQL использовались индексы
+из миграции 0009_user_search_indexes:
+    - число - точное совпадение VK ID (уникальный индекс);
+    - имя, фамилия, город - подстрока без учета регистра (триграммный GIN индекс);
+    - UTM Source / Campaign / Content - подстрока без учета регистра (триграммный GIN
+      индекс из миграции 0020_utm_trigram_indexes).
+"""
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+
+def user_search_q(term):
+    """
+    Условие поиска пользователя по строке из поисковой формы
+
+    Каждое слово должно найтись в имени, фамилии или городе:
+    "Иван Москва" найдет Ивана из Москвы.
+    """
+    term = term.strip()
+    if not term:
+        return Q()
+    if term.isdigit():
+        return Q(vk_user_id=int(term))
+
+    query = Q()
+    for word in term.split():
+        query &= Q(first_name__icontains=word) | Q(last_name__icontains=word) | Q(city__icontains=word)
+    return query
+
+
+# Окна сегментов PushNotification.SEGMENT_CHOICES (дни)
+ACTIVE_DAYS = 7
+NEW_DAYS = 3
+
+
+def segment_q(segment, now=None):
+    """
+    Условие сегмента пользователей (PushNotification.SEGMENT_CHOICES)
+    """
+    now = now or timezone.now()
+    if segment == 'active':
+        return Q(last_visit__gte=now - timedelta(days=ACTIVE_DAYS))
+    if segment == 'inactive':
+        return Q(last_visit__lt=now - timedelta(days=ACTIVE_DAYS))
+    if segment == 'new':
+        return Q(first_visit__gte=now - timedelta(days=NEW_DAYS))
+    return Q()
+
+
+def city_q(city):
+    return Q(city__icontains=city.strip())
+
+
+def utm_q(field, value):
+    """
+    Подстрока utm_source / utm_campaign / utm_content: "vk" найдет vk_ads и ads_vk
+    """
+    return Q(**{f'{field}__icontains': value.strip()})
+
+
+def search_users(queryset, term):
+    return queryset.filter(user_search_q(term))
@@ -0,0 +1,512 @@
+"""
+Индекс аудитории пушей для мгновенной оценки сегментов
+
+Пользователи хранятся по возрастанию ID (колонка ids, позиция ищется бинарным
+поиском np.searchsorted), атрибуты таргетинга - колонками numpy:
+    subscribed                   - notifications_enabled и notifications_allowed;
+    sex, total_visits            - числа (0 - не указан);
+    birth_date                   - порядковый номер дня (0 - не указан);
+    vk_city_id, vk_country_id    - ID VK (0 - не указан);
+    city, utm_*                  - коды словаря значений;
+    first_visit, last_visit      - время (секунды с микросекундами, как в базе).
+
+Условие сегмента превращается в булев массив (битовую карту) по всем пользователям:
+город и UTM проверяются один раз по словарю значений, затем коды ищутся
+в колонке (np.isin), окна активности и возраст - сравнение колонки с порогом.
+Комбинации AND/OR/NOT - поэлементные операции над массивами, поэтому оценка
+сегмента на миллионе пользователей занимает миллисекунды и не ходит в базу.
+Язык правил и проверка правил - api/rules.py; evaluate повторяет rule_q.
+
+Загрузка и обновление выполняются в фоновом потоке процесса (start_segment_index),
+запрос никогда не ждет построения индекса: пока индекса нет, оценка недоступна
+(SegmentIndexNotReady). Поток запускается после fork воркера (gunicorn.conf.py,
+post_worker_init) и при оценке, если индекс устарел:
+    - индекс читается из снимка SEGMENT_INDEX_PATH, который строит команда
+      build_segment_index (cron), и дочитывается по last_visit; без свежего снимка
+      индекс строится из базы;
+    - не чаще раза в SEGMENT_INDEX_REFRESH_INTERVAL секунд перечитываются пользователи
+      с last_visit новее последнего чтения (индекс по last_visit; auto_now меняется
+      при каждом save, в том числе при регистрации и проверке разрешения уведомлений);
+    - раз в SEGMENT_INDEX_REBUILD_INTERVAL секунд и после массовых изменений без save
+      (invalidate_segment_index) индекс строится заново - так учитываются удаления.
+
+Из оценки вычитаются пользователи, упирающиеся в лимиты частоты уведомления
+(api/capping.py). Отправка пушей по-прежнему
+выбирает получателей запросом (PushNotification.get_target_users_queryset),
+правило которого повторяет notification_rule.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.utils import timezone
+
+from .capping import capped_user_ids
+from .models import PushNotification, VKUser
+from .rules import (
+    UTM_LEAVES, birth_date_bounds, id_list, number_range, positive_number, split_rule, text,
+)
+from .search import ACTIVE_DAYS, NEW_DAYS
+
+SEGMENT_INDEX_GENERATION_KEY = 'api:segments:generation'
+# Числовые колонки индекса и их типы (NULL хранится как 0)
+NUMBER_COLUMNS = {
+    'sex': np.int8,
+    'total_visits': np.int32,
+    'birth_date': np.int32,
+    'vk_city_id': np.int32,
+    'vk_country_id': np.int32,
+}
+# Строковые колонки (коды словаря значений)
+TEXT_COLUMNS = ('city',) + UTM_LEAVES
+SEGMENT_FIELDS = (
+    ('id', 'notifications_enabled', 'notifications_allowed', 'first_visit', 'last_visit')
+    + tuple(NUMBER_COLUMNS) + TEXT_COLUMNS
+)
+# Перечитываются и пользователи, сохраненные чуть раньше последнего чтения:
+# транзакция могла зафиксироваться позже, чем поставлено время last_visit
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+logger = logging.getLogger(__name__)
+
+_index = None
+_lock = threading.Lock()
+_worker = None
+
+
+class SegmentIndexNotReady(Exception):
+    """
+    Индекс аудитории процесса еще загружается
+    """
+
+
+class ValueDictionary:
+    """
+    Словарь строковых значений колонки: значение <-> код
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+        self.lowered = []
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            self.lowered.append(value.lower())
+        return code
+
+    def matching(self, predicate):
+        """
+        Коды значений, для которых predicate(значение в нижнем регистре) истинно
+        """
+        return np.fromiter(
+            (code for code, value in enumerate(self.lowered) if predicate(value)), dtype=np.int32,
+        )
+
+
+class SegmentIndex:
+    """
+    Колонки атрибутов таргетинга по плотному номеру пользователя
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.lock = threading.Lock()
+        self.columns = {
+            'ids': np.zeros(0, dtype=np.int64),
+            'subscribed': np.zeros(0, dtype=bool),
+            'first_visit': np.zeros(0, dtype=np.float64),
+            'last_visit': np.zeros(0, dtype=np.float64),
+            **{name: np.zeros(0, dtype=dtype) for name, dtype in NUMBER_COLUMNS.items()},
+            **{name: np.zeros(0, dtype=np.int32) for name in TEXT_COLUMNS},
+        }
+        self.dictionaries = {name: ValueDictionary() for name in TEXT_COLUMNS}
+        self.watermark = None
+        self.built_at = time.monotonic()
+        self.refreshed_at = 0.0
+        self.generation = None
+        self.created = time.time()
+
+    def column(self, name):
+        return self.columns[name][:self.size]
+
+    def reserve(self, size):
+        capacity = len(self.columns['ids'])
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 1024)
+        for name, column in self.columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def positions(self, pks):
+        """
+        Позиции известных пользователей из pks (бинарный поиск по ids)
+        """
+        pks = np.asarray(pks, dtype=np.int64)
+        ids = self.column('ids')
+        positions = np.searchsorted(ids, pks)
+        found = positions < self.size
+        found[found] = ids[positions[found]] == pks[found]
+        return positions[found]
+
+    def apply(self, rows):
+        """
+        Добавляет новых и обновляет известных пользователей (строки SEGMENT_FIELDS)
+
+        Новые пользователи обычно старше всех известных и дописываются в конец;
+        если нет (транзакция зафиксировалась позже), колонки пересортировываются по ID.
+        """
+        if not rows:
+            return
+        fields = list(zip(*rows))
+        pks = np.array(fields[0], dtype=np.int64)
+        values = {
+            'subscribed': np.logical_and(fields[1], fields[2]),
+            'first_visit': np.array([value.timestamp() for value in fields[3]]),
+            'last_visit': np.array([value.timestamp() for value in fields[4]]),
+        }
+        for (name, dtype), column in zip(NUMBER_COLUMNS.items(), fields[5:]):
+            if name == 'birth_date':
+                column = [value.toordinal() if value else 0 for value in column]
+            values[name] = np.array([value or 0 for value in column], dtype=dtype)
+        for name, column in zip(TEXT_COLUMNS, fields[5 + len(NUMBER_COLUMNS):]):
+            code = self.dictionaries[name].code
+            values[name] = np.array([code(value) for value in column], dtype=np.int32)
+        watermark = max(fields[4])
+
+        with self.lock:
+            ids = self.column('ids')
+            positions = np.searchsorted(ids, pks)
+            known = positions < self.size
+            known[known] = ids[positions[known]] == pks[known]
+            new = ~known
+            count = int(np.count_nonzero(new))
+            ordered = not count or not self.size or pks[new].min() > ids[-1]
+            self.reserve(self.size + count)
+            positions[new] = np.arange(self.size, self.size + count)
+            self.columns['ids'][positions[new]] = pks[new]
+            self.size += count
+            for name, column in values.items():
+                self.columns[name][positions] = column
+            if not ordered:
+                order = np.argsort(self.column('ids'), kind='stable')
+                for column in self.columns.values():
+                    column[:self.size] = column[:self.size][order]
+            if self.watermark is None or watermark > self.watermark:
+                self.watermark = watermark
+
+    def save(self, path):
+        """
+        Записывает снимок индекса (команда build_segment_index); файл заменяется атомарно
+        """
+        arrays = {f'column_{name}': self.column(name) for name in self.columns}
+        for name, dictionary in self.dictionaries.items():
+            arrays[f'values_{name}'] = np.array(dictionary.values, dtype=str)
+        arrays['meta'] = np.array([self.watermark.timestamp() if self.watermark else np.nan, self.created])
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.', suffix='.npz', delete=False) as f:
+            np.savez(f, **arrays)
+        os.chmod(f.name, 0o644)  # воркеры могут работать под другим пользователем
+        os.replace(f.name, path)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Индекс из снимка save; пользователи, измененные после снимка, дочитываются refresh
+        """
+        index = cls()
+        with np.load(path, allow_pickle=False) as data:
+            for name in index.columns:
+                index.columns[name] = data[f'column_{name}']
+            for name, dictionary in index.dictionaries.items():
+                for value in data[f'values_{name}'].tolist():
+                    dictionary.code(value)
+            watermark, index.created = data['meta'].tolist()
+        index.size = len(index.columns['ids'])
+        index.watermark = None if np.isnan(watermark) else datetime.fromtimestamp(watermark, tz=dt_timezone.utc)
+        # Возраст индекса - с момента построения снимка
+        index.built_at = time.monotonic() - max(time.time() - index.created, 0)
+        return index
+
+    def load(self, queryset):
+        """
+        Читает пользователей порциями по первичному ключу (короткие запросы и через pgbouncer)
+        """
+        chunk_size = settings.SEGMENT_INDEX_CHUNK_SIZE
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list(*SEGMENT_FIELDS)[:chunk_size])
+            self.apply(rows)
+            if len(rows) < chunk_size:
+                break
+            last_pk = rows[-1][0]
+        self.refreshed_at = time.monotonic()
+
+    def refresh(self):
+        """
+        Перечитывает пользователей, сохраненных после последнего чтения
+        """
+        queryset = VKUser.objects.all()
+        if self.watermark is not None:
+            queryset = queryset.filter(last_visit__gte=self.watermark - REFRESH_OVERLAP)
+        self.load(queryset)
+
+    def evaluate(self, rule, now=None):
+        """
+        Битовая карта пользователей, подходящих под правило (см. rule_q)
+
+        Raises:
+            ValueError: Неверное правило
+        """
+        now = now or timezone.now()
+        key, value = split_rule(rule)
+
+        if key == 'and' or key == 'or':
+            masks = [self.evaluate(item, now) for item in value]
+            return np.logical_and.reduce(masks) if key == 'and' else np.logical_or.reduce(masks)
+        if key == 'not':
+            return ~self.evaluate(value, now)
+        if key == 'subscribed':
+            return self.column('subscribed') if value else ~self.column('subscribed')
+        if key == 'segment':
+            if value == 'active':
+                return self.since('last_visit', now, ACTIVE_DAYS)
+            if value == 'inactive':
+                return ~self.since('last_visit', now, ACTIVE_DAYS)
+            if value == 'new':
+                return self.since('first_visit', now, NEW_DAYS)
+            return np.ones(self.size, dtype=bool)
+        if key == 'active_days':
+            return self.since('last_visit', now, positive_number(key, value))
+        if key == 'new_days':
+            return self.since('first_visit', now, positive_number(key, value))
+        if key == 'visits':
+            return self.between('total_visits', *number_range(key, value))
+        if key == 'age':
+            earliest, latest = birth_date_bounds(*number_range(key, value), timezone.localdate(now))
+            return self.between(
+                'birth_date',
+                earliest.toordinal() if earliest else 1,
+                latest.toordinal() if latest else None,
+            )
+        if key == 'sex':
+            return self.column('sex') == positive_number(key, value)
+        if key == 'city':
+            term = text(key, value).lower()
+            return self.matching(key, lambda city: term in city)
+        if key in ('city_id', 'country_id'):
+            return np.isin(self.column(f'vk_{key}'), id_list(key, value))
+        if key in UTM_LEAVES:
+            term = text(key, value).lower()
+            return self.matching(key, lambda source: term in source)
+        # users
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.positions(id_list(key, value))] = True
+        return mask
+
+    def since(self, name, now, days):
+        return self.column(name) >= (now - timedelta(days=days)).timestamp()
+
+    def between(self, name, minimum, maximum):
+        column = self.column(name)
+        mask = np.ones(self.size, dtype=bool)
+        if minimum is not None:
+            mask &= column >= minimum
+        if maximum is not None:
+            mask &= column <= maximum
+        return mask
+
+    def matching(self, name, predicate):
+        return np.isin(self.column(name), self.dictionaries[name].matching(predicate))
+
+    def count(self, rule, now=None):
+        return self.counts(rule, now=now)[0]
+
+    def counts(self, rule, excluded=(), now=None):
+        """
+        Размер сегмента и сколько в нем останется без пользователей excluded (ID)
+        """
+        with self.lock:
+            mask = self.evaluate(rule, now)
+            count = int(np.count_nonzero(mask))
+            return count, count - int(np.count_nonzero(mask[self.positions(excluded)]))
+
+
+def invalidate_segment_index():
+    """
+    Перестроить индексы после массовых изменений пользователей без save (QuerySet.update)
+
+    Поколение хранится в общем кэше (CACHES['shared']): индекс перестраивают все воркеры,
+    а не только тот, в котором вызвана функция.
+    """
+    caches['shared'].set(SEGMENT_INDEX_GENERATION_KEY, time.time(), timeout=None)
+
+
+def segment_index_generation():
+    """
+    Текущее поколение индексов (время последнего invalidate_segment_index) или None
+    """
+    return caches['shared'].get(SEGMENT_INDEX_GENERATION_KEY)
+
+
+def segment_index_stale(index, generation):
+    """
+    Что нужно сделать с индексом процесса: 'build', 'refresh' или None
+    """
+    now = time.monotonic()
+    if (index is None or index.generation != generation
+            or now - index.built_at >= settings.SEGMENT_INDEX_REBUILD_INTERVAL):
+        return 'build'
+    if now - index.refreshed_at >= settings.SEGMENT_INDEX_REFRESH_INTERVAL:
+        return 'refresh'
+    return None
+
+
+def read_snapshot(generation):
+    """
+    Свежий снимок индекса (после последнего invalidate_segment_index) или None
+    """
+    path = settings.SEGMENT_INDEX_PATH
+    if not path or not os.path.exists(path):
+        return None
+    index = SegmentIndex.from_file(path)
+    if generation is not None and index.created < generation:
+        return None
+    if time.monotonic() - index.built_at >= settings.SEGMENT_INDEX_REBUILD_INTERVAL:
+        return None
+    return index
+
+
+def update_segment_index():
+    """
+    Загружает, строит заново или дочитывает индекс процесса (фоновый поток start_segment_index)
+    """
+    global _index
+    generation = segment_index_generation()
+    action = segment_index_stale(_index, generation)
+    if action == 'refresh':
+        _index.refresh()
+        return
+    if action is None:
+        return
+
+    started = time.perf_counter()
+    index = read_snapshot(generation)
+    source = 'snapshot'
+    if index is None:
+        index = SegmentIndex()
+        index.load(VKUser.objects.all())
+        source = 'database'
+    else:
+        index.refresh()
+    index.generation = generation
+    _index = index
+    logger.info(
+        "segment_index_loaded source=%s users=%s elapsed=%.2f",
+        source, index.size, time.perf_counter() - started,
+    )
+
+
+def _maintain():
+    global _worker
+    try:
+        update_segment_index()
+    except Exception:
+        logger.exception("segment_index_failed")
+    finally:
+        connections.close_all()
+        with _lock:
+            _worker = None
+
+
+def start_segment_index():
+    """
+    Запускает фоновую загрузку или обновление индекса, если они нужны и еще не идут
+    """
+    global _worker
+    generation = segment_index_generation()
+    with _lock:
+        if _worker is not None or segment_index_stale(_index, generation) is None:
+            return
+        _worker = threading.Thread(target=_maintain, name='segment-index', daemon=True)
+        _worker.start()
+
+
+def get_segment_index():
+    """
+    Индекс аудитории процесса или None, пока он загружается
+
+    Не ждет загрузки: устаревший индекс обновляется в фоне, до конца обновления
+    используется прежний.
+    """
+    start_segment_index()
+    return _index
+
+
+def notification_rule(notification):
+    """
+    Правило аудитории уведомления (то же, что get_target_users_queryset)
+    """
+    user_ids = []
+    if notification.segment == 'custom' and notification.pk:
+        user_ids = list(notification.target_users.values_list('pk', flat=True))
+    return targeting_rule(
+        notification.segment, user_ids, notification.filter_city, notification.filter_sex,
+        notification.filter_utm_source, notification.audience_rule,
+    )
+
+
+def targeting_rule(segment, user_ids=(), city='', sex=None, utm_source='', audience_rule=None):
+    """
+    Правило из полей таргетинга PushNotification (в том числе из несохраненной формы админки)
+    """
+    rules = [{'users': list(user_ids)} if segment == 'custom' and user_ids else {'subscribed': True}]
+    rules.append({'segment': segment})
+    if city:
+        rules.append({'city': city})
+    if sex:
+        rules.append({'sex': sex})
+    if utm_source:
+        rules.append({'utm_source': utm_source})
+    if audience_rule:
+        rules.append(audience_rule)
+    return {'and': rules}
+
+
+def estimate_segment(rule, notification=None):
+    """
+    Размер сегмента по индексу аудитории
+
+    Из 'count' вычитаются пользователи, упирающиеся в лимиты частоты уведомления
+    (без уведомления - лимиты по умолчанию), 'before_caps' - размер без лимитов.
+
+    Returns:
+        dict: {'count': ..., 'before_caps': ..., 'total': ..., 'elapsed_ms': ...}
+
+    Raises:
+        ValueError: Неверное правило
+        SegmentIndexNotReady: Индекс еще загружается
+    """
+    index = get_segment_index()
+    if index is None:
+        raise SegmentIndexNotReady("Индекс аудитории загружается, повторите через несколько секунд")
+    started = time.perf_counter()
+    capped = np.fromiter(capped_user_ids(notification or PushNotification()), dtype=np.int64)
+    before_caps, count = index.counts(rule, capped)
+    return {
+        'count': count,
+        'before_caps': before_caps,
+        'total': index.size,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
@@ -1,43 +1,59 @@
 """
 Сервис для работы с пуш-уведомлениями VK Mini Apps
 """
+import logging
+import random
+import re
+
 import requests
 from django.conf import settings
 from django.utils import timezone
 from .models import VKUser, PushNotification, PushLog
+from .capping import capped_users, record_pushes
+from .metrics import PUSH_MESSAGES, observe_upstream
+from .pacing import pacer_for
+from .personalization import compile_message
+from .rules import derived_columns
+
+logger = logging.getLogger(__name__)
+
+# Коды ошибок VK API, после которых отправку можно повторить (api/retries.py):
+# 1 - неизвестная ошибка, 6 - слишком много запросов в секунду, 9 - flood control,
+# 10 - внутренняя ошибка сервера, 29 - достигнут лимит вызовов метода
+RETRYABLE_VK_ERRORS = frozenset({1, 6, 9, 10, 29})
+# notifications.sendMessage принимает до 100 user_ids за вызов
+VK_MAX_USER_IDS = 100
+# Строка запроса в тексте исключения requests
+QUERY_STRING_RE = re.compile(r'\?[^\s\'")]*')
 
 
-def send_vk_notification(user_id, message, fragment=None):
+def send_vk_notification(user_ids, message, fragment=None):
     """
     Отправка уведомления через VK API
     
     Args:
-        user_id: VK ID пользователя
+        user_ids: VK ID пользователя или список до VK_MAX_USER_IDS ID (один текст на всех)
         message: Текст уведомления
         fragment: Параметр для открытия определенной части приложения
     
     Returns:
         dict: Ответ VK API
     """
-    import logging
-    logger = logging.getLogger(__name__)
-    
     # Получаем токен доступа из настроек
     access_token = getattr(settings, 'VK_APP_ACCESS_TOKEN', None)
     
-    logger.info(f"🔑 VK Token присутствует: {bool(access_token)}")
-    if access_token:
-        logger.info(f"🔑 VK Token (первые 20 символов): {access_token[:20]}...")
-    
     if not access_token:
         error_msg = "VK_APP_ACCESS_TOKEN не установлен в settings.py"
         logger.error(f"❌ {error_msg}")
         raise ValueError(error_msg)
     
-    # Параметры запроса к VK API
+    if isinstance(user_ids, (list, tuple)):
+        user_ids = ','.join(str(user_id) for user_id in user_ids)
+    
+    # Параметры запроса к VK API (в теле POST: токен не попадает в URL, а с ним в тексты ошибок и логи прокси)
     # ВАЖНО: VK API требует user_ids (множественное число)!
     params = {
-        'user_ids': str(user_id),  # Один ID, но в формате для множественного числа
+        'user_ids': str(user_ids),
         'message': message,
         'access_token': access_token,
         'v': '5.131',  # Версия API
@@ -47,35 +63,173 @@ def send_vk_notification(user_id, message, fragment=None):
     if fragment:
         params['fragment'] = fragment
     
-    logger.info(f"📱 Отправка пуш-уведомления пользователю {user_id}")
-    logger.info(f"📝 Сообщение: {message}")
-    
     # Отправка запроса
-    url = 'https://api.vk.com/method/notifications.sendMessage'
-    logger.info(f"🌐 URL: {url}")
+    url = f'{settings.VK_API_BASE_URL}/notifications.sendMessage'
     
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        result = response.json()
-        
-        logger.info(f"📊 Статус код: {response.status_code}")
-        logger.info(f"📋 Ответ VK API: {result}")
-        
-        if 'error' in result:
-            logger.error(f"❌ Ошибка VK API: {result['error']}")
+    with observe_upstream('vk'):
+        response = requests.post(url, data=params, timeout=10)
+    return response.json()
+
+
+def request_error(exc):
+    """
+    Текст сетевой ошибки для PushLog и логов: тип исключения и сообщение без строки запроса
+    """
+    return f'{type(exc).__name__}: {QUERY_STRING_RE.sub("", str(exc))}'
+
+
+def push_result(vk_response, vk_user_id):
+    """
+    Результат отправки одному получателю по ответу VK API
+    
+    Ошибка всего запроса (error) повторяема, если ее код в RETRYABLE_VK_ERRORS.
+    Отказ по конкретному получателю в response (уведомления выключены, приложение
+    заблокировано) постоянный - повторять бесполезно.
+    
+    Returns:
+        tuple: (доставлено, код ошибки, сообщение об ошибке, можно повторить)
+    """
+    if 'error' in vk_response:
+        error = vk_response.get('error') or {}
+        error_code = error.get('error_code')
+        return False, error_code, error.get('error_msg', 'Unknown error'), error_code in RETRYABLE_VK_ERRORS
+    if 'response' not in vk_response:
+        return False, None, 'Unknown error', True
+    
+    response = vk_response['response']
+    for item in response if isinstance(response, list) else []:
+        if isinstance(item, dict) and item.get('user_id') == vk_user_id and item.get('status') is False:
+            error = item.get('error') or {}
+            return False, error.get('code'), error.get('description', 'Notification rejected'), False
+    return True, None, '', False
+
+
+def recipient_responses(vk_response, vk_user_ids):
+    """
+    Ответ VK на общий вызов по получателям: {VK ID: ответ для push_result и PushLog}
+    
+    Ошибка всего запроса относится к каждому получателю.
+    """
+    response = vk_response.get('response')
+    if not isinstance(response, list):
+        return {vk_user_id: vk_response for vk_user_id in vk_user_ids}
+    items = {item.get('user_id'): item for item in response if isinstance(item, dict)}
+    return {
+        vk_user_id: {'response': [items[vk_user_id]] if vk_user_id in items else []}
+        for vk_user_id in vk_user_ids
+    }
+
+
+def deliver(notification, recipients, pacer=None, stats=None):
+    """
+    Отправка получателям общими вызовами VK API
+    
+    Получатели с одинаковым текстом уходят вызовами до VK_MAX_USER_IDS ID
+    (при равномерной отправке - примерно вызов в секунду, см. Pacer.batch_size).
+    
+    Args:
+        notification: Уведомление (fragment берется из action_url)
+        recipients: Список (VKUser, текст)
+        pacer: api.pacing.Pacer или None
+        stats: Статистика отправки, в stats['calls'] добавляется число вызовов VK
+    
+    Returns:
+        list: (VKUser, доставлено, код ошибки, сообщение об ошибке, можно повторить, ответ VK) по получателям
+    """
+    groups = {}
+    for user, message in recipients:
+        groups.setdefault(message, []).append(user)
+    
+    fragment = notification.action_url or None
+    results = []
+    for message, users in groups.items():
+        start = 0
+        while start < len(users):
+            size = pacer.batch_size(VK_MAX_USER_IDS) if pacer else VK_MAX_USER_IDS
+            chunk = users[start:start + size]
+            start += size
+            if pacer:
+                pacer.wait(len(chunk))
+            vk_user_ids = [user.vk_user_id for user in chunk]
+            if stats is not None:
+                stats['calls'] += 1
+            try:
+                vk_response = send_vk_notification(vk_user_ids, message, fragment)
+            except Exception as e:
+                results.extend((user, False, None, request_error(e), True, {}) for user in chunk)
+                continue
+            responses = recipient_responses(vk_response, vk_user_ids)
+            for user in chunk:
+                user_response = responses[user.vk_user_id]
+                results.append((user, *push_result(user_response, user.vk_user_id), user_response))
+    return results
+
+
+def log_push_result(notification, user, status, vk_response=None, error='', error_code=None):
+    """
+    Структурированный лог результата отправки одному получателю
+
+    Успешные отправки логируются с вероятностью PUSH_LOG_SAMPLE_RATE,
+    ошибки - всегда. Токен и текст сообщения в лог не попадают.
+    """
+    PUSH_MESSAGES.inc(status=status)
+
+    if status == 'delivered':
+        if random.random() >= getattr(settings, 'PUSH_LOG_SAMPLE_RATE', 0.01):
+            return
+        logger.info(
+            "push_result notification_id=%s vk_user_id=%s status=%s sampled=1",
+            notification.id, user.vk_user_id, status,
+        )
+        return
+
+    if error_code is None:
+        error_code = (vk_response or {}).get('error', {}).get('error_code', '')
+    logger.warning(
+        "push_result notification_id=%s vk_user_id=%s status=%s error_code=%s error=%r",
+        notification.id, user.vk_user_id, status, error_code, error,
+    )
+
+
+def save_push_results(notification, results, stats):
+    """
+    PushLog одним INSERT, статистика и журнал частоты по результатам deliver
+    """
+    logs = []
+    delivered_ids = []
+    for user, delivered, error_code, error_msg, retryable, vk_response in results:
+        if delivered:
+            logs.append(PushLog(notification=notification, user=user, status='delivered', vk_response=vk_response))
+            delivered_ids.append(user.pk)
+            stats['sent'] += 1
+            stats['delivered'] += 1
+            log_push_result(notification, user, 'delivered')
         else:
-            logger.info(f"✅ Успешно отправлено!")
-        
-        return result
-    except Exception as e:
-        logger.error(f"❌ Исключение при отправке: {str(e)}")
-        raise
+            logs.append(PushLog(
+                notification=notification,
+                user=user,
+                status='failed',
+                error_message=error_msg,
+                error_code=error_code,
+                retryable=retryable,
+                vk_response=vk_response,
+            ))
+            stats['failed'] += 1
+            stats['retryable'] += int(retryable)
+            log_push_result(notification, user, 'failed', vk_response, error_msg, error_code)
+    PushLog.objects.bulk_create(logs)
+    record_pushes(delivered_ids)
 
 
 def send_push_notification(notification_id):
     """
     Отправка пуш-уведомления всем целевым пользователям
     
+    Получатели читаются порциями по первичному ключу, текст отрисовывается
+    по шаблону (api/personalization.py), одинаковые тексты копятся до полного
+    вызова VK (VK_MAX_USER_IDS получателей), но не больше PUSH_GROUP_BUFFER
+    получателей в ожидании.
+    
     Args:
         notification_id: ID уведомления из базы
     
@@ -91,11 +245,14 @@ def send_push_notification(notification_id):
     if notification.status not in ['draft', 'scheduled']:
         raise ValueError(f"Уведомление уже было отправлено (статус: {notification.status})")
     
+    # Шаблон разбирается до смены статуса: с ошибкой в тексте уведомление остается черновиком
+    template = compile_message(notification.message)
+    
     # Обновляем статус
     notification.status = 'sending'
     notification.save()
     
-    # Получаем список целевых пользователей
+    # Получаем список целевых пользователей (без упирающихся в лимит частоты)
     target_users = notification.get_target_users_queryset()
     
     # Статистика
@@ -104,61 +261,57 @@ def send_push_notification(notification_id):
         'sent': 0,
         'delivered': 0,
         'failed': 0,
+        'capped': 0,
+        'retryable': 0,
+        'calls': 0,
     }
+    capped = capped_users(notification)
+    if capped is not None:
+        stats['capped'] = notification.get_target_users_queryset(frequency_caps=False).filter(capped).count()
+    
+    # Равномерная отправка, если в уведомлении задана скорость или окно
+    pacer = pacer_for(notification, stats['total'])
     
     # Отправляем уведомления
-    for user in target_users:
-        try:
-            # Формируем fragment для навигации (если указан action_url)
-            fragment = None
-            if notification.action_url:
-                # Можно добавить параметры для открытия определенной страницы в приложении
-                fragment = notification.action_url
-            
-            # Отправляем уведомление через VK API
-            vk_response = send_vk_notification(
-                user_id=user.vk_user_id,
-                message=notification.message,
-                fragment=fragment
-            )
-            
-            # Проверяем ответ
-            if 'response' in vk_response:
-                # Успешно отправлено
-                PushLog.objects.create(
-                    notification=notification,
-                    user=user,
-                    status='delivered',
-                    vk_response=vk_response
-                )
-                stats['sent'] += 1
-                stats['delivered'] += 1
-            else:
-                # Ошибка при отправке
-                error_msg = vk_response.get('error', {}).get('error_msg', 'Unknown error')
-                PushLog.objects.create(
-                    notification=notification,
-                    user=user,
-                    status='failed',
-                    error_message=error_msg,
-                    vk_response=vk_response
-                )
-                stats['failed'] += 1
-                
-        except Exception as e:
-            # Ошибка при отправке
-            PushLog.objects.create(
-                notification=notification,
-                user=user,
-                status='failed',
-                error_message=str(e)
-            )
-            stats['failed'] += 1
+    users = target_users.only('id', 'vk_user_id', *template.fields).order_by('pk')
+    batch_size = settings.PUSH_SEND_BATCH_SIZE
+    # Получатели по тексту, еще не набравшие полный вызов VK
+    pending = {}
+    last_pk = 0
+    while True:
+        batch = list(users.filter(pk__gt=last_pk)[:batch_size])
+        for user in batch:
+            pending.setdefault(template.render(user), []).append(user)
+        
+        finished = len(batch) < batch_size
+        if finished or sum(len(group) for group in pending.values()) >= settings.PUSH_GROUP_BUFFER:
+            ready = [(user, message) for message, group in pending.items() for user in group]
+            pending = {}
+        else:
+            ready = []
+            for message, group in pending.items():
+                full = len(group) - len(group) % VK_MAX_USER_IDS
+                ready.extend((user, message) for user in group[:full])
+                del group[:full]
+        
+        save_push_results(notification, deliver(notification, ready, pacer, stats), stats)
+        if finished:
+            break
+        last_pk = batch[-1].pk
+    
+    # Среднее число ID на вызов VK: около 1 - тексты уникальны (UNIQUE_FIELDS в шаблоне)
+    ids_per_call = (stats['delivered'] + stats['failed']) / stats['calls'] if stats['calls'] else 0
+    logger.info(
+        "push_finished notification_id=%s total=%s delivered=%s failed=%s retryable=%s capped=%s calls=%s ids_per_call=%.1f",
+        notification.id, stats['total'], stats['delivered'], stats['failed'], stats['retryable'], stats['capped'],
+        stats['calls'], ids_per_call,
+    )
     
     # Обновляем статистику уведомления
     notification.total_sent = stats['sent']
     notification.total_delivered = stats['delivered']
     notification.total_failed = stats['failed']
+    notification.total_capped = stats['capped']
     notification.status = 'sent'
     notification.sent_at = timezone.now()
     notification.save()
@@ -220,6 +373,10 @@ def register_or_update_user(vk_user_data, utm_params=None):
         if new_utm_content and new_utm_content != user.utm_content:
             user.utm_content = new_utm_content
     
+    # Производные колонки таргетинга: дата рождения с годом, ID города и страны VK
+    for field, value in derived_columns(vk_user_data, user.bdate).items():
+        setattr(user, field, value)
+    
     # Сохраняем дополнительные данные
     user.extra_data = vk_user_data
     user.save()
@@ -245,18 +402,19 @@ def check_notifications_permission(vk_user_id):
         if not access_token:
             return False
         
-        # Проверяем разрешение через VK API
+        # Проверяем разрешение через VK API (токен в теле POST, не в URL)
         params = {
             'user_id': vk_user_id,
             'access_token': access_token,
             'v': '5.131',
         }
         
-        response = requests.get(
-            'https://api.vk.com/method/apps.isNotificationsAllowed',
-            params=params,
-            timeout=10
-        )
+        with observe_upstream('vk'):
+            response = requests.post(
+                f'{settings.VK_API_BASE_URL}/apps.isNotificationsAllowed',
+                data=params,
+                timeout=10
+            )
         
         result = response.json()
         is_allowed = result.get('response', {}).get('is_allowed', False)
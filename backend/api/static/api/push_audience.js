@@ -0,0 +1,86 @@
+/*
+ * Количество получателей пуша в форме админки.
+ * При изменении сегмента, фильтров или выбранных пользователей поля формы
+ * отправляются в PushNotificationAdmin.estimate_view, ответ считается по индексу аудитории
+ * за вычетом пользователей, упирающихся в лимиты частоты.
+ */
+'use strict';
+(function() {
+    const FIELDS = ['segment', 'filter_city', 'filter_sex', 'filter_utm_source', 'audience_rule', 'cap_interval_hours', 'cap_per_day'];
+    // Индекс аудитории еще загружается в фоне (503): повторяем запрос
+    const RETRY_DELAY = 3000;
+
+    function targetUsers(form) {
+        const select = form.querySelector('select[name="target_users"]');
+        if (!select) {
+            return [];
+        }
+        // filter_horizontal: в правом списке (id_target_users_to) все выбранные пользователи
+        const options = select.id.endsWith('_to') ? select.options : select.selectedOptions;
+        return Array.from(options, (option) => option.value);
+    }
+
+    function init() {
+        const output = document.getElementById('push-audience-estimate');
+        const form = document.getElementById('pushnotification_form');
+        if (!output || !form) {
+            return;
+        }
+
+        // Показываем количество рядом с сегментом
+        const segmentRow = form.querySelector('.field-segment');
+        const estimateRow = output.closest('.form-row');
+        if (segmentRow && estimateRow) {
+            segmentRow.after(estimateRow);
+        }
+
+        let timer = null;
+        let lastPayload = null;
+
+        function update() {
+            const data = new FormData();
+            data.append('csrfmiddlewaretoken', form.querySelector('[name="csrfmiddlewaretoken"]').value);
+            FIELDS.forEach((name) => {
+                const field = form.querySelector(`[name="${name}"]`);
+                data.append(name, field ? field.value : '');
+            });
+            targetUsers(form).forEach((value) => data.append('target_users', value));
+
+            const payload = new URLSearchParams(data).toString();
+            if (payload === lastPayload) {
+                return;
+            }
+            lastPayload = payload;
+            output.textContent = '⏳';
+
+            fetch(output.dataset.url, {method: 'POST', body: data, credentials: 'same-origin'})
+                .then((response) => {
+                    if (response.status === 503) {
+                        lastPayload = null;
+                        timer = setTimeout(update, RETRY_DELAY);
+                    }
+                    return response.json();
+                })
+                .then((result) => {
+                    output.textContent = result.error
+                        ? `⚠️ ${result.error}`
+                        : `👥 ${result.count} из ${result.total}, без лимитов частоты ${result.before_caps} (${result.elapsed_ms} мс)`;
+                })
+                .catch(() => {
+                    output.textContent = '⚠️ Не удалось посчитать получателей';
+                    lastPayload = null;
+                });
+        }
+
+        function schedule() {
+            clearTimeout(timer);
+            timer = setTimeout(update, 400);
+        }
+
+        // Кнопки filter_horizontal не вызывают change, поэтому слушаем и клики
+        ['input', 'change', 'click'].forEach((type) => form.addEventListener(type, schedule));
+        update();
+    }
+
+    window.addEventListener('load', init);
+})();
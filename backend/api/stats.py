@@ -0,0 +1,116 @@
+"""
+Сервис статистики пользователей VK Mini App
+
+Все счетчики считаются одним запросом с условной агрегацией и кэшируются
+на короткий TTL в общем для всех процессов кэше (CACHES['shared'], таблица в базе)
+и в памяти процесса. Пересчет выполняет только один процесс из всех воркеров
+(single-flight), остальные в это время получают последнее известное значение.
+"""
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import VKUser
+
+USERS_STATS_CACHE_KEY = 'api:users_stats'
+USERS_STATS_LOCK_KEY = 'api:users_stats:lock'
+# Ключ pg_try_advisory_xact_lock для пересчета статистики
+USERS_STATS_ADVISORY_LOCK = 26001
+
+
+def compute_users_stats():
+    """
+    Подсчет статистики пользователей одним запросом к базе
+
+    Returns:
+        dict: Счетчики пользователей и процент подписки
+    """
+    now = timezone.now()
+    counters = VKUser.objects.aggregate(
+        total_users=Count('id'),
+        active_users_7d=Count('id', filter=Q(last_visit__gte=now - timedelta(days=7))),
+        new_users_3d=Count('id', filter=Q(first_visit__gte=now - timedelta(days=3))),
+        subscribed_users=Count('id', filter=Q(notifications_allowed=True, notifications_enabled=True)),
+    )
+
+    total_users = counters['total_users']
+    subscribed_users = counters['subscribed_users']
+    counters['subscription_rate'] = round((subscribed_users / total_users * 100) if total_users > 0 else 0, 2)
+
+    return counters
+
+
+@contextmanager
+def recompute_lock(timeout):
+    """
+    Блокировка пересчета, общая для всех процессов и воркеров; отдает True, если получена
+
+    На PostgreSQL - pg_try_advisory_xact_lock: снимается с концом транзакции
+    (безопасно и через pgbouncer в режиме transaction). На других базах -
+    cache.add в общем кэше: строка с уникальным ключом вставляется только одним процессом.
+    """
+    if connection.vendor == 'postgresql':
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [USERS_STATS_ADVISORY_LOCK])
+                acquired = cursor.fetchone()[0]
+            yield acquired
+        return
+
+    shared = caches['shared']
+    acquired = shared.add(USERS_STATS_LOCK_KEY, 1, timeout=timeout)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            shared.delete(USERS_STATS_LOCK_KEY)
+
+
+def get_users_stats():
+    """
+    Статистика пользователей из кэша с single-flight пересчетом
+
+    Свежее значение живет USERS_STATS_CACHE_TTL секунд. Устаревшее значение
+    хранится дольше и отдается всем, пока один процесс, захвативший
+    блокировку, пересчитывает счетчики.
+
+    Returns:
+        dict: Счетчики пользователей и процент подписки
+    """
+    ttl = getattr(settings, 'USERS_STATS_CACHE_TTL', 60)
+    shared = caches['shared']
+
+    # Копия в памяти процесса: без запросов к общему кэшу, пока значение свежее
+    cached = cache.get(USERS_STATS_CACHE_KEY)
+    if cached and time.time() - cached['computed_at'] < ttl:
+        return cached['stats']
+
+    cached = shared.get(USERS_STATS_CACHE_KEY) or cached
+    if cached and time.time() - cached['computed_at'] < ttl:
+        cache.set(USERS_STATS_CACHE_KEY, cached, timeout=ttl)
+        return cached['stats']
+
+    with recompute_lock(ttl) as acquired:
+        if acquired:
+            cached = {'stats': compute_users_stats(), 'computed_at': time.time()}
+            shared.set(USERS_STATS_CACHE_KEY, cached, timeout=ttl * 10)
+            cache.set(USERS_STATS_CACHE_KEY, cached, timeout=ttl)
+            return cached['stats']
+
+    if cached:
+        return cached['stats']
+
+    # Кэш пуст, а пересчет уже идет в другом процессе - ждем его результат
+    for _ in range(20):
+        time.sleep(0.05)
+        cached = shared.get(USERS_STATS_CACHE_KEY)
+        if cached:
+            return cached['stats']
+
+    return compute_users_stats()
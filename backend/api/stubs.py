@@ -0,0 +1,208 @@
+"""
+Локальные заглушки партнеров: VK API, витрина itfinance.online и leads.tech
+
+ASGI приложение для замеров пропускной способности без сети.
+Запуск: python manage.py run_partner_stubs --port 8090
+
+Маршруты:
+    /method/notifications.sendMessage    - до 100 user_ids за вызов, ответ по каждому получателю
+    /method/apps.isNotificationsAllowed
+    /itfinance/v1/website-shopwindow-offers
+    /leads-tech/...                      - любой путь, ответ 200
+    /stats                               - счетчики вызовов заглушки и максимум одновременных
+                                           обращений (in_flight.max - сколько запросов бэкенд
+                                           держит открытыми, ожидая партнера)
+"""
+import asyncio
+import json
+import random
+import time
+from urllib.parse import parse_qs
+
+VK_MAX_USER_IDS = 100
+
+# Коды ошибок VK API
+VK_ERROR_UNKNOWN = 1
+VK_ERROR_TOO_MANY_REQUESTS = 6
+VK_ERROR_FLOOD_CONTROL = 9
+VK_ERROR_INTERNAL = 10
+VK_ERROR_INVALID_PARAM = 100
+
+
+class StubConfig:
+    """
+    Параметры поведения заглушки
+    """
+
+    def __init__(self, latency_ms=50, jitter_ms=20, error_rate=0.0, flood_rate=0.0,
+                 rate_limit=20, disallowed_rate=0.05, offers=30, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.rate_limit = rate_limit
+        self.disallowed_rate = disallowed_rate
+        self.offers = offers
+        self.rng = random.Random(seed)
+
+
+class RateLimiter:
+    """
+    Ограничение вызовов в секунду на метод (как у VK API для токена приложения)
+    """
+
+    def __init__(self, per_second):
+        self.per_second = per_second
+        self.windows = {}
+
+    def allow(self, key):
+        if not self.per_second:
+            return True
+        second = int(time.monotonic())
+        window_second, count = self.windows.get(key, (second, 0))
+        if window_second != second:
+            window_second, count = second, 0
+        count += 1
+        self.windows[key] = (window_second, count)
+        return count <= self.per_second
+
+
+def vk_error(code, message):
+    return {'error': {'error_code': code, 'error_msg': message}}
+
+
+def synthetic_offers(count, rng):
+    items = []
+    for order in range(1, count + 1):
+        amount_min = rng.choice([1000, 2000, 3000, 5000])
+        items.append({
+            'order': order,
+            'link': f'https://example.com/offer/{order}?s4={{ref}}&s5={{ref_source}}&s6={{user_id}}',
+            'label_text': rng.choice(['Одобрение 95%', 'Моментально на карту', 'В 2 клика', '']),
+            'offer': {
+                'inn': str(7700000000 + order),
+                'product_name': f'МФО {order}',
+                'image_link': f'https://example.com/logo/{order}.png',
+                'amount_min': str(amount_min),
+                'amount_max': str(amount_min * rng.choice([5, 10, 20])),
+                'loan_term_from': rng.choice([1, 5, 7]),
+                'loan_term_to': rng.choice([30, 60, 180, 365]),
+                'daily_percentage_min': str(rng.choice([0, 0.5, 0.8, 1.0])),
+            },
+        })
+    return {'items': items}
+
+
+class PartnerStubApp:
+    """
+    ASGI приложение заглушек
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.limiter = RateLimiter(config.rate_limit)
+        self.catalog = synthetic_offers(config.offers, config.rng)
+        self.stats = {}
+        self.in_flight = 0
+
+    def count(self, key, amount=1):
+        self.stats[key] = self.stats.get(key, 0) + amount
+
+    async def delay(self):
+        config = self.config
+        latency = config.latency_ms + config.rng.uniform(-config.jitter_ms, config.jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        params = {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+        content_type = dict(scope.get('headers', [])).get(b'content-type', b'').decode()
+        if body and 'application/x-www-form-urlencoded' in content_type:
+            params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+
+        status, payload = await self.route(scope['path'], params)
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json; charset=utf-8')],
+        })
+        await send({'type': 'http.response.body', 'body': data})
+
+    async def route(self, path, params):
+        if path == '/stats':
+            return 200, self.stats
+
+        self.in_flight += 1
+        self.stats['in_flight.max'] = max(self.stats.get('in_flight.max', 0), self.in_flight)
+        try:
+            await self.delay()
+        finally:
+            self.in_flight -= 1
+
+        if path == '/method/notifications.sendMessage':
+            return 200, self.send_message(params)
+        if path == '/method/apps.isNotificationsAllowed':
+            self.count('vk.isNotificationsAllowed')
+            return 200, {'response': {'is_allowed': self.config.rng.random() >= self.config.disallowed_rate}}
+        if path.startswith('/itfinance/'):
+            self.count('itfinance.feed')
+            if self.config.rng.random() < self.config.error_rate:
+                return 502, {'error': 'Bad Gateway'}
+            return 200, self.catalog
+        if path.startswith('/leads-tech'):
+            self.count('leads_tech.postback')
+            if self.config.rng.random() < self.config.error_rate:
+                return 502, {'error': 'Bad Gateway'}
+            return 200, {'status': 'ok'}
+
+        return 404, {'error': 'Not Found'}
+
+    def send_message(self, params):
+        config = self.config
+        self.count('vk.sendMessage.calls')
+
+        user_ids = [user_id for user_id in params.get('user_ids', '').split(',') if user_id]
+        if not user_ids or not params.get('message'):
+            return vk_error(VK_ERROR_INVALID_PARAM, 'One of the parameters specified was missing or invalid')
+        if len(user_ids) > VK_MAX_USER_IDS:
+            return vk_error(VK_ERROR_INVALID_PARAM, f'Too many user_ids (max {VK_MAX_USER_IDS})')
+
+        if not self.limiter.allow('notifications.sendMessage'):
+            self.count('vk.error.6')
+            return vk_error(VK_ERROR_TOO_MANY_REQUESTS, 'Too many requests per second')
+        if config.rng.random() < config.flood_rate:
+            self.count('vk.error.9')
+            return vk_error(VK_ERROR_FLOOD_CONTROL, 'Flood control')
+        if config.rng.random() < config.error_rate:
+            self.count('vk.error.10')
+            return vk_error(VK_ERROR_INTERNAL, 'Internal server error')
+
+        response = []
+        for user_id in user_ids:
+            if config.rng.random() < config.disallowed_rate:
+                response.append({
+                    'user_id': int(user_id),
+                    'status': False,
+                    'error': {'code': VK_ERROR_UNKNOWN, 'description': 'Notifications are disabled'},
+                })
+            else:
+                response.append({'user_id': int(user_id), 'status': True})
+        self.count('vk.sendMessage.recipients', len(user_ids))
+        return {'response': response}
@@ -1,3 +1,814 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
 
-# Create your tests here.
+import numpy as np
+import requests
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from . import catalog, segments, tracking
+from .capping import CAP_WINDOW, capped_users, record_pushes
+from .catalog_sync import sync_catalog
+from .metrics import DB_QUERIES, MultiprocessStore, archive_process, write_snapshot
+from .middleware import MetricsMiddleware, QueryBudgetMiddleware, QueryStats, request_sql_wrapper
+from .models import MFO, Offer, PushLedger, PushLog, PushNotification, TrackingDimension, UTMTracking, VKUser
+from .pacing import CATCH_UP, MIN_FACTOR, Pacer, pacer_for, percentile
+from .partners import build_utm_tracking
+from .personalization import compile_message
+from .retries import notifications_to_retry, retry_failed_pushes
+from .rules import parse_birth_date, rule_q, years_ago
+from .query_budget import QueryBudgetExceeded, assert_query_budget, query_budget
+from .services import push_result, request_error, send_push_notification
+from .segments import SegmentIndex, SegmentIndexNotReady, estimate_segment, notification_rule
+from .stats import USERS_STATS_CACHE_KEY, USERS_STATS_LOCK_KEY, get_users_stats
+
+
+class UsersStatsTests(TestCase):
+    """
+    Кэш статистики пользователей: общий для процессов, пересчет в одном процессе
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        VKUser.objects.bulk_create([
+            VKUser(vk_user_id=1000 + i, notifications_allowed=i % 2 == 0) for i in range(10)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        caches['shared'].clear()
+
+    def test_second_call_uses_process_cache(self):
+        self.assertEqual(get_users_stats()['total_users'], 10)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_users_stats()['total_users'], 10)
+
+    def test_other_process_reads_shared_cache(self):
+        get_users_stats()
+        # Другой воркер: своей копии в памяти нет, пересчета тоже нет
+        cache.clear()
+        VKUser.objects.create(vk_user_id=5000)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_users_stats()['total_users'], 10)
+
+    def test_stale_value_returned_while_other_process_recomputes(self):
+        caches['shared'].set(USERS_STATS_CACHE_KEY, {'stats': {'total_users': 7}, 'computed_at': 0})
+        caches['shared'].add(USERS_STATS_LOCK_KEY, 1)
+        self.assertEqual(get_users_stats(), {'total_users': 7})
+        self.assertIsNone(cache.get(USERS_STATS_CACHE_KEY))
+
+    def test_stale_value_recomputed_by_lock_holder(self):
+        caches['shared'].set(USERS_STATS_CACHE_KEY, {'stats': {'total_users': 7}, 'computed_at': 0})
+        self.assertEqual(get_users_stats()['total_users'], 10)
+        self.assertEqual(caches['shared'].get(USERS_STATS_CACHE_KEY)['stats']['total_users'], 10)
+        self.assertIsNone(caches['shared'].get(USERS_STATS_LOCK_KEY))
+
+    @override_settings(QUERY_BUDGET_MODE='raise', RATELIMIT_ENABLE=False)
+    def test_view_fits_query_budget_on_recompute(self):
+        response = self.client.get('/api/users/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stats']['total_users'], 10)
+
+
+class HybridMiddlewareTests(TestCase):
+    """
+    Middleware метрик и бюджетов работают в async цепочке и видят запросы из sync_to_async
+    """
+
+    def test_async_chain_without_thread_switch(self):
+        async def view(request):
+            return None
+
+        def sync_view(request):
+            return None
+
+        for middleware_class in (MetricsMiddleware, QueryBudgetMiddleware):
+            self.assertTrue(iscoroutinefunction(middleware_class(view)))
+            self.assertFalse(iscoroutinefunction(middleware_class(sync_view)))
+
+    async def test_queries_from_sync_to_async_are_counted(self):
+        stats = QueryStats()
+        with request_sql_wrapper(stats):
+            await sync_to_async(VKUser.objects.count)()
+            await sync_to_async(VKUser.objects.exists)()
+        self.assertEqual(stats.count, 2)
+
+    @override_settings(QUERY_BUDGET_MODE='raise')
+    async def test_async_budget_violation_raises(self):
+        @query_budget(queries=1)
+        async def view(request):
+            await sync_to_async(VKUser.objects.count)()
+            await sync_to_async(VKUser.objects.count)()
+            return None
+
+        request = RequestFactory().get('/')
+        request.resolver_match = type('Match', (), {'func': view, 'view_name': 'test-view'})()
+        with self.assertRaises(QueryBudgetExceeded):
+            await QueryBudgetMiddleware(view)(request)
+
+
+class MultiprocessMetricsTests(TestCase):
+    """
+    /metrics складывает значения всех процессов, включая завершившиеся
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def write_process(self, name, count):
+        write_snapshot(os.path.join(self.directory, name), {
+            DB_QUERIES.name: {json.dumps(['mfo-list']): count},
+        })
+
+    def collected(self, store):
+        return store.collect()[DB_QUERIES.name].get(json.dumps(['mfo-list']), 0)
+
+    def test_processes_and_archive_are_summed_once(self):
+        self.write_process('101-a.json', 3)
+        self.write_process('102-b.json', 4)
+        with override_settings(METRICS_MULTIPROC_DIR=self.directory):
+            store = MultiprocessStore()
+            self.assertEqual(self.collected(store), 7)
+
+            archive_process(self.directory, 101)
+            self.assertEqual(self.collected(store), 7)
+
+            # Файл успели прочитать до переноса в архив: архив его перечисляет
+            self.write_process('101-a.json', 3)
+            self.assertEqual(self.collected(store), 7)
+
+
+# Ссылки партнеров в тестах ведут на закрытый порт: запрос сразу падает с ошибкой соединения
+UNREACHABLE_URL = 'http://127.0.0.1:9'
+
+
+@override_settings(
+    QUERY_BUDGET_MODE='raise', RATELIMIT_ENABLE=False,
+    LEADS_TECH_FALLBACK_URL=f'{UNREACHABLE_URL}/leads', LEADS_TECH_BASE_URL_OVERRIDE='',
+)
+class QueryBudgetTests(TestCase):
+    """
+    Каждое представление с @query_budget укладывается в бюджет на холодных кэшах
+
+    Превышение бюджета в режиме raise - исключение QueryBudgetExceeded из middleware.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.mfos = MFO.objects.bulk_create([
+            MFO(
+                name=f'МФО {i}', link=f'{UNREACHABLE_URL}/mfo/{i}?ref={{ref}}', sum_min=1000, sum_max=30000 + i * 1000,
+                term_min=7, term_max=30 + i, rate=0.5 + i / 100, approval_chance=50 + i, payout_speed_hours=1 + i % 5,
+                requirements='Паспорт; СНИЛС', get_methods='На карту', repay_methods='Карта', sort_order=i,
+            )
+            for i in range(40)
+        ])
+        Offer.objects.bulk_create([
+            Offer(name=f'Оффер {i}', base_url=f'https://example.com/{i}', ref_source='vk', ref=f'campaign_{i}')
+            for i in range(20)
+        ])
+        cls.users = VKUser.objects.bulk_create([
+            VKUser(
+                vk_user_id=100 + i, first_name=f'Имя {i}', city='Москва' if i % 2 else 'Казань',
+                utm_source='vk_ads', notifications_allowed=i % 3 == 0,
+            )
+            for i in range(200)
+        ])
+        cls.user = cls.users[0]
+        for i in range(300):
+            tracking.create_tracking(build_utm_tracking({
+                'user_data': {'id': cls.user.vk_user_id if i % 2 else 100 + i % 200},
+                'utm_params': {'utm_source': f'source_{i % 5}', 'utm_campaign': f'campaign_{i % 7}', 'vk_platform': 'mobile_android'},
+                'url': 'https://vk.com/app1', 'user_agent': 'Mozilla/5.0',
+            }))
+        cls.notification = PushNotification.objects.create(title='Тест', message='Привет', status='sent')
+        PushLog.objects.create(notification=cls.notification, user=cls.user, status='delivered')
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        # Холодный старт процесса: кэши справочников, каталога и статистики пусты
+        cache.clear()
+        caches['shared'].clear()
+        tracking._dimension_ids.clear()
+        tracking._user_agent_ids.clear()
+        catalog._entry = None
+        catalog._index = None
+
+    def launch_data(self, vk_user_id):
+        return {
+            'user_data': {'id': vk_user_id, 'first_name': 'Иван', 'sex': 2, 'bdate': '1.1.1990', 'city': {'id': 1, 'title': 'Москва'}},
+            'utm_params': {'utm_source': 'vk_ads', 'utm_campaign': 'spring', 'utm_content': 'banner', 'vk_platform': 'mobile_iphone'},
+            'url': 'https://vk.com/app1#start', 'referrer': 'https://vk.com/feed', 'user_agent': 'Mozilla/5.0 (iPhone)',
+        }
+
+    def test_mfo_list(self):
+        self.assertEqual(len(self.client.get('/api/mfos/').json()), 40)
+
+    def test_mfo_list_query(self):
+        response = self.client.get('/api/mfos/', {'amount': 20000, 'term': 14, 'sort': 'rate', 'limit': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_mfo_detail(self):
+        self.assertEqual(self.client.get(f'/api/mfos/{self.mfos[0].pk}/').status_code, 200)
+
+    def test_mfo_template(self):
+        self.assertEqual(self.client.get('/api/mfos/template/').status_code, 200)
+
+    def test_offers_list(self):
+        response = self.client.get('/api/offers/', {'user_id': self.user.vk_user_id})
+        self.assertEqual(len(response.json()), 20)
+
+    def test_utm_track(self):
+        response = self.client.post('/api/utm-track/', self.launch_data(self.user.vk_user_id), content_type='application/json')
+        self.assertTrue(response.json()['success'])
+
+    def test_utm_stats(self):
+        response = self.client.get('/api/utm-stats/', {'days': 30})
+        self.assertEqual(response.json()['total_events'], 300)
+
+    def test_user_events(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(f'/api/users/{self.user.vk_user_id}/events/', {'limit': 200})
+        self.assertEqual(len(response.json()['events']), 152)
+
+    def test_user_register_new_and_existing(self):
+        for vk_user_id in (999, self.user.vk_user_id):
+            response = self.client.post('/api/users/register/', self.launch_data(vk_user_id), content_type='application/json')
+            self.assertTrue(response.json()['success'])
+
+    def test_user_allow_notifications(self):
+        response = self.client.post(
+            '/api/users/allow-notifications/', {'vk_user_id': self.user.vk_user_id}, content_type='application/json',
+        )
+        self.assertTrue(response.json()['notifications_allowed'])
+
+    def test_user_status(self):
+        response = self.client.get('/api/users/status/', {'vk_user_id': self.user.vk_user_id})
+        self.assertTrue(response.json()['success'])
+
+    def test_push_click_track(self):
+        response = self.client.post('/api/push/click-track/', {
+            'vk_user_id': self.user.vk_user_id, 'notification_id': self.notification.pk,
+        }, content_type='application/json')
+        self.assertTrue(response.json()['success'])
+
+    def test_users_stats(self):
+        self.assertEqual(self.client.get('/api/users/stats/').json()['stats']['total_users'], 200)
+
+    def test_send_to_leads_tech(self):
+        response = self.client.post('/api/arbitrage/send-to-leads-tech/', {
+            'offer_id': self.mfos[0].pk, 'user_id': self.user.vk_user_id, 'utm_source': 'vk_ads', 's4': 'ref',
+        }, content_type='application/json')
+        self.assertTrue(response.json()['success'])
+
+    def test_session_bootstrap(self):
+        data = dict(
+            self.launch_data(5000),
+            arbitrage={'offer_id': self.mfos[1].pk, 'user_id': 5000, 'utm_source': 'vk_ads'},
+            catalog={'amount': 10000, 'term': 14, 'sort': 'rate'},
+        )
+        response = self.client.post('/api/session/bootstrap/', data, content_type='application/json')
+        self.assertTrue(response.json()['success'])
+        self.assertIsNotNone(response.json()['arbitrage'])
+
+
+class UtmFilterTests(TestCase):
+    """
+    Фильтр пушей по UTM Source ищет подстроку без учета регистра, в базе и в индексе аудитории
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        VKUser.objects.bulk_create([
+            VKUser(vk_user_id=i, utm_source=source, notifications_allowed=True)
+            for i, source in enumerate(['vk_ads', 'VK_target', 'ads_vk', 'telegram', ''])
+        ])
+
+    def test_filter_utm_source_matches_substring(self):
+        notification = PushNotification(title='Тест', message='Привет', filter_utm_source='vk')
+        users = notification.get_target_users_queryset(frequency_caps=False)
+        self.assertEqual(set(users.values_list('utm_source', flat=True)), {'vk_ads', 'VK_target', 'ads_vk'})
+
+    def test_segment_index_agrees_with_queryset(self):
+        notification = PushNotification(title='Тест', message='Привет', filter_utm_source='Ads')
+        index = SegmentIndex()
+        index.load(VKUser.objects.all())
+        self.assertEqual(index.count(notification_rule(notification)), notification.get_target_users_queryset(frequency_caps=False).count())
+        self.assertEqual(index.count(notification_rule(notification)), 2)
+
+
+@override_settings(SEGMENT_INDEX_PATH='')
+class SegmentIndexTests(TestCase):
+    """
+    Индекс аудитории: поиск по отсортированным ID, снимок, лимиты частоты, загрузка вне запроса
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = VKUser.objects.bulk_create([
+            VKUser(vk_user_id=i, city='Москва' if i % 2 else 'Казань', notifications_allowed=True)
+            for i in range(10)
+        ])
+
+    def setUp(self):
+        segments._index = None
+        self.addCleanup(setattr, segments, '_index', None)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_users_found_after_out_of_order_load(self):
+        index = SegmentIndex()
+        index.load(VKUser.objects.filter(pk__gt=self.users[4].pk))
+        index.load(VKUser.objects.all())
+        self.assertEqual(index.size, 10)
+        self.assertTrue(np.all(np.diff(index.column('ids')) > 0))
+        self.assertEqual(index.count({'users': [self.users[0].pk, self.users[7].pk, 10 ** 9]}), 2)
+        self.assertEqual(index.count({'city': 'моск'}), 5)
+
+    def test_snapshot_round_trip(self):
+        index = SegmentIndex()
+        index.load(VKUser.objects.all())
+        path = os.path.join(self.directory, 'index.npz')
+        index.save(path)
+        loaded = SegmentIndex.from_file(path)
+        self.assertEqual(loaded.size, 10)
+        self.assertEqual(loaded.count({'city': 'казань'}), 5)
+        self.assertEqual(loaded.count({'users': [self.users[3].pk]}), 1)
+        self.assertEqual(loaded.watermark, index.watermark)
+
+    def test_update_reads_snapshot_and_users_saved_after_it(self):
+        path = os.path.join(self.directory, 'index.npz')
+        index = SegmentIndex()
+        index.load(VKUser.objects.all())
+        index.save(path)
+        VKUser.objects.create(vk_user_id=100, city='Москва', notifications_allowed=True)
+        with self.settings(SEGMENT_INDEX_PATH=path), self.assertLogs('api.segments', 'INFO') as logs:
+            segments.update_segment_index()
+        self.assertIn('source=snapshot', logs.output[0])
+        self.assertEqual(segments._index.count({'city': 'моск'}), 6)
+
+    def test_invalidation_seen_by_other_workers(self):
+        segments.update_segment_index()
+        index = segments._index
+        self.assertIsNone(segments.segment_index_stale(index, segments.segment_index_generation()))
+        # Другой воркер меняет поколение в общем кэше; локальный кэш этого процесса ни при чем
+        caches['shared'].set(segments.SEGMENT_INDEX_GENERATION_KEY, time.time(), timeout=None)
+        self.assertEqual(segments.segment_index_stale(index, segments.segment_index_generation()), 'build')
+        self.assertIsNone(cache.get(segments.SEGMENT_INDEX_GENERATION_KEY))
+
+    def test_estimate_subtracts_capped_users(self):
+        segments.update_segment_index()
+        now = timezone.now()
+        PushLedger.objects.create(user=self.users[1], last_push_at=now, window_started_at=now, window_count=1)
+        notification = PushNotification(title='Тест', message='Привет', cap_interval_hours=24)
+        estimate = estimate_segment(notification_rule(notification), notification)
+        self.assertEqual((estimate['before_caps'], estimate['count']), (10, 9))
+        self.assertEqual(estimate['count'], notification.get_target_users_queryset().count())
+        uncapped = PushNotification(title='Тест', message='Привет', cap_interval_hours=0, cap_per_day=0)
+        self.assertEqual(estimate_segment(notification_rule(uncapped), uncapped)['count'], 10)
+
+    def test_estimate_unavailable_while_index_loads(self):
+        # Фоновая загрузка уже идет: запрос не ждет и не строит индекс сам
+        segments._worker = threading.current_thread()
+        self.addCleanup(setattr, segments, '_worker', None)
+        with self.assertRaises(SegmentIndexNotReady):
+            estimate_segment({'subscribed': True})
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.post('/admin/api/pushnotification/estimate/', {'segment': 'all'})
+        self.assertEqual(response.status_code, 503)
+
+    def test_change_form_does_not_touch_index(self):
+        notification = PushNotification.objects.create(title='Тест', message='Привет')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(f'/admin/api/pushnotification/{notification.pk}/change/')
+        self.assertContains(response, 'push-audience-estimate')
+        self.assertIsNone(segments._index)
+        self.assertIsNone(segments._worker)
+
+
+class TrackingStorageTests(TestCase):
+    """
+    Уникальные параметры событий пишутся колонками целиком, справочник не растет
+    """
+
+    def setUp(self):
+        tracking._dimension_ids.clear()
+
+    def launch(self, index):
+        return build_utm_tracking({
+            'user_data': {'id': 100 + index},
+            'utm_params': {'utm_source': 'vk_ads', 'utm_term': str(100 + index)},
+            'url': f'https://vk.com/app1?vk_ts={index}&sign=' + 'x' * 700,
+            'referrer': f'https://vk.com/feed?w={index}',
+        })
+
+    def test_high_cardinality_fields_are_plain_columns(self):
+        events = [tracking.create_tracking(self.launch(index)) for index in range(20)]
+        self.assertEqual(events[5].url, f'https://vk.com/app1?vk_ts=5&sign=' + 'x' * 700)
+        self.assertEqual(events[5].utm_term, '105')
+        self.assertEqual(TrackingDimension.objects.count(), 2)  # utm_source и event_type
+
+    def test_repeated_values_need_no_queries(self):
+        # Новые ключи справочника попадают в кэш после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            tracking.create_tracking(self.launch(0))
+        with self.assertNumQueries(1):
+            tracking.create_tracking(self.launch(1))
+
+    def test_resolver_cache_evicts_oldest_keys(self):
+        size = tracking.RESOLVER_CACHE_SIZE
+        tracking.RESOLVER_CACHE_SIZE = 3
+        try:
+            for index in range(5):
+                tracking._store(tracking._dimension_ids, {('utm_source', str(index)): index})
+        finally:
+            tracking.RESOLVER_CACHE_SIZE = size
+        self.assertEqual(list(tracking._dimension_ids), [('utm_source', '2'), ('utm_source', '3'), ('utm_source', '4')])
+
+
+@override_settings(
+    VK_APP_ACCESS_TOKEN='token', VK_API_BASE_URL=f'{UNREACHABLE_URL}/method', PUSH_RETRY_ROUNDS=1,
+)
+class PushRetryTests(TestCase):
+    """
+    Повторяются только временные ошибки, с учетом лимитов частоты и вне запроса админки
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = VKUser.objects.bulk_create([
+            VKUser(vk_user_id=i, first_name=f'Имя {i}', notifications_allowed=True) for i in range(3)
+        ])
+        cls.notification = PushNotification.objects.create(
+            title='Тест', message='Привет', status='sent', sent_at=timezone.now(), cap_interval_hours=24,
+        )
+        PushLog.objects.bulk_create([
+            PushLog(notification=cls.notification, user=cls.users[0], status='failed', retryable=True, error_code=9),
+            PushLog(notification=cls.notification, user=cls.users[1], status='failed', retryable=True, error_code=9),
+            PushLog(notification=cls.notification, user=cls.users[2], status='failed', retryable=False, error_code=15),
+        ])
+
+    def test_push_result_splits_retryable_and_permanent(self):
+        self.assertEqual(push_result({'error': {'error_code': 9, 'error_msg': 'Flood control'}}, 1), (False, 9, 'Flood control', True))
+        self.assertEqual(push_result({'error': {'error_code': 15, 'error_msg': 'Access denied'}}, 1), (False, 15, 'Access denied', False))
+        self.assertEqual(push_result({}, 1), (False, None, 'Unknown error', True))
+        rejected = {'response': [{'user_id': 1, 'status': False, 'error': {'code': 1, 'description': 'Notifications disabled'}}]}
+        self.assertEqual(push_result(rejected, 1), (False, 1, 'Notifications disabled', False))
+        self.assertEqual(push_result({'response': [{'user_id': 1, 'status': True}]}, 1), (True, None, '', False))
+
+    def test_retry_skips_permanent_and_capped_recipients(self):
+        now = timezone.now()
+        PushLedger.objects.create(user=self.users[0], last_push_at=now, window_started_at=now, window_count=1)
+        stats = retry_failed_pushes(self.notification.id)
+        self.assertEqual((stats['retried'], stats['capped'], stats['failed'], stats['permanent']), (1, 1, 2, 1))
+        attempts = dict(PushLog.objects.values_list('user_id', 'attempts'))
+        self.assertEqual(attempts, {self.users[0].pk: 1, self.users[1].pk: 2, self.users[2].pk: 1})
+
+    def test_admin_action_queues_retry_for_command(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.client.post('/admin/api/pushnotification/', {
+            'action': 'retry_failed', '_selected_action': [self.notification.pk],
+        })
+        self.assertEqual(set(PushLog.objects.values_list('attempts', flat=True)), {1})
+        self.notification.refresh_from_db()
+        self.assertIsNotNone(self.notification.retry_requested_at)
+        # Очередь видна команде и за пределами окна --hours
+        self.assertEqual(list(notifications_to_retry(timezone.now())), [self.notification])
+
+        call_command('retry_failed_pushes', stdout=open(os.devnull, 'w'))
+        self.notification.refresh_from_db()
+        self.assertIsNone(self.notification.retry_requested_at)
+        self.assertEqual(PushLog.objects.filter(attempts=2).count(), 2)
+
+
+class MessageTemplateTests(TestCase):
+    """
+    Шаблон текста пуша и число ID на вызов VK
+    """
+
+    def test_render_fields_defaults_and_escapes(self):
+        template = compile_message('{{акция}} {first_name|друг}, займ в {city}!')
+        self.assertEqual(template.fields, ('first_name', 'city'))
+        user = VKUser(first_name='  Анна ', city='Москва')
+        self.assertEqual(template.render(user), '{акция} Анна, займ в Москва!')
+        self.assertEqual(template.render(VKUser(first_name='', city='')), '{акция} друг, займ в !')
+
+    def test_static_text_is_merged(self):
+        template = compile_message('Скидка {{10%}} сегодня')
+        self.assertTrue(template.is_static)
+        self.assertEqual(template.parts, ['Скидка {10%} сегодня'])
+
+    def test_invalid_templates_rejected(self):
+        for message in ('Привет, {nickname}', 'Привет, {first_name', 'Скидка }'):
+            with self.assertRaises(ValueError):
+                compile_message(message)
+
+    def test_unique_fields(self):
+        self.assertEqual(compile_message('{first_name} {last_name} из {city}').unique_fields, ('first_name', 'last_name'))
+        self.assertEqual(compile_message('Новое в {city}').unique_fields, ())
+
+    @override_settings(VK_APP_ACCESS_TOKEN='token', VK_API_BASE_URL=f'{UNREACHABLE_URL}/method')
+    def test_send_logs_ids_per_call(self):
+        VKUser.objects.bulk_create([
+            VKUser(vk_user_id=i, first_name=f'Имя {i}', notifications_allowed=True) for i in range(150)
+        ])
+        for message, calls in (('Привет', 2), ('Привет, {first_name}', 150)):
+            notification = PushNotification.objects.create(title='Тест', message=message, cap_interval_hours=0, cap_per_day=0)
+            with self.assertLogs('api.services', 'INFO') as logs:
+                stats = send_push_notification(notification.id)
+            self.assertEqual(stats['calls'], calls)
+            self.assertIn(f'ids_per_call={150 / calls:.1f}', logs.output[-1])
+
+    def test_admin_warns_about_unique_fields(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.post('/admin/api/pushnotification/add/', {
+            'title': 'Тест', 'message': 'Привет, {first_name}', 'segment': 'all', 'status': 'draft',
+        }, follow=True)
+        self.assertContains(response, 'почти уникальным')
+
+
+class UserTimelineTests(TestCase):
+    """
+    Keyset пагинация событий пользователя: каждая страница - один запрос, события без пропусков и повторов
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(25):
+            event = tracking.create_tracking(build_utm_tracking({
+                'user_data': {'id': 777}, 'utm_params': {'utm_source': f'source_{i % 3}'}, 'url': f'https://vk.com/app1#{i}',
+            }))
+            # По три события с одинаковым временем: порядок внутри - по id
+            UTMTracking.objects.filter(pk=event.pk).update(timestamp=timezone.now().replace(microsecond=0) - timedelta(minutes=i // 3))
+        tracking.create_tracking(build_utm_tracking({'user_data': {'id': 778}}))
+
+    def test_pages_cover_timeline_once_in_order(self):
+        seen = []
+        cursor = None
+        for page in range(3):
+            with assert_query_budget(queries=1, name='user_timeline'):
+                events, cursor = tracking.user_timeline(777, 10, cursor)
+                seen.extend(event.url for event in events)
+            self.assertEqual(len(events), 10 if page < 2 else 5)
+        self.assertIsNone(cursor)
+        expected = UTMTracking.objects.filter(user_id=777).order_by('-timestamp', '-id').values_list('url', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_invalid_cursor_rejected(self):
+        with self.assertRaises(ValueError):
+            tracking.decode_cursor('не курсор')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get('/api/users/777/events/', {'cursor': 'bm8tc2VwYXJhdG9y'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogSyncTests(TestCase):
+    """
+    Синхронизация каталога применяет к таблице MFO только разницу с витриной
+    """
+
+    def offer(self, external_id, source='itfinance', **fields):
+        return {
+            'external_id': external_id, 'source': source, 'name': f'МФО {external_id}', 'logo_url': '',
+            'link': f'https://example.com/{external_id}', 'sum_min': 1000, 'sum_max': 30000, 'term_min': 7,
+            'term_max': 30, 'rate': 0.8, 'approval_chance': 90, 'payout_speed_hours': 1, 'promo_text': '',
+            'sort_order': 0, **fields,
+        }
+
+    def setUp(self):
+        sync_catalog([self.offer('1'), self.offer('2'), self.offer('3')], ['itfinance'])
+        sync_catalog([self.offer('9', source='other')], ['other'])
+
+    def test_unchanged_offers_not_written(self):
+        synced_at = dict(MFO.objects.values_list('external_id', 'synced_at'))
+        stats = sync_catalog([self.offer('1'), self.offer('2'), self.offer('3')], ['itfinance'])
+        self.assertEqual(stats, {'created': 0, 'updated': 0, 'unchanged': 3, 'deactivated': 0})
+        self.assertEqual(dict(MFO.objects.values_list('external_id', 'synced_at')), synced_at)
+
+    def test_changed_new_and_missing_offers(self):
+        stats = sync_catalog([self.offer('1', rate=0.5), self.offer('2'), self.offer('4')], ['itfinance'])
+        self.assertEqual(stats, {'created': 1, 'updated': 1, 'unchanged': 1, 'deactivated': 1})
+        self.assertEqual(MFO.objects.get(external_id='1').rate, 0.5)
+        active = set(MFO.objects.filter(is_active=True).values_list('external_id', flat=True))
+        # МФО другого источника не скрываются
+        self.assertEqual(active, {'1', '2', '4', '9'})
+
+    def test_returning_offer_reactivated(self):
+        sync_catalog([self.offer('1'), self.offer('2')], ['itfinance'])
+        stats = sync_catalog([self.offer('1'), self.offer('2'), self.offer('3')], ['itfinance'])
+        self.assertEqual((stats['updated'], stats['unchanged']), (1, 2))
+        self.assertTrue(MFO.objects.get(external_id='3').is_active)
+
+    def test_imported_row_claimed_by_name(self):
+        MFO.objects.create(**dict(self.offer('5', rate=1.0), external_id=None, source=''))
+        stats = sync_catalog([self.offer('1'), self.offer('2'), self.offer('3'), self.offer('5')], ['itfinance'])
+        self.assertEqual((stats['created'], stats['updated']), (0, 1))
+        self.assertEqual(MFO.objects.get(name='МФО 5').external_id, '5')
+
+    def test_empty_feed_and_dry_run_change_nothing(self):
+        self.assertEqual(sync_catalog([], ['itfinance'])['deactivated'], 0)
+        stats = sync_catalog([self.offer('4')], ['itfinance'], dry_run=True)
+        self.assertEqual((stats['created'], stats['deactivated']), (1, 3))
+        self.assertEqual(MFO.objects.filter(is_active=True).count(), 4)
+        self.assertFalse(MFO.objects.filter(external_id='4').exists())
+
+
+class AudienceRuleTests(TestCase):
+    """
+    Правила аудитории: SQL условие rule_q и индекс аудитории отбирают одних и тех же пользователей
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        births = [date(2008, 6, 15), date(2008, 6, 16), date(1991, 6, 16), date(1991, 6, 15), None]
+        VKUser.objects.bulk_create([
+            VKUser(
+                vk_user_id=i, birth_date=births[i % 5], total_visits=i, sex=1 + i % 2, vk_city_id=1 + i % 3,
+                vk_country_id=1, city=['Москва', 'Казань', ''][i % 3], utm_source=['vk_ads', 'telegram'][i % 2],
+                utm_campaign=f'spring_{i % 4}', notifications_allowed=i % 4 != 0,
+            )
+            for i in range(20)
+        ])
+
+    def test_age_bounds_inclusive(self):
+        now = datetime(2026, 6, 15, 12, tzinfo=timezone.get_current_timezone())
+        users = VKUser.objects.filter(rule_q({'age': {'min': 18, 'max': 34}}, now))
+        self.assertEqual(set(users.values_list('birth_date', flat=True)), {date(2008, 6, 15), date(1991, 6, 16)})
+        self.assertEqual(years_ago(date(2024, 2, 29), 1), date(2023, 2, 28))
+
+    def test_rule_q_agrees_with_segment_index(self):
+        index = SegmentIndex()
+        index.load(VKUser.objects.all())
+        rules = [
+            {'and': [{'subscribed': True}, {'visits': {'min': 3, 'max': 12}}]},
+            # LIKE в SQLite не сравнивает регистр кириллицы, поэтому подстрока в регистре значения
+            {'or': [{'city': 'Моск'}, {'city_id': [3]}]},
+            {'not': {'utm_source': 'VK'}},
+            {'and': [{'age': {'max': 20}}, {'sex': 2}, {'country_id': 1}]},
+            {'and': [{'utm_campaign': 'spring_1'}, {'not': {'segment': 'inactive'}}, {'active_days': 1}]},
+            {'users': list(VKUser.objects.values_list('pk', flat=True)[:3])},
+        ]
+        for rule in rules:
+            with self.subTest(rule=rule):
+                self.assertEqual(index.count(rule), VKUser.objects.filter(rule_q(rule)).count())
+
+    def test_invalid_rules_rejected(self):
+        for rule in (
+            {}, {'and': []}, {'age': {'min': 30, 'max': 20}}, {'visits': {'min': -1}}, {'sex': True},
+            {'segment': 'vip'}, {'city': ' '}, {'city_id': ['1']}, {'height': 180}, {'age': {'from': 18}},
+        ):
+            with self.subTest(rule=rule), self.assertRaises(ValueError):
+                rule_q(rule)
+
+    def test_parse_birth_date(self):
+        self.assertEqual(parse_birth_date('5.3.1990'), date(1990, 3, 5))
+        for bdate in ('5.3', '31.2.1990', '1.1.1800', '', None):
+            self.assertIsNone(parse_birth_date(bdate))
+
+
+@override_settings(PUSH_CAP_INTERVAL_HOURS=0, PUSH_CAP_PER_DAY=0)
+class FrequencyCapTests(TestCase):
+    """
+    Журнал частоты пушей: окно, счетчик и исключение упирающихся в лимит получателей
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = VKUser.objects.bulk_create([VKUser(vk_user_id=i, notifications_allowed=True) for i in range(4)])
+        cls.pks = [user.pk for user in cls.users]
+
+    def ledger(self):
+        return {row.user_id: row for row in PushLedger.objects.all()}
+
+    def targets(self, **caps):
+        notification = PushNotification(title='Тест', message='Привет', **caps)
+        return set(notification.get_target_users_queryset().values_list('pk', flat=True))
+
+    def test_record_pushes_counts_within_window(self):
+        now = timezone.now()
+        record_pushes(self.pks[:2], now - timedelta(hours=2))
+        # UPDATE известных и INSERT новых; SAVEPOINT и RELEASE - atomic внутри транзакции теста
+        with self.assertNumQueries(4):
+            record_pushes(self.pks[:3], now)
+        ledger = self.ledger()
+        self.assertEqual([ledger[pk].window_count for pk in self.pks[:3]], [2, 2, 1])
+        self.assertEqual(ledger[self.pks[0]].window_started_at, now - timedelta(hours=2))
+        self.assertEqual(ledger[self.pks[0]].last_push_at, now)
+
+    def test_expired_window_starts_again(self):
+        now = timezone.now()
+        record_pushes(self.pks[:1], now - CAP_WINDOW - timedelta(minutes=1))
+        record_pushes(self.pks[:1], now)
+        row = self.ledger()[self.pks[0]]
+        self.assertEqual((row.window_count, row.window_started_at), (1, now))
+
+    def test_interval_and_daily_caps(self):
+        now = timezone.now()
+        record_pushes(self.pks[:1], now - timedelta(hours=5))
+        record_pushes(self.pks[:2], now - timedelta(hours=1))
+        self.assertEqual(self.targets(cap_interval_hours=3), set(self.pks[2:]))
+        self.assertEqual(self.targets(cap_interval_hours=0, cap_per_day=2), set(self.pks[1:]))
+        self.assertEqual(self.targets(cap_interval_hours=0, cap_per_day=0), set(self.pks))
+
+    def test_defaults_from_settings(self):
+        record_pushes(self.pks[:1])
+        self.assertIsNone(capped_users(PushNotification()))
+        self.assertEqual(self.targets(), set(self.pks))
+        with self.settings(PUSH_CAP_INTERVAL_HOURS=24):
+            self.assertEqual(self.targets(), set(self.pks[1:]))
+            # 0 в уведомлении отключает лимит по умолчанию
+            self.assertEqual(self.targets(cap_interval_hours=0), set(self.pks))
+
+
+class ScriptedPacer(Pacer):
+    """
+    Pacer с заданными замерами задержки бэкенда вместо запросов
+    """
+
+    def __init__(self, per_minute, latencies):
+        super().__init__(per_minute, adaptive=True)
+        self.script = list(latencies)
+
+    def probe(self):
+        return self.script.pop(0)
+
+
+class PacerTests(TestCase):
+    """
+    Равномерная отправка: расписание, догон без залпа и замедление по p95
+    """
+
+    def test_pacer_for_notification(self):
+        self.assertIsNone(pacer_for(PushNotification(), 1000))
+        self.assertEqual(pacer_for(PushNotification(pace_window_minutes=7), 1000).per_minute, 143)
+        self.assertEqual(pacer_for(PushNotification(pace_per_minute=600, pace_window_minutes=7), 1000).per_minute, 600)
+        self.assertIsNone(pacer_for(PushNotification(pace_window_minutes=7), 0))
+
+    def test_batches_spread_evenly(self):
+        pacer = Pacer(6000)
+        self.assertEqual(pacer.batch_size(100), 100)
+        self.assertEqual(Pacer(600).batch_size(100), 10)
+        self.assertEqual(Pacer(30).batch_size(100), 1)
+        started = time.monotonic()
+        for _ in range(5):
+            pacer.wait(10)
+        # 10 сообщений при 100 в секунду - 0.1 с; первый вызов без ожидания
+        self.assertGreaterEqual(time.monotonic() - started, 0.39)
+
+    def test_lag_caught_up_without_burst(self):
+        pacer = Pacer(60)
+        pacer.next_at = time.monotonic() - 30
+        pacer.wait(1)
+        self.assertGreaterEqual(pacer.next_at, time.monotonic() - CATCH_UP)
+
+    @override_settings(PUSH_PACE_PROBE_INTERVAL=0, PUSH_PACE_LATENCY_TARGET_MS=500)
+    def test_adaptive_slows_down_and_recovers(self):
+        pacer = ScriptedPacer(6000, [1.0] * 12 + [0.1] * 3)
+        for _ in range(3):
+            pacer.adapt()
+        self.assertEqual(pacer.factor, 0.5)
+        # Решение - по трем новым замерам после каждой смены скорости: 0.25, 0.125, MIN_FACTOR
+        for _ in range(9):
+            pacer.adapt()
+        self.assertEqual(pacer.factor, MIN_FACTOR)
+        for _ in range(3):
+            pacer.adapt()
+        self.assertAlmostEqual(pacer.factor, MIN_FACTOR * 1.25)
+        self.assertEqual(percentile([0.1, 0.2, 0.3, 0.4], 0.95), 0.4)
+
+
+@override_settings(VK_APP_ACCESS_TOKEN='secret-token', VK_API_BASE_URL=f'{UNREACHABLE_URL}/method')
+class PushTokenTests(TestCase):
+    """
+    Токен VK не попадает в логи и PushLog при сетевых ошибках
+    """
+
+    def test_network_error_redacted(self):
+        VKUser.objects.bulk_create([VKUser(vk_user_id=i, notifications_allowed=True) for i in range(3)])
+        notification = PushNotification.objects.create(title='Тест', message='Привет', cap_interval_hours=0, cap_per_day=0)
+        with self.assertLogs('api.services', 'INFO') as logs:
+            stats = send_push_notification(notification.id)
+        self.assertEqual(stats['failed'], 3)
+        errors = set(PushLog.objects.values_list('error_message', flat=True))
+        self.assertTrue(all(error.startswith('ConnectionError: ') for error in errors))
+        self.assertNotIn('secret-token', '\n'.join(logs.output) + ''.join(errors))
+
+    def test_request_error_drops_query_string(self):
+        error = requests.ConnectionError(
+            "HTTPConnectionPool(host='vk'): Max retries exceeded with url: /method/x?access_token=secret-token&v=5.131 (Caused by timeout)"
+        )
+        self.assertEqual(
+            request_error(error),
+            "ConnectionError: HTTPConnectionPool(host='vk'): Max retries exceeded with url: /method/x (Caused by timeout)",
+        )
@@ -0,0 +1,227 @@
+"""
+Запись и чтение UTM событий в компактной схеме
+
+Повторяющиеся строковые параметры (utm_source/medium/campaign/content, vk_*,
+event_type) заменяются ключами справочника TrackingDimension, User-Agent - ключом
+UserAgent (по SHA-1), исходные данные запроса сохраняются один раз в сжатом JSON.
+url, referrer и utm_term почти у каждого события уникальны (параметры запуска
+vk_ts/sign, ID пользователя) и пишутся в колонки события целиком (TEXT_FIELDS).
+
+Ключи справочников кэшируются в памяти процесса: повторные значения
+не требуют запросов к базе. При переполнении кэша вытесняются самые старые ключи.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import threading
+import zlib
+from datetime import datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import TrackingDimension, UserAgent, UTMTracking
+
+DIMENSION_FIELDS = tuple(kind for kind, _ in TrackingDimension.KIND_CHOICES)
+TEXT_FIELDS = ('utm_term', 'url', 'referrer')
+# Значения справочника - короткие идентификаторы; исходная строка остается в payload
+DIMENSION_MAX_LENGTH = 500
+RESOLVER_CACHE_SIZE = 100000
+TIMELINE_DIMENSIONS = ('event_type', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'vk_platform', 'vk_ad_id')
+TIMELINE_FIELDS = ('url',)
+
+_dimension_ids = {}
+_user_agent_ids = {}
+_cache_lock = threading.Lock()
+
+
+def _store(cache, values):
+    with _cache_lock:
+        cache.update(values)
+        overflow = len(cache) - RESOLVER_CACHE_SIZE
+        if overflow > 0:
+            # Словарь хранит порядок добавления: первыми вытесняются самые старые ключи
+            for key in list(islice(cache, overflow)):
+                del cache[key]
+
+
+def _remember(cache, values, created):
+    if created:
+        # Новые записи могут откатиться вместе с транзакцией - кэшируем после коммита
+        transaction.on_commit(lambda: _store(cache, values))
+    else:
+        _store(cache, values)
+
+
+def _lookup_dimensions(keys):
+    query = Q()
+    for kind, value in keys:
+        query |= Q(kind=kind, value=value)
+    return {
+        (kind, value): dimension_id
+        for dimension_id, kind, value in TrackingDimension.objects.filter(query).values_list('id', 'kind', 'value')
+    }
+
+
+def resolve_dimensions(values):
+    """
+    Ключи справочника для словаря {kind: значение} (None для пустых значений)
+
+    Не больше трех запросов на все значения события, ноль - если все уже в кэше.
+    """
+    keys = {}
+    for kind, value in values.items():
+        value = str(value)[:DIMENSION_MAX_LENGTH] if value is not None else ''
+        if value:
+            keys[kind] = (kind, value)
+
+    missing = {key for key in keys.values() if key not in _dimension_ids}
+    if missing:
+        found = _lookup_dimensions(missing)
+        _remember(_dimension_ids, found, created=False)
+        new = missing - found.keys()
+        if new:
+            TrackingDimension.objects.bulk_create(
+                [TrackingDimension(kind=kind, value=value) for kind, value in new],
+                ignore_conflicts=True,
+            )
+            created = _lookup_dimensions(new)
+            _remember(_dimension_ids, created, created=True)
+            found.update(created)
+    else:
+        found = {}
+
+    return {
+        kind: (found.get(keys[kind]) or _dimension_ids.get(keys[kind])) if kind in keys else None
+        for kind in values
+    }
+
+
+def dimension_id(kind, value):
+    return resolve_dimensions({kind: value})[kind]
+
+
+def user_agent_id(value):
+    if not value:
+        return None
+
+    digest = hashlib.sha1(value.encode('utf-8')).hexdigest()
+    cached = _user_agent_ids.get(digest)
+    if cached is not None:
+        return cached
+
+    user_agent, created = UserAgent.objects.get_or_create(hash=digest, defaults={'value': value})
+    _remember(_user_agent_ids, {digest: user_agent.id}, created)
+    return user_agent.id
+
+
+def encode_payload(data):
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    if settings.UTM_PAYLOAD_COMPRESSION:
+        return zlib.compress(raw)
+    return raw
+
+
+def decode_payload(blob):
+    if not blob:
+        return {}
+    blob = bytes(blob)
+    # zlib поток начинается с 0x78, JSON - с "{" или "["
+    if blob[:1] == b'\x78':
+        blob = zlib.decompress(blob)
+    return json.loads(blob.decode('utf-8'))
+
+
+def normalize_vk_user_id(value):
+    """
+    VK ID из данных клиента (число или строка из цифр) или None
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if value > 0 else None
+    value = str(value or '').strip()
+    return int(value) if value.isdigit() else None
+
+
+def tracking_fields(fields):
+    """
+    Поля модели UTMTracking из словаря строковых параметров
+    (см. build_utm_tracking / build_arbitrage_tracking в api/partners.py)
+    """
+    values = {
+        'user_id': normalize_vk_user_id(fields.get('user_id')),
+        'user_agent_id': user_agent_id(fields.get('user_agent')),
+        'payload': encode_payload(fields.get('payload', {})),
+    }
+    for field in TEXT_FIELDS:
+        value = fields.get(field)
+        values[field] = str(value) if value is not None else ''
+    dimensions = resolve_dimensions({kind: fields.get(kind) for kind in DIMENSION_FIELDS})
+    for kind, dimension_id in dimensions.items():
+        values[f'{kind}_id'] = dimension_id
+    return values
+
+
+def create_tracking(fields):
+    return UTMTracking.objects.create(**tracking_fields(fields))
+
+
+# Async представления: справочники читаются и дополняются синхронным ORM
+acreate_tracking = sync_to_async(create_tracking)
+
+
+def encode_cursor(event):
+    """
+    Курсор keyset пагинации: позиция события (timestamp, id)
+    """
+    raw = f'{event.timestamp.isoformat()}|{event.id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    (timestamp, id) из курсора; ValueError для неверного курсора
+    """
+    try:
+        timestamp, event_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(timestamp), int(event_id)
+    except (UnicodeError, binascii.Error) as e:
+        raise ValueError(f'Неверный курсор: {e}')
+
+
+def user_timeline(vk_user_id, limit, cursor=None):
+    """
+    События пользователя от новых к старым, страница после cursor
+
+    Использует индекс api_utm_user_timeline (vk_user_id, timestamp DESC, id DESC).
+    """
+    queryset = (
+        UTMTracking.objects.filter(user_id=vk_user_id)
+        .select_related(*TIMELINE_DIMENSIONS)
+        .order_by('-timestamp', '-id')
+    )
+    if cursor:
+        timestamp, event_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=event_id))
+
+    events = list(queryset[:limit + 1])
+    next_cursor = encode_cursor(events[limit - 1]) if len(events) > limit else None
+    return events[:limit], next_cursor
+
+
+def serialize_event(event):
+    data = {
+        'id': event.id,
+        'timestamp': event.timestamp.isoformat(),
+    }
+    for kind in TIMELINE_DIMENSIONS:
+        dimension = getattr(event, kind)
+        data[kind] = dimension.value if dimension is not None else ''
+    for field in TIMELINE_FIELDS:
+        data[field] = getattr(event, field)
+    return data
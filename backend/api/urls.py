@@ -1,10 +1,16 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
     mfo_list, mfo_detail, utm_track, utm_stats, offers_list, upload_mfo_excel, mfo_template,
     user_register, user_allow_notifications, user_status, push_click_track, users_stats,
-    send_to_leads_tech
+    send_to_leads_tech, session_bootstrap, user_events, export_data, segment_estimate
 )
 
+# Под ASGI внешние запросы обслуживают асинхронные версии представлений
+if settings.ASYNC_VIEWS:
+    from .async_views import mfo_list_async as mfo_list
+    from .async_views import send_to_leads_tech_async as send_to_leads_tech
+
 # URL-ы API
 urlpatterns = [
     # МФО endpoints
@@ -27,9 +33,17 @@ urlpatterns = [
     path('users/allow-notifications/', user_allow_notifications, name='user-allow-notifications'),
     path('users/status/', user_status, name='user-status'),
     path('users/stats/', users_stats, name='users-stats'),
+    path('users/<int:vk_user_id>/events/', user_events, name='user-events'),
+    
+    # Выгрузки для аналитиков (csv, csv.gz, xlsx)
+    path('exports/<slug:dataset>.<str:file_format>', export_data, name='export-data'),
     
     # Пуш-уведомления endpoints
     path('push/click-track/', push_click_track, name='push-click-track'),
+    path('push/segments/estimate/', segment_estimate, name='segment-estimate'),
+    
+    # Запуск Mini App одним запросом
+    path('session/bootstrap/', session_bootstrap, name='session-bootstrap'),
     
     # Арбитраж endpoints
     path('arbitrage/send-to-leads-tech/', send_to_leads_tech, name='send-to-leads-tech'),
@@ -3,21 +3,34 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from django_ratelimit.decorators import ratelimit
+from django.conf import settings
 from django.utils import timezone
+from django.db import transaction
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from .models import MFO, Offer, UTMTracking, VKUser, PushNotification, PushLog
 from .services import register_or_update_user, check_notifications_permission
+from .stats import get_users_stats
+from .catalog import get_catalog, get_catalog_index, parse_catalog_query, query_catalog
+from .postbacks import enqueue_leads_tech_postback
+from .metrics import observe_upstream, render_prometheus
+from .query_budget import query_budget
+from .tracking import create_tracking, user_timeline, serialize_event
+from .exports import DATASETS, EXPORT_FORMATS, export_chunks, export_filename
+from .logos import logo_urls
+from .segments import SegmentIndexNotReady, estimate_segment, notification_rule
+from .partners import (
+    get_client_ip, build_leads_tech_data, build_leads_tech_params, build_leads_tech_url,
+    leads_tech_request_headers, build_utm_tracking, build_arbitrage_tracking,
+)
 import json
-import pandas as pd
 import io
 import traceback
 from rest_framework import serializers
 from django.db.models import Count
 import logging
 import requests
-import re
 
 logger = logging.getLogger(__name__)
 
@@ -54,99 +67,39 @@ class MFOSerializer(serializers.ModelSerializer):
     def get_repay_methods(self, obj):
         return self.get_string_as_list(obj, 'repay_methods')
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Логотип - локальная уменьшенная копия (api/logos.py), если она есть
+        data.update(logo_urls(instance.logo_url, instance.logo_source, instance.logo_file))
+        return data
+
 
 # =============================================================================
 # API VIEWS
 # =============================================================================
 
+@query_budget(queries=2)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def mfo_list(request):
     """
-    Получение списка МФО из внешнего API itfinance.online
+    Получение списка МФО из локального каталога (синхронизируется с itfinance.online)
+    
+    С параметрами amount, term, max_rate, sort (approval, rate, speed, overpayment),
+    limit и offset возвращает подходящие офферы из индекса каталога:
+    {"count": ..., "offset": ..., "limit": ..., "next_offset": ..., "results": [...]}
     """
     try:
-        # URL внешнего API
-        api_url = "https://api.we.itfinance.online/v1/website-shopwindow-offers?website_id=4228&shopwindow_type=of-list-suc"
-        
-        # Пробрасываем важные заголовки от пользователя
-        headers = {
-            'User-Agent': request.headers.get('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'),
-            'Referer': request.headers.get('Referer', 'https://vk.com/'),
-        }
-
-        logger.info(f"Запрашиваем данные из {api_url} с заголовками: {headers}")
-
-        # Выполняем запрос
-        response = requests.get(api_url, timeout=10, headers=headers)
-
-        logger.info(f"Ответ от itfinance.online: status_code={response.status_code}")
-        
-        # Логируем часть контента для отладки, если есть проблемы
-        if response.status_code != 200:
-             logger.warning(f"Контент ответа itfinance.online: {response.text[:500]}")
-        
-        response.raise_for_status()  # Вызовет исключение для кодов 4xx/5xx
-        
-        data = response.json()
-        
-        logger.info(f"Получено {len(data.get('items', []))} офферов от itfinance.online")
-
-        transformed_mfos = []
-        for item in data.get('items', []):
-            offer = item.get('offer', {})
-            if not offer:
-                continue
-
-            # --- Извлечение approval_chance ---
-            approval_chance = 80  # Default value
-            label_text = item.get('label_text', '')
-            match = re.search(r'(\d+)%', label_text)
-            if match:
-                approval_chance = int(match.group(1))
-            else:
-                # Fallback based on order if no percentage found
-                order = item.get('order', 5)
-                approval_chance = max(100 - order * 5, 75)
-
-            # --- Извлечение payout_speed_hours ---
-            payout_speed_hours = 24 # Default value
-            if 'моментально' in label_text.lower():
-                payout_speed_hours = 0.5
-            elif 'в 2 клика' in label_text.lower():
-                 payout_speed_hours = 1.0
-            else:
-                order = item.get('order', 5)
-                payout_speed_hours = max(24 - order * 2, 1)
-
-            transformed_mfos.append({
-                'id': offer.get('inn') or item.get('order'), # Use INN or order as ID
-                'name': offer.get('product_name'),
-                'logo_url': offer.get('image_link'),
-                'link': item.get('link'),
-                'sum_min': int(float(offer.get('amount_min', 0))),
-                'sum_max': int(float(offer.get('amount_max', 0))),
-                'term_min': offer.get('loan_term_from'),
-                'term_max': offer.get('loan_term_to'),
-                'rate': float(offer.get('daily_percentage_min', 0.8)),
-                'approval_chance': approval_chance,
-                'payout_speed_hours': payout_speed_hours,
-                'promo_text': label_text, # Дополнительное поле для фронтенда
-                'requirements': [], # Отсутствует в API
-                'get_methods': [], # Отсутствует в API
-                'repay_methods': [], # Отсутствует в API
-            })
-            
-        return Response(transformed_mfos)
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка при запросе к API itfinance.online: {e}")
-        return Response({'error': 'Не удалось получить данные от партнера'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
-    except Exception as e:
-        logger.exception("Непредвиденная ошибка в mfo_list при работе с внешним API")
-        return Response({'error': 'Внутренняя ошибка сервера'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        catalog_query = parse_catalog_query(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if catalog_query is not None:
+        return Response(query_catalog(get_catalog_index(), catalog_query))
+    return Response(get_catalog())
 
 
+@query_budget(queries=1, rows=1)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def mfo_detail(request, pk):
@@ -162,6 +115,7 @@ def mfo_detail(request, pk):
         return Response({'error': 'MFO not found'}, status=status.HTTP_404_NOT_FOUND)
 
 
+@query_budget(queries=8)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @ratelimit(key='ip', rate='100/h', method='POST')
@@ -172,39 +126,8 @@ def utm_track(request):
     try:
         data = request.data
         
-        # Извлекаем основные UTM параметры
-        utm_params = data.get('utm_params', {})
-        user_data = data.get('user_data', {})
-        
         # Создаем запись UTM отслеживания
-        utm_tracking = UTMTracking.objects.create(
-            user_id=user_data.get('id') or utm_params.get('vk_user_id') or utm_params.get('user_id'),
-            
-            # UTM параметры
-            utm_source=utm_params.get('utm_source', ''),
-            utm_medium=utm_params.get('utm_medium', ''),
-            utm_campaign=utm_params.get('utm_campaign', ''),
-            utm_content=utm_params.get('utm_content', ''),
-            utm_term=utm_params.get('utm_term', ''),
-            
-            # VK параметры
-            vk_ad_id=utm_params.get('vk_ad_id') or utm_params.get('ad_id', ''),
-            vk_ref=utm_params.get('vk_ref') or utm_params.get('ref', ''),
-            vk_ref_source=utm_params.get('vk_ref_source') or utm_params.get('ref_source', ''),
-            vk_platform=utm_params.get('vk_platform', ''),
-            
-            # Дополнительные данные
-            url=data.get('url', ''),
-            referrer=data.get('referrer', ''),
-            user_agent=data.get('user_agent', ''),
-            
-            # Полные данные
-            full_utm_data=utm_params,
-            full_user_data=user_data,
-            
-            # Тип события
-            event_type=data.get('event_type', 'page_view')
-        )
+        utm_tracking = create_tracking(build_utm_tracking(data))
         
         return Response({
             'success': True,
@@ -221,6 +144,7 @@ def utm_track(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(queries=6, rows=5000)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def utm_stats(request):
@@ -239,27 +163,22 @@ def utm_stats(request):
         )
         
         if utm_source:
-            queryset = queryset.filter(utm_source=utm_source)
+            queryset = queryset.filter(utm_source__value=utm_source)
         if utm_campaign:
-            queryset = queryset.filter(utm_campaign=utm_campaign)
+            queryset = queryset.filter(utm_campaign__value=utm_campaign)
         
-        # Статистика по источникам
-        sources_stats = {}
-        campaigns_stats = {}
-        platforms_stats = {}
-        
-        for tracking in queryset:
-            # Статистика по источникам
-            source = tracking.utm_source or 'unknown'
-            sources_stats[source] = sources_stats.get(source, 0) + 1
-            
-            # Статистика по кампаниям
-            campaign = tracking.utm_campaign or 'unknown'
-            campaigns_stats[campaign] = campaigns_stats.get(campaign, 0) + 1
-            
-            # Статистика по платформам
-            platform = tracking.vk_platform or 'unknown'
-            platforms_stats[platform] = platforms_stats.get(platform, 0) + 1
+        # Статистика по источникам, кампаниям и платформам считается в БД
+        def count_by(field):
+            stats = {}
+            lookup = f'{field}__value'
+            for row in queryset.values(lookup).annotate(total=Count('id')).order_by():
+                key = row[lookup] or 'unknown'
+                stats[key] = stats.get(key, 0) + row['total']
+            return stats
+
+        sources_stats = count_by('utm_source')
+        campaigns_stats = count_by('utm_campaign')
+        platforms_stats = count_by('vk_platform')
         
         return Response({
             'period_days': days,
@@ -273,12 +192,12 @@ def utm_stats(request):
                     'id': t.id,
                     'timestamp': t.timestamp.isoformat(),
                     'user_id': t.user_id,
-                    'utm_source': t.utm_source,
-                    'utm_campaign': t.utm_campaign,
-                    'vk_ad_id': t.vk_ad_id,
-                    'event_type': t.event_type
+                    'utm_source': t.utm_source.value if t.utm_source else '',
+                    'utm_campaign': t.utm_campaign.value if t.utm_campaign else '',
+                    'vk_ad_id': t.vk_ad_id.value if t.vk_ad_id else '',
+                    'event_type': t.event_type.value if t.event_type else ''
                 }
-                for t in queryset.order_by('-timestamp')[:10]
+                for t in queryset.select_related('utm_source', 'utm_campaign', 'vk_ad_id', 'event_type').order_by('-timestamp')[:10]
             ]
         })
         
@@ -288,6 +207,101 @@ def utm_stats(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(queries=1, rows=201)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def user_events(request, vk_user_id):
+    """
+    Хронология UTM событий пользователя (от новых к старым)
+    
+    GET параметры:
+        limit  - событий на странице (по умолчанию 50, максимум 200)
+        cursor - next_cursor из предыдущего ответа
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 50)), 1), 200)
+        events, next_cursor = user_timeline(vk_user_id, limit, request.GET.get('cursor'))
+    except ValueError as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'vk_user_id': vk_user_id,
+        'events': [serialize_event(event) for event in events],
+        'next_cursor': next_cursor,
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def segment_estimate(request):
+    """
+    Размер аудитории пуша по индексу аудитории (см. api/segments.py)
+    
+    Тело запроса:
+        {"rule": {"and": [{"subscribed": true}, {"city": "Москва"}, {"not": {"segment": "new"}}]}}
+        или {"notification": 15} - аудитория существующего уведомления
+    
+    count - за вычетом пользователей, упирающихся в лимиты частоты уведомления
+    (для rule - лимиты по умолчанию), before_caps - без учета лимитов.
+    Пока индекс аудитории загружается в фоне, ответ 503.
+    """
+    rule = request.data.get('rule')
+    notification = None
+    if rule is None and request.data.get('notification'):
+        try:
+            notification = PushNotification.objects.get(pk=request.data['notification'])
+        except (PushNotification.DoesNotExist, ValueError, TypeError):
+            return Response({'error': 'Уведомление не найдено'}, status=status.HTTP_404_NOT_FOUND)
+        rule = notification_rule(notification)
+    if rule is None:
+        return Response({'error': 'Укажите rule или notification'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        return Response(estimate_segment(rule, notification))
+    except SegmentIndexNotReady as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except ValueError as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def export_data(request, dataset, file_format):
+    """
+    Потоковая выгрузка пользователей, логов пушей или UTM событий (см. api/exports.py)
+    
+    Пример: /api/exports/utm.csv.gz?date_from=2025-01-01&date_to=2025-01-31&utm_source=vk
+    """
+    export = DATASETS.get(dataset)
+    if export is None or file_format not in EXPORT_FORMATS:
+        return Response({
+            'error': f'Доступны выгрузки {", ".join(DATASETS)} в форматах {", ".join(EXPORT_FORMATS)}'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        queryset = export.queryset(request.GET)
+    except ValueError as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    response = StreamingHttpResponse(
+        export_chunks(export, queryset, file_format),
+        content_type=EXPORT_FORMATS[file_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(export, file_format)}"'
+    # nginx не должен буферизовать выгрузку целиком
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@query_budget(queries=1, rows=500)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def offers_list(request):
@@ -314,6 +328,9 @@ def upload_mfo_excel(request):
     """
     Загрузка МФО из Excel файла
     """
+    # pandas тяжелый, импортируем только когда он действительно нужен
+    import pandas as pd
+
     try:
         if 'file' not in request.FILES:
             return Response({
@@ -423,12 +440,15 @@ def upload_mfo_excel(request):
             'traceback': traceback.format_exc()
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@query_budget(queries=0)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def mfo_template(request):
     """
     Получение шаблона Excel файла для загрузки МФО
     """
+    import pandas as pd
+
     try:
         # Создаем шаблон с примерами данных
         template_data = {
@@ -470,6 +490,7 @@ def mfo_template(request):
             'error': f'Ошибка создания шаблона: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@query_budget(queries=6)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @ratelimit(key='ip', rate='50/h', method='POST')
@@ -528,6 +549,7 @@ def user_register(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(queries=4)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @ratelimit(key='ip', rate='30/h', method='POST')
@@ -580,6 +602,7 @@ def user_allow_notifications(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(queries=2, rows=1)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def user_status(request):
@@ -635,6 +658,7 @@ def user_status(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(queries=5)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def push_click_track(request):
@@ -701,38 +725,21 @@ def push_click_track(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+# Обычно 0-1 запрос (копия в памяти или общий кэш); бюджет - пересчет:
+# блокировка, агрегат и запись в общий кэш (DatabaseCache: COUNT, SELECT, INSERT)
+@query_budget(queries=13, rows=4)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def users_stats(request):
     """
-    Статистика по пользователям
+    Статистика по пользователям (кэшируется, см. api.stats)
     """
     try:
-        from datetime import timedelta
-        
-        total_users = VKUser.objects.count()
-        active_users = VKUser.objects.filter(
-            last_visit__gte=timezone.now() - timedelta(days=7)
-        ).count()
-        new_users = VKUser.objects.filter(
-            first_visit__gte=timezone.now() - timedelta(days=3)
-        ).count()
-        notifications_allowed = VKUser.objects.filter(
-            notifications_allowed=True,
-            notifications_enabled=True
-        ).count()
-        
-        subscription_rate = round((notifications_allowed / total_users * 100) if total_users > 0 else 0, 2)
+        stats = get_users_stats()
         
         return Response({
             'success': True,
-            'stats': {
-                'total_users': total_users,
-                'active_users_7d': active_users,
-                'new_users_3d': new_users,
-                'subscribed_users': notifications_allowed,
-                'subscription_rate': subscription_rate
-            }
+            'stats': stats
         })
         
     except Exception as e:
@@ -742,6 +749,7 @@ def users_stats(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@query_budget(queries=10)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @ratelimit(key='ip', rate='100/h', method='POST')
@@ -752,66 +760,9 @@ def send_to_leads_tech(request):
     try:
         data = request.data
         
-        # Получаем IP адрес пользователя
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip_address = x_forwarded_for.split(',')[0]
-        else:
-            ip_address = request.META.get('REMOTE_ADDR', '')
-        
         # Подготавливаем данные для leads.tech
-        leads_tech_data = {
-            'user_id': data.get('user_id', ''),
-            'first_name': data.get('first_name', ''),
-            'last_name': data.get('last_name', ''),
-            'email': data.get('email', ''),
-            'phone': data.get('phone', ''),
-            'utm_source': data.get('utm_source', ''),
-            'utm_medium': data.get('utm_medium', ''),
-            'utm_campaign': data.get('utm_campaign', ''),
-            'utm_content': data.get('utm_content', ''),
-            'utm_term': data.get('utm_term', ''),
-            'vk_user_id': data.get('vk_user_id', ''),
-            'vk_ad_id': data.get('vk_ad_id', ''),
-            'vk_ref': data.get('vk_ref', ''),
-            'vk_ref_source': data.get('vk_ref_source', ''),
-            'vk_platform': data.get('vk_platform', ''),
-            'click_id': data.get('click_id', ''),
-            'sub_id': data.get('sub_id', ''),
-            's1': data.get('s1', ''),
-            's2': data.get('s2', ''),
-            's3': data.get('s3', ''),
-            's4': data.get('s4', ''),
-            's5': data.get('s5', ''),
-            's6': data.get('s6', ''),
-            's7': data.get('s7', ''),
-            's8': data.get('s8', ''),
-            'timestamp': data.get('timestamp', ''),
-            'url': data.get('url', ''),
-            'referrer': data.get('referrer', ''),
-            'user_agent': data.get('user_agent', ''),
-            'ip_address': ip_address,
-        }
-        
-        # Параметры для leads.tech (формат офферов)
-        # Поддерживаем стандартные VK параметры И старый формат для обратной совместимости
-        # Приоритет: campaign_id/banner_id (VK стандарт) → ref/ref_source (старый формат)
-        leads_tech_params = {
-            's4': (data.get('s4') or 
-                   data.get('campaign_id') or  # VK стандарт: {{campaign_id}}
-                   data.get('utm_campaign') or  # Стандартный UTM
-                   data.get('ref') or           # Старый формат
-                   data.get('vk_ref') or ''),
-            's5': (data.get('s5') or 
-                   data.get('banner_id') or     # VK стандарт: {{banner_id}}
-                   data.get('utm_content') or   # Стандартный UTM
-                   data.get('ref_source') or    # Старый формат
-                   data.get('vk_ref_source') or ''),
-            's6': (data.get('s6') or 
-                   data.get('user_id') or       # Основной ID
-                   data.get('utm_term') or      # VK может передать в utm_term
-                   data.get('vk_user_id') or ''),
-        }
+        leads_tech_data = build_leads_tech_data(data, get_client_ip(request))
+        leads_tech_params = build_leads_tech_params(data)
         
         # Логируем все входящие данные для отладки
         logger.info(f"🔍 [Leads.Tech] Входящие данные: {data}")
@@ -821,10 +772,8 @@ def send_to_leads_tech(request):
         
         # Реальная интеграция с leads.tech
         try:
-            import requests
-            
             offer_id = data.get('offer_id')
-            leads_tech_url = "https://безотказа.бабкиманки.рф/Eg5hd"
+            leads_tech_url = settings.LEADS_TECH_FALLBACK_URL
 
             if offer_id:
                 try:
@@ -835,46 +784,17 @@ def send_to_leads_tech(request):
                     logger.warning(f"⚠️ [Leads.Tech] MFO с ID {offer_id} не найдено. Используем fallback URL.")
             else:
                 logger.warning("⚠️ [Leads.Tech] offer_id не предоставлен. Используем fallback URL.")
-                
-            # ВАЖНО: Заменяем плейсхолдеры {ref}, {ref_source}, {user_id} на реальные значения
-            # Это нужно, чтобы в URL не было дублирования параметров
-            # ФИНАЛЬНОЕ ИСПРАВЛЕНИЕ: приводим все значения к строке перед заменой
-            leads_tech_url = leads_tech_url.replace('{ref}', str(leads_tech_params.get('s4', '')))
-            leads_tech_url = leads_tech_url.replace('{ref_source}', str(leads_tech_params.get('s5', '')))
-            leads_tech_url = leads_tech_url.replace('{user_id}', str(leads_tech_params.get('s6', '')))
             
-            # Очистка пустых параметров после замены плейсхолдеров
-            # Удаляем параметры вида &param= или ?param=
-            import re
-            leads_tech_url = re.sub(r'[&?]\w+=$', '', leads_tech_url)  # в конце
-            leads_tech_url = re.sub(r'[&?]\w+=[&]', '&', leads_tech_url)  # в середине
-            leads_tech_url = re.sub(r'\?&', '?', leads_tech_url)  # ?& -> ?
-            leads_tech_url = re.sub(r'&&+', '&', leads_tech_url)  # && -> &
-            leads_tech_url = re.sub(r'[?&]$', '', leads_tech_url)  # удаляем ? или & в конце
-                
-            # Если после замены плейсхолдеров нужно добавить дополнительные параметры
-            # (когда в leads_tech_params есть значения, но их нет в базовой ссылке)
-            params_to_add = []
-            for key, value in leads_tech_params.items():
-                if value and key not in leads_tech_url:
-                    params_to_add.append(f"{key}={str(value)}") # Приводим к строке
-            
-            if params_to_add:
-                separator = "&" if "?" in leads_tech_url else "?"
-                leads_tech_url = leads_tech_url + separator + "&".join(params_to_add)
-            
-            leads_tech_params_url = leads_tech_url
+            leads_tech_params_url = build_leads_tech_url(leads_tech_url, leads_tech_params)
             
             logger.info(f"🔗 [Leads.Tech] Отправляем в leads.tech: {leads_tech_params_url}")
             
-            leads_tech_response = requests.get(
-                leads_tech_params_url,
-                timeout=10,
-                headers={
-                    'User-Agent': data.get('user_agent', ''),
-                    'Referer': data.get('referrer', ''),
-                }
-            )
+            with observe_upstream('leads_tech'):
+                leads_tech_response = requests.get(
+                    leads_tech_params_url,
+                    timeout=10,
+                    headers=leads_tech_request_headers(data)
+                )
             
             if leads_tech_response.status_code == 200:
                 logger.info(f"✅ [Leads.Tech] Успешно отправлено: {leads_tech_response.status_code}")
@@ -885,24 +805,7 @@ def send_to_leads_tech(request):
             logger.error(f"⚠️ [Leads.Tech] Ошибка соединения: {leads_error}")
         
         # Сохраняем в UTMTracking для аналитики
-        utm_tracking = UTMTracking.objects.create(
-            user_id=str(data.get('user_id', '')),
-            utm_source=data.get('utm_source', ''),
-            utm_medium=data.get('utm_medium', ''),
-            utm_campaign=data.get('utm_campaign', ''),
-            utm_content=data.get('utm_content', ''),
-            utm_term=data.get('utm_term', ''),
-            vk_ad_id=data.get('vk_ad_id', ''),
-            vk_ref=data.get('vk_ref', ''),
-            vk_ref_source=data.get('vk_ref_source', ''),
-            vk_platform=data.get('vk_platform', ''),
-            url=data.get('url', ''),
-            referrer=data.get('referrer', ''),
-            user_agent=data.get('user_agent', ''),
-            full_utm_data=data,
-            full_user_data=data,
-            event_type='arbitrage_send'
-        )
+        utm_tracking = create_tracking(build_arbitrage_tracking(data))
         
         logger.info(f"✅ [Leads.Tech] Сохранено в UTMTracking с ID: {utm_tracking.id}")
         
@@ -921,4 +824,99 @@ def send_to_leads_tech(request):
         return Response({
             'success': False,
             'error': 'Internal Server Error'
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+@query_budget(queries=22)
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@ratelimit(key='ip', rate='100/h', method='POST')
+def session_bootstrap(request):
+    """
+    Запуск Mini App одним запросом вместо users/register, users/status,
+    utm-track, arbitrage/send-to-leads-tech и mfos
+    
+    Ожидаемые данные:
+    {
+        "user_data": {"id": 123456789, "first_name": "Иван", ...},
+        "utm_params": {"utm_source": "vk_ads", ...},
+        "url": "...", "referrer": "...", "user_agent": "...",
+        "arbitrage": {"offer_id": 1, "s4": "...", ...},  # необязательно
+        "catalog": {"amount": 10000, "term": 14, "sort": "rate"}  # необязательно, как у /api/mfos/
+    }
+    
+    Регистрация, UTM трекинг и запись арбитража выполняются в одной транзакции,
+    постбэк в leads.tech отправляется в фоне после коммита.
+    """
+    try:
+        data = request.data
+        user_data = data.get('user_data', {})
+        utm_params = data.get('utm_params', {})
+        arbitrage_data = data.get('arbitrage')
+        catalog_query = parse_catalog_query(data.get('catalog') or {})
+        
+        arbitrage = None
+        
+        with transaction.atomic():
+            user = register_or_update_user(user_data, utm_params)
+            utm_tracking = create_tracking(build_utm_tracking(data))
+            
+            if arbitrage_data:
+                leads_tech_params = build_leads_tech_params(arbitrage_data)
+                
+                offer_id = arbitrage_data.get('offer_id')
+                base_url = None
+                if offer_id:
+                    base_url = MFO.objects.filter(id=offer_id).values_list('link', flat=True).first()
+                leads_tech_url = build_leads_tech_url(base_url or settings.LEADS_TECH_FALLBACK_URL, leads_tech_params)
+                
+                arbitrage_tracking = create_tracking(build_arbitrage_tracking(arbitrage_data))
+                enqueue_leads_tech_postback(leads_tech_url, leads_tech_request_headers(arbitrage_data))
+                
+                arbitrage = {
+                    'tracking_id': arbitrage_tracking.id,
+                    'leads_tech_params': leads_tech_params,
+                    'leads_tech_url': leads_tech_url,
+                }
+        
+        if catalog_query is not None:
+            mfos = query_catalog(get_catalog_index(), catalog_query)
+        else:
+            mfos = get_catalog()
+        
+        return Response({
+            'success': True,
+            'user': {
+                'id': user.id,
+                'vk_user_id': user.vk_user_id,
+                'first_name': user.first_name,
+                'last_name': user.last_name,
+                'notifications_enabled': user.notifications_enabled,
+                'notifications_allowed': user.notifications_allowed,
+                'total_visits': user.total_visits,
+                'first_visit': user.first_visit.isoformat(),
+                'last_visit': user.last_visit.isoformat(),
+            },
+            'tracking_id': utm_tracking.id,
+            'arbitrage': arbitrage,
+            'mfos': mfos,
+        })
+        
+    except Exception as e:
+        logger.exception("Непредвиденная ошибка в session_bootstrap")
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+def metrics(request):
+    """
+    Метрики производительности в формате Prometheus
+
+    Если задан METRICS_TOKEN, нужен заголовок Authorization: Bearer <token>
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
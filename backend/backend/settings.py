@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os # Убедимся, что os импортирован
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Метрики производительности (/metrics) - первым, чтобы учитывать весь стек
+    'api.middleware.MetricsMiddleware',
+    # Бюджеты SQL запросов (@query_budget в api/views.py)
+    'api.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     # Добавляем middleware для CORS
@@ -52,6 +57,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Профилирование запросов по требованию сотрудников (PROFILING_ENABLED)
+    'api.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,6 +81,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
+
+# Асинхронные версии представлений с внешними запросами (mfo_list, send_to_leads_tech).
+# Включать при запуске под ASGI: gunicorn -k uvicorn.workers.UvicornWorker backend.asgi:application
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS', '') == 'True'
 
 
 # Database
@@ -88,9 +100,29 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD', 'change_this_password'),
         'HOST': os.environ.get('DB_HOST', 'db'),
         'PORT': os.environ.get('DB_PORT', '5432'),
+        # Переиспользуем соединение между запросами вместо переподключения на каждый запрос
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        # Перед повторным использованием соединение проверяется, "мертвые" соединения отбрасываются
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
     }
 }
 
+# Пул соединений psycopg 3 (требует пакет psycopg[binary,pool]).
+# Несовместим с постоянными соединениями, поэтому CONN_MAX_AGE сбрасывается в 0.
+if os.environ.get('DB_POOL', '') == 'True':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+        'timeout': int(os.environ.get('DB_POOL_TIMEOUT', '10')),
+    }
+
+# Подключение через pgbouncer (docker-compose --profile pgbouncer, DB_HOST=pgbouncer, DB_PORT=6432).
+# В режиме transaction pooling серверные курсоры не поддерживаются.
+if os.environ.get('DB_PGBOUNCER', '') == 'True':
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -146,10 +178,135 @@ CSRF_TRUSTED_ORIGINS = [
     'https://www.bodyexp.ru',
 ]
 
+# Кэш (используется для статистики и rate limiting)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'babkimanki',
+    },
+    # Общий для всех процессов и воркеров gunicorn кэш (таблица в базе, создается миграцией
+    # 0019_shared_cache_table): значения и блокировки, которые должны видеть все процессы
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_shared_cache',
+    },
+}
+
+# Время жизни кэша статистики пользователей (секунды)
+USERS_STATS_CACHE_TTL = int(os.environ.get('USERS_STATS_CACHE_TTL', '60'))
+
+# Время жизни кэша списков значений для фильтров админки (город, UTM Source и т.п.)
+ADMIN_FACET_CACHE_TTL = int(os.environ.get('ADMIN_FACET_CACHE_TTL', '3600'))
+
+# Индекс аудитории пушей (api/segments.py): как часто дочитывать измененных пользователей,
+# как часто строить заново (учитывает удаления) и размер порции чтения
+SEGMENT_INDEX_REFRESH_INTERVAL = int(os.environ.get('SEGMENT_INDEX_REFRESH_INTERVAL', '10'))
+SEGMENT_INDEX_REBUILD_INTERVAL = int(os.environ.get('SEGMENT_INDEX_REBUILD_INTERVAL', '3600'))
+SEGMENT_INDEX_CHUNK_SIZE = int(os.environ.get('SEGMENT_INDEX_CHUNK_SIZE', '20000'))
+# Снимок индекса, который пишет команда build_segment_index (cron) и читают воркеры,
+# и загружать ли индекс в фоне сразу после запуска воркера (gunicorn.conf.py)
+SEGMENT_INDEX_PATH = os.environ.get('SEGMENT_INDEX_PATH', os.path.join(BASE_DIR, 'segment_index.npz'))
+SEGMENT_INDEX_WARMUP = os.environ.get('SEGMENT_INDEX_WARMUP', 'True') == 'True'
+
+# Метрики производительности: токен для /metrics (пусто - без проверки)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Общий каталог метрик воркеров (задает gunicorn.conf.py; пусто - /metrics отдает только свой процесс)
+# и как часто процесс записывает туда свои значения (секунды)
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+
+# Бюджеты SQL запросов представлений: raise - исключение (dev, тесты), log - предупреждение с EXPLAIN, off
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'raise' if DEBUG else 'log')
+
+# Профилирование запросов по требованию (?_profile=1 для staff или заголовок X-Profile-Token)
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'False') == 'True'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '2'))
+PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', '3600'))
+
+# Сжатие исходных данных UTM событий (zlib)
+UTM_PAYLOAD_COMPRESSION = os.environ.get('UTM_PAYLOAD_COMPRESSION', 'True') == 'True'
+
+# Выгрузки (api/exports.py): строк за одно чтение из серверного курсора
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '2000'))
+
+# Доля успешных отправок пушей, попадающих в лог (ошибки логируются всегда)
+PUSH_LOG_SAMPLE_RATE = float(os.environ.get('PUSH_LOG_SAMPLE_RATE', '0.01'))
+
+# Лимиты частоты пушей для уведомлений без своих значений (api/capping.py), 0 - без ограничения:
+# не чаще раза в N часов и не больше N пушей за сутки
+PUSH_CAP_INTERVAL_HOURS = int(os.environ.get('PUSH_CAP_INTERVAL_HOURS', '0'))
+PUSH_CAP_PER_DAY = int(os.environ.get('PUSH_CAP_PER_DAY', '0'))
+
+# Отправка пушей (api/services.py): получателей за одно чтение из базы и сколько получателей
+# с еще не набранным до 100 ID текстом (персонализация) можно держать в ожидании общего вызова VK
+PUSH_SEND_BATCH_SIZE = int(os.environ.get('PUSH_SEND_BATCH_SIZE', '1000'))
+PUSH_GROUP_BUFFER = int(os.environ.get('PUSH_GROUP_BUFFER', '20000'))
+
+# Замедление равномерной отправки пушей (api/pacing.py): процесс отправки раз в PUSH_PACE_PROBE_INTERVAL
+# секунд запрашивает PUSH_PACE_PROBE_URL и снижает скорость, пока p95 ответа выше PUSH_PACE_LATENCY_TARGET_MS
+PUSH_PACE_PROBE_URL = os.environ.get('PUSH_PACE_PROBE_URL', 'http://127.0.0.1:8000/api/mfos/')
+PUSH_PACE_PROBE_INTERVAL = float(os.environ.get('PUSH_PACE_PROBE_INTERVAL', '5'))
+PUSH_PACE_PROBE_TIMEOUT = float(os.environ.get('PUSH_PACE_PROBE_TIMEOUT', '5'))
+PUSH_PACE_LATENCY_TARGET_MS = int(os.environ.get('PUSH_PACE_LATENCY_TARGET_MS', '500'))
+
+# Повторная отправка пушей с временными ошибками (api/retries.py): строк за порцию, попыток на получателя,
+# проходов за вызов и начальная пауза после ограничения частоты VK (секунды, удваивается)
+PUSH_RETRY_BATCH_SIZE = int(os.environ.get('PUSH_RETRY_BATCH_SIZE', '1000'))
+PUSH_RETRY_MAX_ATTEMPTS = int(os.environ.get('PUSH_RETRY_MAX_ATTEMPTS', '5'))
+PUSH_RETRY_ROUNDS = int(os.environ.get('PUSH_RETRY_ROUNDS', '3'))
+PUSH_RETRY_BACKOFF = float(os.environ.get('PUSH_RETRY_BACKOFF', '1'))
+
+# Как часто процесс проверяет версию каталога МФО в базе (секунды)
+CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', '60'))
+
+# Интервал синхронизации каталога с витринами партнеров (sync_mfo_catalog --loop), секунды
+CATALOG_SYNC_INTERVAL = int(os.environ.get('CATALOG_SYNC_INTERVAL', '300'))
+
+# Источник офферов пропускается после стольких ошибок подряд на CATALOG_FEED_RETRY_AFTER секунд
+CATALOG_FEED_FAILURE_THRESHOLD = int(os.environ.get('CATALOG_FEED_FAILURE_THRESHOLD', '3'))
+CATALOG_FEED_RETRY_AFTER = int(os.environ.get('CATALOG_FEED_RETRY_AFTER', '900'))
+
+# Локальные копии логотипов МФО (api/logos.py): каталог в общем volume со статикой,
+# отдается nginx как /static/logos/ с Cache-Control immutable
+LOGO_CACHE_ENABLED = os.environ.get('LOGO_CACHE_ENABLED', 'True') == 'True'
+LOGO_CACHE_DIR = os.environ.get('LOGO_CACHE_DIR', os.path.join(STATIC_ROOT, 'logos'))
+LOGO_CACHE_URL = os.environ.get('LOGO_CACHE_URL', '/static/logos/')
+# Одновременных загрузок логотипов и таймаут одной загрузки (секунды)
+LOGO_CACHE_CONCURRENCY = int(os.environ.get('LOGO_CACHE_CONCURRENCY', '8'))
+LOGO_CACHE_TIMEOUT = int(os.environ.get('LOGO_CACHE_TIMEOUT', '10'))
+
+# Количество потоков для фоновой отправки постбэков в leads.tech
+POSTBACK_WORKERS = int(os.environ.get('POSTBACK_WORKERS', '4'))
+
+# Rate limiting (django-ratelimit). Отключать только на стендах для нагрузочных тестов
+RATELIMIT_ENABLE = os.environ.get('RATELIMIT_ENABLE', 'True') == 'True'
+
 # VK Mini App Settings
 VK_APP_ACCESS_TOKEN = os.environ.get('VK_APP_ACCESS_TOKEN', '')
 VK_APP_ID = os.environ.get('VK_APP_ID', '')
 
+# Адреса партнеров. Для замеров без сети их можно направить на локальные заглушки:
+#   python manage.py run_partner_stubs --port 8090
+#   VK_API_BASE_URL=http://localhost:8090/method
+#   ITFINANCE_FEED_URL=http://localhost:8090/itfinance/v1/website-shopwindow-offers
+#   LEADS_TECH_BASE_URL_OVERRIDE=http://localhost:8090/leads-tech
+VK_API_BASE_URL = os.environ.get('VK_API_BASE_URL', 'https://api.vk.com/method')
+ITFINANCE_FEED_URL = os.environ.get(
+    'ITFINANCE_FEED_URL',
+    'https://api.we.itfinance.online/v1/website-shopwindow-offers?website_id=4228&shopwindow_type=of-list-suc',
+)
+
+# Источники офферов каталога МФО (api/feeds.py), JSON список, например:
+#   CATALOG_FEED_SOURCES='[{"name": "itfinance", "url": "...", "priority": 1, "timeout": 10},
+#                          {"name": "itfinance_cards", "url": "...&shopwindow_type=cards", "priority": 2, "timeout": 5}]'
+# По умолчанию - одна витрина ITFINANCE_FEED_URL
+CATALOG_FEED_SOURCES = json.loads(os.environ.get('CATALOG_FEED_SOURCES') or 'null') or [
+    {'name': 'itfinance', 'url': ITFINANCE_FEED_URL, 'parser': 'itfinance', 'priority': 1, 'timeout': 10},
+]
+LEADS_TECH_FALLBACK_URL = os.environ.get('LEADS_TECH_FALLBACK_URL', 'https://безотказа.бабкиманки.рф/Eg5hd')
+LEADS_TECH_BASE_URL_OVERRIDE = os.environ.get('LEADS_TECH_BASE_URL_OVERRIDE', '')
+
 # Sentry Configuration for Error Monitoring
 SENTRY_DSN = os.environ.get('SENTRY_DSN', '')
 if SENTRY_DSN and not DEBUG:
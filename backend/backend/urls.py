@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from api.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')), # Подключаем URL-ы нашего приложения api
+    path('metrics', metrics, name='metrics'), # Метрики Prometheus (не проксируется nginx наружу)
 ]
@@ -0,0 +1,97 @@
+"""
+Конфигурация Gunicorn для продакшена
+
+Gunicorn подхватывает этот файл автоматически при запуске из /app.
+Все значения можно переопределить переменными окружения GUNICORN_*.
+"""
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+logger = logging.getLogger('gunicorn.error')
+
+_started_at = time.monotonic()
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Sync воркеры при threads > 1 автоматически становятся gthread.
+# Для ASGI: GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+workers = _env_int('GUNICORN_WORKERS', min(cpu_count * 2 + 1, 9))
+threads = _env_int('GUNICORN_THREADS', 4 if worker_class in ('sync', 'gthread') else 1)
+
+# Код приложения импортируется один раз в мастере и разделяется
+# воркерами copy-on-write: быстрее старт и меньше RSS на воркер
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True') == 'True'
+
+# Перезапуск воркеров для защиты от утечек памяти
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 2000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 200)
+
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def _rss_mb():
+    """
+    Текущий RSS процесса в МБ (с учетом страниц, общих с мастером)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        # ru_maxrss в Linux возвращается в килобайтах
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Каталог, через который /metrics собирает значения всех воркеров (api/metrics.py)
+metrics_dir = os.environ.setdefault('METRICS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'api_metrics'))
+
+
+def on_starting(server):
+    # Метрики считаются с запуска мастера, файлы прошлого запуска удаляются
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    logger.info(
+        "🚀 Gunicorn готов за %.2f с: workers=%s, threads=%s, worker_class=%s, preload=%s, RSS мастера=%.1f МБ",
+        time.monotonic() - _started_at, workers, threads, worker_class, preload_app, _rss_mb(),
+    )
+
+
+def post_worker_init(worker):
+    logger.info("👷 Воркер %s запущен, RSS=%.1f МБ", worker.pid, _rss_mb())
+    # Индекс аудитории пушей грузится в фоновом потоке воркера, а не в первом запросе
+    from django.conf import settings
+    if settings.SEGMENT_INDEX_WARMUP:
+        from api.segments import start_segment_index
+        start_segment_index()
+
+
+def worker_exit(server, worker):
+    from api.metrics import STORE
+    STORE.flush()
+
+
+def child_exit(server, worker):
+    # Значения завершившегося воркера остаются в сумме (перезапуск по max_requests)
+    from api.metrics import archive_process
+    archive_process(metrics_dir, worker.pid)